@@ -0,0 +1,249 @@
+"""Benchmarks of the hot paths of the repo, run on fixed workloads so that their results can be
+compared across commits. Results are written as JSON:
+
+    python benchmarks/run_benchmarks.py run results.json
+    python benchmarks/run_benchmarks.py compare baseline.json results.json
+
+The comparison exits with an error when any benchmark is slower than the baseline by more than
+the threshold given, so it can guard the hot paths before changes reach long sweeps.
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+import click
+import click.testing
+import numpy as np
+import scipy
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.ap_restitution import ap_restitution
+from cardiac_cells_py.experiments.protocols import run_model
+from cardiac_cells_py.experiments.steady_state import steady_state
+
+# Workloads of the benchmarks. Changing them makes results incomparable with older ones.
+CELL_MODEL = "minimal_model"
+CELL_TYPES = ["endo", "epi", "m"]
+# Number of cells in the array state of the RHS benchmark
+NUM_CELLS = 1000
+# Beats solved to time run_model
+NUM_BEATS = 5
+CYCLE_LENGTH = 1000
+# Beats solved to measure the peak memory of long pacing runs. Memory is traced with tracemalloc,
+# which slows the run down considerably
+LONG_RUN_BEATS = 20
+# Arguments of the end to end commands, which are followed by OUTDIR
+STEADY_STATE_ARGS = [CELL_MODEL, "epi", "20", str(CYCLE_LENGTH)]
+AP_RESTITUTION_ARGS = [CELL_MODEL, "epi", "50", "400", "50"]
+# Commands run in a fresh interpreter to time the start up of the command line
+IMPORT_COMMANDS = {
+    "cli_import_s": ["-c", "import cardiac_cells_py.experiments.experiments"],
+    "cli_help_s": ["-m", "cardiac_cells_py.experiments.experiments", "--help"],
+}
+
+
+def best_time(function: Callable[[], Any], number: int, repeat: int) -> float:
+    """Best time, in seconds, of a call to :param function: over :param repeat: measurements of
+    :param number: calls each."""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress bars and messages of the experiments."""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def bench_rhs(repeat: int) -> Dict[str, float]:
+    """Calls per second of the derivative of the model for a single cell and for NUM_CELLS cells,
+    for which cells per second are reported as well."""
+    model = CellModels[CELL_MODEL.upper()].create()
+    params = model.parameters(cell_type="epi")
+    scalar_state = model.INITIAL_CONDITIONS.copy()
+    array_state = np.repeat(scalar_state[:, np.newaxis], NUM_CELLS, axis=1)
+    array_params = model.stack_parameters([params]*NUM_CELLS)
+    scalar_time = best_time(
+        lambda: model.cell_model(0., scalar_state, params, True), number=2000, repeat=repeat
+    )
+    array_time = best_time(
+        lambda: model.cell_model(0., array_state, array_params, True), number=200, repeat=repeat
+    )
+    return {
+        "rhs_scalar_calls_per_s": 1 / scalar_time,
+        "rhs_array_calls_per_s": 1 / array_time,
+        "rhs_array_cells_per_s": NUM_CELLS / array_time,
+    }
+
+
+def bench_run_model(repeat: int) -> Dict[str, float]:
+    """Wall time per beat of run_model for each of CELL_TYPES."""
+    model = CellModels[CELL_MODEL.upper()].create()
+    results = {}
+    for cell_type in CELL_TYPES:
+        def solve():
+            with quiet():
+                run_model(
+                    cell_model=model,
+                    num_cycles=NUM_BEATS,
+                    cycle_length=CYCLE_LENGTH,
+                    cell_type=cell_type,
+                )
+        results[f"run_model_s_per_beat_{cell_type}"] = (
+            best_time(solve, number=1, repeat=repeat) / NUM_BEATS
+        )
+    return results
+
+
+def bench_memory() -> Dict[str, float]:
+    """Peak memory, in MiB, allocated by a pacing run of LONG_RUN_BEATS keeping all the beats and
+    keeping only the last one."""
+    model = CellModels[CELL_MODEL.upper()].create()
+    results = {}
+    for keep in ("all", "last"):
+        tracemalloc.start()
+        with quiet():
+            run_model(
+                cell_model=model,
+                num_cycles=LONG_RUN_BEATS,
+                cycle_length=CYCLE_LENGTH,
+                cell_type="epi",
+                keep=keep,
+            )
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"long_run_peak_mib_keep_{keep}"] = peak / 2**20
+    return results
+
+
+def bench_commands(repeat: int) -> Dict[str, float]:
+    """Wall time of the end to end steady-state and ap-restitution commands, without cache."""
+    runner = click.testing.CliRunner()
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        commands: List[Tuple[str, click.Command, List[str]]] = [
+            ("steady_state", steady_state, [*STEADY_STATE_ARGS, outdir, "--no-cache"]),
+            ("ap_restitution", ap_restitution, [*AP_RESTITUTION_ARGS, outdir, "--no-cache"]),
+        ]
+        for name, command, args in commands:
+            def invoke():
+                result = runner.invoke(command, args, catch_exceptions=False)
+                if result.exit_code != 0:
+                    raise RuntimeError(f"{name} failed: {result.output}")
+            results[f"{name}_command_s"] = best_time(invoke, number=1, repeat=repeat)
+    return results
+
+
+def bench_import(repeat: int) -> Dict[str, float]:
+    """Wall time of importing the command line and of printing its help, each in a new Python
+    process, which is what every short job launched from a scheduler pays before doing any work.
+    """
+    results = {}
+    for name, args in IMPORT_COMMANDS.items():
+        def start():
+            subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+        results[name] = best_time(start, number=1, repeat=repeat)
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    """Description of the code and the machine that ran the benchmarks."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+@click.group()
+def benchmarks():
+    """Run the benchmarks of the repo and compare their results."""
+
+
+@benchmarks.command()
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--repeat",
+    default=3,
+    type=click.IntRange(min=1),
+    help="Number of times each benchmark is repeated, the best time is reported.",
+    show_default=True,
+)
+@click.option(
+    "--skip-commands",
+    is_flag=True,
+    help="Do not time the end to end commands, which take the longest.",
+)
+def run(output, repeat, skip_commands):
+    """Run the benchmarks and write their results to OUTPUT as JSON."""
+    results: Dict[str, float] = {}
+    stages = [
+        ("import", lambda: bench_import(repeat)),
+        ("RHS", lambda: bench_rhs(repeat)),
+        ("run_model", lambda: bench_run_model(repeat)),
+        ("memory", bench_memory),
+    ]
+    if not skip_commands:
+        stages.append(("commands", lambda: bench_commands(repeat)))
+    for name, stage in stages:
+        click.echo(f"Running {name} benchmarks", err=True)
+        results.update(stage())
+    with open(output, "w") as output_file:
+        json.dump({"environment": environment(), "results": results}, output_file, indent=2)
+    for name, value in results.items():
+        click.echo(f"{name}: {value:.6g}")
+
+
+@benchmarks.command()
+@click.argument("baseline", type=click.Path(exists=True, dir_okay=False))
+@click.argument("current", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    default=0.1,
+    type=float,
+    help="Relative change above which a benchmark counts as a regression.",
+    show_default=True,
+)
+def compare(baseline, current, threshold):
+    """Compare the results in CURRENT with those in BASELINE and fail on regressions."""
+    with open(baseline) as baseline_file, open(current) as current_file:
+        old = json.load(baseline_file)["results"]
+        new = json.load(current_file)["results"]
+    regressions = []
+    for name in sorted(set(old) & set(new)):
+        # Rates are better when higher, times and memory when lower
+        change = new[name] / old[name] - 1
+        worse = -change if name.endswith("_per_s") else change
+        flag = "REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        click.echo(f"{name}: {old[name]:.6g} -> {new[name]:.6g} ({change:+.1%}) {flag}")
+    if regressions:
+        raise click.ClickException(f"{len(regressions)} benchmarks regressed")
+
+
+if __name__ == "__main__":
+    benchmarks()
@@ -1,13 +1,68 @@
 """Initialise the cell models module"""
 import enum
-from typing import Union
+import functools
+import importlib
+from typing import Any, Type
+
+from .cell_model import CellModel
+
+
+class LazyModelClass:
+    """Class of a cell model given by its location, "module:ClassName", which is only imported
+    when the model is used. It stands in for the class itself: calling it constructs the model and
+    its attributes are those of the class."""
+    def __init__(self, location: str):
+        self.location = location
+
+    def resolve(self) -> Type[CellModel]:
+        """The class of the cell model, imported on first use."""
+        return _import_class(self.location)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> CellModel:
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found on the stand in, e.g. STATE_VARS_NAMES. Private
+        # and special names are not forwarded, so that inspecting it, e.g. by enum, or copying it
+        # does not import the model
+        if name.startswith("_") or name == "location":
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, LazyModelClass) and other.location == self.location
+
+    def __hash__(self) -> int:
+        return hash(self.location)
+
+    def __repr__(self) -> str:
+        return f"LazyModelClass({self.location!r})"
 
-from .minimal_model.model import MinimalModel
 
 class CellModels(enum.Enum):
-    """Factory to obtain cell models."""
-    MINIMAL_MODEL = MinimalModel
+    """Factory to obtain cell models. Each model is registered by the location of its class, which
+    is only imported when the model is used, so listing the models stays cheap however many there
+    are. CellModels.X.value() still constructs the model, as when the classes were registered."""
+    MINIMAL_MODEL = LazyModelClass("cardiac_cells_py.cell_models.minimal_model.model:MinimalModel")
+    MINIMAL_MODEL_LUT = LazyModelClass(
+        "cardiac_cells_py.cell_models.minimal_model.model:MinimalModelLUT"
+    )
 
     @classmethod
     def valid_models(cls):
         return cls._member_names_
+
+    def model_class(self) -> Type[CellModel]:
+        """Class of the cell model, imported on first use."""
+        return self.value.resolve()
+
+    def create(self) -> CellModel:
+        """Construct an instance of the cell model."""
+        return self.model_class()()
+
+
+@functools.lru_cache(maxsize=None)
+def _import_class(location: str) -> Type[CellModel]:
+    """Class at :param location:, given as "module:ClassName"."""
+    module_name, class_name = location.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
@@ -2,11 +2,13 @@
 in the experiments assume that every model will have these attributes.
 """
 import abc
-from typing import Any, List
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
 import numpy as np
 import numpy.typing as npt
 
+from cardiac_cells_py.cell_models.stimulus import AnyStimulus, Stimulus
+
 class CellModel(abc.ABC):
     """General interface to define a cell model."""
     # Initial conditions to start solving the PDEs
@@ -17,6 +19,17 @@ class CellModel(abc.ABC):
     STATE_VARS_NAMES: List[str]
     # Names of the cuurrents in the order that they are returned
     CURRENTS_NAMES: List[str]
+    # Stimulus applied at the start of every cycle unless another one is requested
+    STIMULUS: Stimulus
+    # Indices of the state variables that are gates, i.e. that follow dx/dt = (x_inf - x)/tau.
+    # Models that define them can be solved with the Rush-Larsen integrator.
+    GATE_INDICES: List[int] = []
+    # Boolean matrix marking the entries of the jacobian that can be non-zero, if known
+    JACOBIAN_SPARSITY: Optional[npt.NDArray[np.bool_]] = None
+    # Parameters that divide each of the currents, by name in CURRENTS_NAMES, e.g. their time
+    # constants. Models that define them can have a fraction of those currents blocked, see
+    # :meth:`block_currents`.
+    CURRENT_TIME_CONSTANTS: Dict[str, List[str]] = {}
 
     def __init__(self):
         """Construct an instance of a cell model."""
@@ -37,17 +50,129 @@ class CellModel(abc.ABC):
         state_vars: npt.NDArray[np.float_],
         params: Any,
         ret_ode: bool,
+        stimulus: Optional[AnyStimulus] = None,
+        out: Optional[npt.NDArray[np.float_]] = None,
+        workspace: Any = None,
     ) -> npt.NDArray[np.float_]:
         """Differential equations that define the cell model. The definition of this function
         matches what is required by scipy's solvers.
         :param t: time
         :param state_vars: state variables for the model provided as required by SciPy's solvers.
-        :param params: parameters for the model.
+        Any trailing dimensions after the first one are treated as independent cells.
+        :param params: parameters for the model, or stacked parameters as returned by
+        :meth:`stack_parameters` when solving for several cells at once.
         :param ret_ode: whether to return the derivative of the state variables or the ionic
         currents.
+        :param stimulus: stimulus applied to the cell, defaults to STIMULUS.
+        :param out: buffer with the shape of :param state_vars: in which the derivative of the
+        state variables is written when :param ret_ode: is set, so that integrators can reuse it
+        between calls. The value returned is then a view of it.
+        :param workspace: scratch arrays returned by :meth:`workspace` for the cells of
+        :param state_vars:, used together with :param out:. They belong to the caller, e.g. a
+        single solver, so calls that do not share them can run concurrently.
         :returns: either the derivative of the state variables or the ionic currents.
         """
 
+    @staticmethod
+    def workspace(shape: Tuple[int, ...]) -> Any:
+        """Scratch arrays used by cell_model to write the derivative of cells of :param shape:
+        (i.e. the shape of the state variables without their first axis) into a buffer without
+        allocating, or None if the model does not need any."""
+        return None
+
+    @staticmethod
+    def jacobian(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: Any,
+    ) -> npt.NDArray[np.float_]:
+        """Jacobian of the derivative of the state variables with respect to the state variables,
+        used by implicit solvers. Arguments are the same as for :meth:`cell_model`.
+        :returns: the jacobian, with shape (..., num_state_vars, num_state_vars) where ... are the
+        trailing dimensions of :param state_vars:.
+        """
+        raise NotImplementedError("The model does not define its jacobian.")
+
+    @classmethod
+    def has_jacobian(cls) -> bool:
+        """Whether the model implements an analytic jacobian."""
+        return cls.jacobian is not CellModel.jacobian
+
+    @staticmethod
+    def gate_dynamics(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: Any,
+    ) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.float_]]:
+        """Steady state and time constant of the gating variables, in the order given by
+        GATE_INDICES. Arguments are the same as for :meth:`cell_model`.
+        :returns: tuple with the steady state values and the time constants of the gates.
+        """
+        raise NotImplementedError("The model does not define the dynamics of its gates.")
+
+    @staticmethod
+    def scalar_cell_model(
+        state_vars: npt.NDArray[np.float_],
+        params: npt.NDArray[np.float_],
+        stimulus_current: float,
+        out: npt.NDArray[np.float_],
+    ) -> None:
+        """Derivative of the state variables of a single cell, written into :param out:. Models
+        opt into the JIT backend (see experiments.jit) by implementing it, together with
+        :meth:`scalar_gate_dynamics` if they define GATE_INDICES, using only scalar arithmetic and
+        math functions so that it can be compiled.
+        :param state_vars: state variables of the cell, with shape (num_state_vars,).
+        :param params: parameters of the cell as a float array, in the order of their fields.
+        :param stimulus_current: stimulus current applied to the cell.
+        """
+        raise NotImplementedError("The model does not define a scalar kernel.")
+
+    @staticmethod
+    def scalar_gate_dynamics(
+        state_vars: npt.NDArray[np.float_],
+        params: npt.NDArray[np.float_],
+        x_inf: npt.NDArray[np.float_],
+        tau: npt.NDArray[np.float_],
+    ) -> None:
+        """Steady state and time constant of the gates of a single cell, written into
+        :param x_inf: and :param tau: in the order given by GATE_INDICES. Arguments are the same as
+        for :meth:`scalar_cell_model`.
+        """
+        raise NotImplementedError("The model does not define a scalar kernel for its gates.")
+
+    @classmethod
+    def has_scalar_kernel(cls) -> bool:
+        """Whether the model implements the scalar kernels used by the JIT backend."""
+        return cls.scalar_cell_model is not CellModel.scalar_cell_model and (
+            not cls.GATE_INDICES or cls.scalar_gate_dynamics is not CellModel.scalar_gate_dynamics
+        )
+
+    @classmethod
+    def block_currents(cls, params: Any, block: Mapping[str, float]) -> Any:
+        """Parameters :param params: with a fraction of each of the currents in :param block:
+        blocked, e.g. by a drug, by dividing the current by 1 - fraction. Only currents in
+        CURRENT_TIME_CONSTANTS can be blocked and fractions must be in [0, 1).
+        """
+        replacements: Dict[str, float] = {}
+        for current, fraction in block.items():
+            if current not in cls.CURRENT_TIME_CONSTANTS:
+                raise ValueError(f"Current ({current}) cannot be blocked")
+            if not 0 <= fraction < 1:
+                raise ValueError(f"Block fraction ({fraction}) must be in [0, 1)")
+            for name in cls.CURRENT_TIME_CONSTANTS[current]:
+                replacements[name] = replacements.get(name, getattr(params, name)) / (1 - fraction)
+        return params._replace(**replacements)
+
+    @staticmethod
+    def stack_parameters(params: Sequence[Any]) -> Any:
+        """Combine a sequence of parameter sets into a single parameter set whose fields are arrays
+        with one entry per cell, so that :meth:`cell_model` can be evaluated for a population of
+        cells at once. The default implementation works for parameters defined as NamedTuples.
+        """
+        return type(params[0])(
+            *(np.asarray(field, dtype=np.float_) for field in zip(*params))
+        )
+
     def rescale_ap(
         self,
         state_vars: npt.NDArray[np.float_],
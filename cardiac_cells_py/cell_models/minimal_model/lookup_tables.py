@@ -0,0 +1,64 @@
+"""Lookup tables for the smooth voltage dependent terms of the minimal model. Each of the terms is
+an affine function of the sigmoid (1 + tanh(x)) / 2 at x = kappa * (u - u0), so a single table of
+the sigmoid on a fine grid of x serves every term and every parameter set. The parameters only
+enter through the affine maps, which are evaluated per cell, so populations whose parameters
+differ share the table and the memory used does not grow with the number of parameter sets.
+"""
+import functools
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from .utils import MMParams
+
+# Range and resolution of the grid of x. Values of x outside of the range use the closest entry,
+# the sigmoid has saturated to within 1e-17 at its ends.
+X_MIN = -20.
+X_MAX = 20.
+X_STEP = 5e-4
+# Terms interpolated from the table, in order
+TABLE_TERMS = ["tau_w_minus", "tau_so", "s_inf"]
+
+
+@functools.lru_cache(maxsize=1)
+def sigmoid_table() -> npt.NDArray[np.float_]:
+    """The sigmoid (1 + tanh(x)) / 2 on the grid of x, built on first use."""
+    x = np.linspace(X_MIN, X_MAX, int(round((X_MAX - X_MIN) / X_STEP)) + 1)
+    return (1+np.tanh(x))/2
+
+
+def interpolate_sigmoid(x: npt.NDArray[np.float_]) -> npt.NDArray[np.float_]:
+    """Linearly interpolate the sigmoid (1 + tanh(x)) / 2 at :param x: from the table."""
+    table = sigmoid_table()
+    position = np.clip((x - X_MIN) / X_STEP, 0, len(table) - 1)
+    lower = np.minimum(position.astype(np.int_), len(table) - 2)
+    below = table[lower]
+    return below + (position - lower)*(table[lower + 1] - below)
+
+
+class LookupTable(NamedTuple):
+    """Tuple mapping the tabulated sigmoid onto the terms of one or more parameter sets."""
+    # Parameters of a single cell or, as returned by stack_parameters, of a population of cells
+    params: MMParams
+
+    def interpolate(self, u: npt.NDArray[np.float_]) -> npt.NDArray[np.float_]:
+        """Interpolate the terms in TABLE_TERMS at :param u:, returning an array with the terms
+        along the first axis followed by the shape of u."""
+        params = self.params
+        return np.array([
+            params.tau_w1 + (params.tau_w2 - params.tau_w1)*interpolate_sigmoid(
+                params.kappa_w*(u - params.u_w)
+            ),
+            params.tau_so1 + (params.tau_so2 - params.tau_so1)*interpolate_sigmoid(
+                params.kappa_so*(u - params.u_so)
+            ),
+            interpolate_sigmoid(params.kappa_s*(u - params.u_s)),
+        ])
+
+
+def lookup_table(params: MMParams) -> LookupTable:
+    """Return the lookup table for :param params:, which may hold a single parameter set or a
+    population of them as returned by stack_parameters. All parameter sets share the table of the
+    sigmoid, which is built once."""
+    return LookupTable(params=params)
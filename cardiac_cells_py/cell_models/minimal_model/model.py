@@ -6,15 +6,22 @@ action potentials in tissue. Journal of theoretical biology, 253(3), 544-560.
 The model can be used to reproduce ventricular action potentials of the three different ventricular
 cell types (epi, endo, m) or to reproduce other models.
 """
-from typing import NamedTuple
+import math
+from typing import NamedTuple, Optional, Tuple
 
 import numpy as np
 import numpy.typing as npt
 
 from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import AnyStimulus, Stimulus
 
+from .lookup_tables import lookup_table
 from .utils import MMParams, heaviside, get_model_parameters
 
+# Scratch arrays of MinimalModel.ode_kernel, see MinimalModel.workspace
+Workspace = Tuple[Tuple[npt.NDArray[np.float_], ...], Tuple[npt.NDArray[np.bool_], ...]]
+
+
 class MinimalModel(CellModel):
     """Implementation of the minimal model.
     """
@@ -22,6 +29,31 @@ class MinimalModel(CellModel):
     CURRENTS_NAMES = ["Jfi", "Jso", "Jsi", "Jstim"]
     INITIAL_CONDITIONS = np.array([0., 1., 1., 0.])
     AP_INDEX = 0
+    STIMULUS = Stimulus(amplitude=0.4, duration=1.)
+    GATE_INDICES = [1, 2, 3]
+    JACOBIAN_SPARSITY = np.array([
+        [True, True, True, True],
+        [False, True, False, False],
+        [True, False, True, False],
+        [True, False, False, True],
+    ])
+    # Jso is (u - u_o)/tau_o below th_w and 1/tau_so above it, with tau_so between tau_so1 and
+    # tau_so2, so all four time constants are scaled to block it
+    CURRENT_TIME_CONSTANTS = {
+        "Jfi": ["tau_fi"],
+        "Jso": ["tau_o1", "tau_o2", "tau_so1", "tau_so2"],
+        "Jsi": ["tau_si"],
+    }
+
+    @staticmethod
+    def workspace(shape: Tuple[int, ...]) -> Workspace:
+        """Scratch arrays used by ode_kernel for cells of :param shape:."""
+        floats = np.empty((2, *shape))
+        bools = np.empty((5, *shape), dtype=np.bool_)
+        return (
+            tuple(floats[i, ...] for i in range(len(floats))),
+            tuple(bools[i, ...] for i in range(len(bools))),
+        )
 
     @staticmethod
     def parameters(cell_type: str) -> MMParams:
@@ -36,14 +68,256 @@ class MinimalModel(CellModel):
     ) -> npt.NDArray[np.float_]:
         return 85.7*state_vars[:, self.AP_INDEX] - 84
 
+    @staticmethod
+    def jacobian(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: MMParams,
+    ) -> npt.NDArray[np.float_]:
+        """Jacobian of the minimal model. The heaviside functions are treated as constants, so
+        their derivatives are taken to be zero away from the thresholds."""
+        u, v, w, s = state_vars
+        h_v = heaviside(u - params.th_v)
+        h_w = heaviside(u - params.th_w)
+        h_o = heaviside(u - params.th_o)
+
+        tau_v_minus = (
+            (1-heaviside(u-params.th_v_minus)) * params.tau_v1 +
+            heaviside(u - params.th_v_minus) * params.tau_v2
+        )
+        tanh_w = np.tanh(params.kappa_w*(u - params.u_w))
+        tau_w_minus = params.tau_w1 + (params.tau_w2 - params.tau_w1) * (1+tanh_w) / 2
+        dtau_w_minus = (params.tau_w2 - params.tau_w1) * params.kappa_w * (1 - tanh_w**2) / 2
+        tanh_so = np.tanh(params.kappa_so*(u-params.u_so))
+        tau_so = params.tau_so1 + (params.tau_so2 - params.tau_so1)*(1+tanh_so) / 2
+        dtau_so = (params.tau_so2 - params.tau_so1) * params.kappa_so * (1 - tanh_so**2) / 2
+        tau_s = (1 - h_w)*params.tau_s1 + h_w*params.tau_s2
+        tau_o = (1 - h_o)*params.tau_o1 + h_o*params.tau_o2
+        w_inf = (1 - h_o)*(1-u/params.tau_w_inf) + h_o*params.w_inf_star
+        dw_inf = -(1 - h_o)/params.tau_w_inf
+        tanh_s = np.tanh(params.kappa_s*(u-params.u_s))
+
+        dJfi_du = -v*h_v*(params.u_u + params.th_v - 2*u)/params.tau_fi
+        dJso_du = (1 - h_w)/tau_o - h_w*dtau_so/tau_so**2
+
+        jac = np.zeros((*np.shape(u), 4, 4))
+        jac[..., 0, 0] = -(dJfi_du + dJso_du)
+        jac[..., 0, 1] = h_v*(u-params.th_v)*(params.u_u-u)/params.tau_fi
+        jac[..., 0, 2] = h_w*s/params.tau_si
+        jac[..., 0, 3] = h_w*w/params.tau_si
+        jac[..., 1, 1] = -(1 - h_v)/tau_v_minus - h_v/params.tau_v
+        jac[..., 2, 0] = (
+            (1 - h_w)*(dw_inf*tau_w_minus - (w_inf - w)*dtau_w_minus) / tau_w_minus**2
+        )
+        jac[..., 2, 2] = -(1 - h_w)/tau_w_minus - h_w/params.tau_w
+        jac[..., 3, 0] = params.kappa_s*(1 - tanh_s**2)/(2*tau_s)
+        jac[..., 3, 3] = -1/tau_s
+        return jac
+
+    @staticmethod
+    def gate_dynamics(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: MMParams,
+    ) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.float_]]:
+        """Steady state and time constant of the gates v, w and s. Above their thresholds, v and w
+        decay to zero with time constants tau_v and tau_w respectively."""
+        u = state_vars[0]
+        h_v = heaviside(u - params.th_v)
+        h_w = heaviside(u - params.th_w)
+        h_o = heaviside(u - params.th_o)
+
+        tau_v_minus = (
+            (1-heaviside(u-params.th_v_minus)) * params.tau_v1 +
+            heaviside(u - params.th_v_minus) * params.tau_v2
+        )
+        tau_w_minus = (
+            params.tau_w1 +
+            (params.tau_w2 - params.tau_w1) * (1+np.tanh(params.kappa_w*(u - params.u_w))) / 2
+        )
+        tau_s = (1 - h_w)*params.tau_s1 + h_w*params.tau_s2
+        v_inf = u < params.th_v_minus
+        w_inf = (1 - h_o)*(1-u/params.tau_w_inf) + h_o*params.w_inf_star
+        s_inf = (1+np.tanh(params.kappa_s*(u-params.u_s)))/2
+
+        rate_v = (1 - h_v)/tau_v_minus + h_v/params.tau_v
+        rate_w = (1 - h_w)/tau_w_minus + h_w/params.tau_w
+        return (
+            np.array([
+                (1 - h_v)*v_inf/(tau_v_minus*rate_v),
+                (1 - h_w)*w_inf/(tau_w_minus*rate_w),
+                s_inf,
+            ]),
+            np.array([1/rate_v, 1/rate_w, tau_s]),
+        )
+
+    @staticmethod
+    def scalar_cell_model(
+        state_vars: npt.NDArray[np.float_],
+        params: npt.NDArray[np.float_],
+        stimulus_current: float,
+        out: npt.NDArray[np.float_],
+    ) -> None:
+        """Equations for the minimal model for a single cell, used by the JIT backend."""
+        (
+            u_o, u_u, th_v, th_w, th_v_minus, th_o, tau_v1, tau_v2, tau_v, tau_w1, tau_w2, kappa_w,
+            u_w, tau_w, tau_fi, tau_o1, tau_o2, tau_so1, tau_so2, kappa_so, u_so, tau_s1, tau_s2,
+            kappa_s, u_s, tau_si, tau_w_inf, w_inf_star,
+        ) = params
+        u, v, w, s = state_vars
+
+        tau_w_minus = tau_w1 + (tau_w2 - tau_w1) * (1+math.tanh(kappa_w*(u - u_w))) / 2
+        tau_so = tau_so1 + (tau_so2 - tau_so1)*(1+math.tanh(kappa_so*(u-u_so))) / 2
+        tau_v_minus = tau_v2 if u > th_v_minus else tau_v1
+        tau_s = tau_s2 if u > th_w else tau_s1
+        tau_o = tau_o2 if u > th_o else tau_o1
+        v_inf = 1. if u < th_v_minus else 0.
+        w_inf = w_inf_star if u > th_o else 1-u/tau_w_inf
+
+        Jfi = -v*(u-th_v)*(u_u-u)/tau_fi if u > th_v else 0.
+        Jso = 1/tau_so if u > th_w else (u-u_o)/tau_o
+        Jsi = -w*s/tau_si if u > th_w else 0.
+        out[0] = -(Jfi + Jso + Jsi) + stimulus_current
+        out[1] = -v/tau_v if u > th_v else (v_inf-v)/tau_v_minus
+        out[2] = -w/tau_w if u > th_w else (w_inf-w)/tau_w_minus
+        out[3] = ((1+math.tanh(kappa_s*(u-u_s)))/2 - s)/tau_s
+
+    @staticmethod
+    def scalar_gate_dynamics(
+        state_vars: npt.NDArray[np.float_],
+        params: npt.NDArray[np.float_],
+        x_inf: npt.NDArray[np.float_],
+        tau: npt.NDArray[np.float_],
+    ) -> None:
+        """Steady state and time constant of the gates v, w and s of a single cell, used by the JIT
+        backend."""
+        (
+            u_o, u_u, th_v, th_w, th_v_minus, th_o, tau_v1, tau_v2, tau_v, tau_w1, tau_w2, kappa_w,
+            u_w, tau_w, tau_fi, tau_o1, tau_o2, tau_so1, tau_so2, kappa_so, u_so, tau_s1, tau_s2,
+            kappa_s, u_s, tau_si, tau_w_inf, w_inf_star,
+        ) = params
+        u = state_vars[0]
+        if u > th_v:
+            x_inf[0], tau[0] = 0., tau_v
+        else:
+            x_inf[0] = 1. if u < th_v_minus else 0.
+            tau[0] = tau_v2 if u > th_v_minus else tau_v1
+        if u > th_w:
+            x_inf[1], tau[1] = 0., tau_w
+        else:
+            x_inf[1] = w_inf_star if u > th_o else 1-u/tau_w_inf
+            tau[1] = tau_w1 + (tau_w2 - tau_w1) * (1+math.tanh(kappa_w*(u - u_w))) / 2
+        x_inf[2] = (1+math.tanh(kappa_s*(u-u_s)))/2
+        tau[2] = tau_s2 if u > th_w else tau_s1
+
+    @staticmethod
+    def ode_kernel(
+        t: float,
+        state_vars: npt.NDArray[np.float_],
+        params: MMParams,
+        stimulus: Optional[AnyStimulus],
+        out: npt.NDArray[np.float_],
+        workspace: Optional[Workspace] = None,
+    ) -> npt.NDArray[np.float_]:
+        """Derivative of the state variables of the minimal model written into :param out:, which
+        has the shape of :param state_vars:. Each threshold is compared once and every
+        intermediate result is stored in the scratch arrays of :param workspace: (see workspace),
+        so no arrays are allocated when the caller reuses them between calls. Without them, new
+        scratch arrays are allocated for the call.
+        """
+        u, v, w, s = state_vars
+        # Indexing with an ellipsis keeps the rows of a single cell as arrays that can be written
+        du, dv, dw, ds = (out[i, ...] for i in range(4))
+        (tmp, tmp2), (above_v, above_w, above_o, above_v_minus, below_v_minus) = (
+            workspace or MinimalModel.workspace(u.shape)
+        )
+        np.greater(u, params.th_v, out=above_v)
+        np.greater(u, params.th_w, out=above_w)
+        np.greater(u, params.th_o, out=above_o)
+        np.greater(u, params.th_v_minus, out=above_v_minus)
+        np.less(u, params.th_v_minus, out=below_v_minus)
+
+        # -Jfi
+        np.subtract(u, params.th_v, out=du)
+        np.subtract(params.u_u, u, out=tmp)
+        du *= tmp
+        du *= v
+        du /= params.tau_fi
+        du *= above_v
+        # -Jso, with 1/tau_so above th_w and (u - u_o)/tau_o below it
+        np.subtract(u, params.u_so, out=tmp)
+        tmp *= params.kappa_so
+        np.tanh(tmp, out=tmp)
+        tmp += 1
+        tmp *= (params.tau_so2 - params.tau_so1) / 2
+        tmp += params.tau_so1
+        np.copyto(tmp2, params.tau_o1)
+        np.copyto(tmp2, params.tau_o2, where=above_o)
+        np.subtract(u, params.u_o, out=ds)
+        np.divide(ds, tmp2, out=tmp2)
+        np.reciprocal(tmp, out=tmp)
+        np.copyto(tmp2, tmp, where=above_w)
+        du -= tmp2
+        # -Jsi
+        np.multiply(w, s, out=tmp)
+        tmp /= params.tau_si
+        tmp *= above_w
+        du += tmp
+        du += (stimulus or MinimalModel.STIMULUS).current(t)
+
+        # v decays with tau_v above th_v and relaxes to v_inf with tau_v_minus below it
+        np.copyto(tmp, params.tau_v1)
+        np.copyto(tmp, params.tau_v2, where=above_v_minus)
+        np.copyto(dv, below_v_minus)
+        dv -= v
+        dv /= tmp
+        np.divide(v, params.tau_v, out=tmp)
+        np.negative(tmp, out=tmp)
+        np.copyto(dv, tmp, where=above_v)
+
+        # w decays with tau_w above th_w and relaxes to w_inf with tau_w_minus below it
+        np.subtract(u, params.u_w, out=tmp)
+        tmp *= params.kappa_w
+        np.tanh(tmp, out=tmp)
+        tmp += 1
+        tmp *= (params.tau_w2 - params.tau_w1) / 2
+        tmp += params.tau_w1
+        np.divide(u, params.tau_w_inf, out=tmp2)
+        np.subtract(1, tmp2, out=tmp2)
+        np.copyto(tmp2, params.w_inf_star, where=above_o)
+        np.subtract(tmp2, w, out=dw)
+        dw /= tmp
+        np.divide(w, params.tau_w, out=tmp)
+        np.negative(tmp, out=tmp)
+        np.copyto(dw, tmp, where=above_w)
+
+        # s relaxes to s_inf with tau_s
+        np.subtract(u, params.u_s, out=ds)
+        ds *= params.kappa_s
+        np.tanh(ds, out=ds)
+        ds += 1
+        ds /= 2
+        ds -= s
+        np.copyto(tmp, params.tau_s1)
+        np.copyto(tmp, params.tau_s2, where=above_w)
+        ds /= tmp
+        return out.T
+
     @staticmethod
     def cell_model(
         t: npt.NDArray[np.float_],
         state_vars: npt.NDArray[np.float_],
         params: MMParams,
         ret_ode: bool,
+        stimulus: Optional[AnyStimulus] = None,
+        out: Optional[npt.NDArray[np.float_]] = None,
+        workspace: Optional[Workspace] = None,
     ) -> npt.NDArray[np.float_]:
-        """Equations for the minimal model"""
+        """Equations for the minimal model. When :param out: is given the derivative of the state
+        variables is computed with ode_kernel instead, this implementation is kept as the reference
+        for it."""
+        if ret_ode and out is not None:
+            return MinimalModel.ode_kernel(t, state_vars, params, stimulus, out, workspace)
         u, v, w, s = state_vars
 
         tau_v_minus = (
@@ -75,7 +349,7 @@ class MinimalModel(CellModel):
         Jso = (u-params.u_o)*(1-heaviside(u-params.th_w)) / tau_o + heaviside(u-params.th_w)/tau_so
         Jsi = -heaviside(u-params.th_w)*w*s/params.tau_si
 
-        Jstim = (t < 1) * 0.4
+        Jstim = (stimulus or MinimalModel.STIMULUS).current(t) * np.ones_like(u)
 
         du = -(Jfi + Jso + Jsi) + Jstim
         dv = (
@@ -91,3 +365,76 @@ class MinimalModel(CellModel):
         if ret_ode:
             return np.array([du, dv, dw, ds]).T
         return np.array([Jfi, Jso, Jsi, Jstim]).T
+
+
+class MinimalModelLUT(MinimalModel):
+    """Minimal model evaluated with lookup tables. The smooth voltage dependent terms are
+    interpolated from a table shared by all parameter sets (see lookup_tables) and the thresholds
+    are only compared once per evaluation. Results agree with MinimalModel to the accuracy of the
+    tables.
+    """
+    @staticmethod
+    def gate_dynamics(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: MMParams,
+    ) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.float_]]:
+        """Steady state and time constant of the gates v, w and s, as in MinimalModel."""
+        u = state_vars[0]
+        tau_w_minus, _, s_inf = lookup_table(params).interpolate(u)
+        above_v = u > params.th_v
+        above_w = u > params.th_w
+        tau_v_minus = np.where(u > params.th_v_minus, params.tau_v2, params.tau_v1)
+        w_inf = np.where(u > params.th_o, params.w_inf_star, 1-u/params.tau_w_inf)
+        return (
+            np.array([
+                np.where(above_v, 0., u < params.th_v_minus),
+                np.where(above_w, 0., w_inf),
+                s_inf,
+            ]),
+            np.array([
+                np.where(above_v, params.tau_v, tau_v_minus),
+                np.where(above_w, params.tau_w, tau_w_minus),
+                np.where(above_w, params.tau_s2, params.tau_s1),
+            ]),
+        )
+
+    @staticmethod
+    def cell_model(
+        t: npt.NDArray[np.float_],
+        state_vars: npt.NDArray[np.float_],
+        params: MMParams,
+        ret_ode: bool,
+        stimulus: Optional[AnyStimulus] = None,
+        out: Optional[npt.NDArray[np.float_]] = None,
+        workspace: Optional[Workspace] = None,
+    ) -> npt.NDArray[np.float_]:
+        """Equations for the minimal model using lookup tables"""
+        u, v, w, s = state_vars
+        tau_w_minus, tau_so, s_inf = lookup_table(params).interpolate(u)
+        above_v = u > params.th_v
+        above_w = u > params.th_w
+        above_o = u > params.th_o
+
+        tau_v_minus = np.where(u > params.th_v_minus, params.tau_v2, params.tau_v1)
+        tau_s = np.where(above_w, params.tau_s2, params.tau_s1)
+        tau_o = np.where(above_o, params.tau_o2, params.tau_o1)
+        v_inf = u < params.th_v_minus
+        w_inf = np.where(above_o, params.w_inf_star, 1-u/params.tau_w_inf)
+        Jfi = np.where(above_v, -v*(u-params.th_v)*(params.u_u-u)/params.tau_fi, 0.)
+        Jso = np.where(above_w, 1/tau_so, (u-params.u_o)/tau_o)
+        Jsi = np.where(above_w, -w*s/params.tau_si, 0.)
+
+        Jstim = (stimulus or MinimalModel.STIMULUS).current(t) * np.ones_like(u)
+
+        du = -(Jfi + Jso + Jsi) + Jstim
+        dv = np.where(above_v, -v/params.tau_v, (v_inf-v)/tau_v_minus)
+        dw = np.where(above_w, -w/params.tau_w, (w_inf-w)/tau_w_minus)
+        ds = (s_inf - s)/tau_s
+
+        if ret_ode:
+            if out is not None:
+                out[0], out[1], out[2], out[3] = du, dv, dw, ds
+                return out.T
+            return np.array([du, dv, dw, ds]).T
+        return np.array([Jfi, Jso, Jsi, Jstim]).T
@@ -0,0 +1,69 @@
+"""Stimulus currents used to elicit action potentials in the cell models."""
+import bisect
+from typing import List, NamedTuple, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+
+
+class Stimulus(NamedTuple):
+    """Square pulse of current applied once per cycle. Times are measured from the start of the
+    cycle, in milliseconds.
+    """
+    # Amplitude of the current, in the units of the model
+    amplitude: float
+    # Duration of the pulse
+    duration: float = 1.
+    # Time at which the pulse starts
+    start: float = 0.
+
+    def current(
+        self,
+        t: Union[float, npt.NDArray[np.float_]],
+    ) -> npt.NDArray[np.float_]:
+        """Stimulus current at time :param t:."""
+        return self.amplitude * ((t >= self.start) & (t < self.start + self.duration))
+
+    def breakpoints(self, t_span: Tuple[float, float]) -> List[float]:
+        """Times strictly inside :param t_span: at which the stimulus switches on or off. Solvers
+        should not step across these times, since the current is discontinuous there."""
+        return [t for t in (self.start, self.start + self.duration) if t_span[0] < t < t_span[1]]
+
+
+class StimulusTrain(NamedTuple):
+    """Sequence of identical stimuli applied at arbitrary times, e.g. by a pacing protocol. It can
+    be used wherever a single Stimulus is expected, with times measured from the start of the
+    protocol.
+    """
+    # Shape of each stimulus, with its start measured from the time at which it is applied
+    pulse: Stimulus
+    # Times at which the stimuli are applied, in increasing order
+    times: npt.NDArray[np.float_]
+
+    def current(
+        self,
+        t: Union[float, npt.NDArray[np.float_]],
+    ) -> npt.NDArray[np.float_]:
+        """Stimulus current at time :param t:, given by the last stimulus applied before it."""
+        if isinstance(t, float):
+            # Solvers evaluate one time at a time, for which bisect is several times faster
+            last = bisect.bisect_right(self.times, t) - 1
+            return self.pulse.current(t - float(self.times[last])) if last >= 0 else 0.
+        last = np.searchsorted(self.times, t, side="right") - 1
+        return np.where(
+            last >= 0,
+            self.pulse.current(t - self.times[np.maximum(last, 0)]),
+            0.,
+        )
+
+    def breakpoints(self, t_span: Tuple[float, float]) -> List[float]:
+        """Times strictly inside :param t_span: at which any of the stimuli switches on or off."""
+        return sorted({
+            time + offset
+            for time in self.times
+            for offset in self.pulse.breakpoints((t_span[0] - time, t_span[1] - time))
+        })
+
+
+# Anything that can be used to stimulate a cell model
+AnyStimulus = Union[Stimulus, StimulusTrain]
@@ -1,13 +1,131 @@
 """Perform an action potential restitution experiment."""
 import click
+import concurrent.futures
+import contextlib
 import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
+import numpy.typing as npt
 
 from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.cache import (
+    DEFAULT_CACHE_DIR,
+    SteadyStateCache,
+    solve_steady_state,
+)
+from cardiac_cells_py.experiments.events import DenseOutput
 from cardiac_cells_py.experiments.experiment_result import ExperimentResult
-from cardiac_cells_py.experiments.utils import run_model
+from cardiac_cells_py.experiments.measurements import elicits_ap
+from cardiac_cells_py.experiments.plotting import pyplot
+from cardiac_cells_py.experiments.protocols import PacingProtocol, iter_protocol_beats
+
+
+# Arguments shared by all the S2 beats solved in a process, set by _init_s2_worker
+_S2_WORKER_ARGS: Dict[str, Any] = {}
+
+
+def s2_apd(
+    model: CellModel,
+    cell_type: str,
+    ss_apd_90: float,
+    ss_amplitude: float,
+    ss_dense_output: DenseOutput,
+    stimulus: Stimulus,
+    di: float,
+) -> Optional[float]:
+    """Return the APD90 of the beat elicited by an S2 stimulus applied :param di: milliseconds after
+    the end of the steady state action potential, or None if the S2 stimulus did not elicit an
+    action potential (see elicits_ap). The S2 beat starts from the state of the steady state beat
+    at the exact S2 time, given by its :param ss_dense_output:, and it is only solved until it
+    repolarises."""
+    s2_time = ss_apd_90 + di
+    if not ss_dense_output.t_span[0] <= s2_time <= ss_dense_output.t_span[1]:
+        raise ValueError(f"S2 time ({s2_time}) outside of the steady state beat")
+    s2_results = ExperimentResult(
+        model=model,
+        model_solution=next(iter_protocol_beats(
+            cell_model=model,
+            protocol=PacingProtocol.constant(cycle_length=1000, num_beats=1),
+            cell_type=cell_type,
+            initial_conditions=ss_dense_output(s2_time),
+            stimulus=stimulus,
+            crossing_percents=(90,),
+            stop_at_repolarisation=90,
+        )),
+        cycle_length=1000,
+        experiment_id=f"ap_res_{di}di"
+    )
+    if not elicits_ap(ap_signal=s2_results.ap_signal, reference_amplitude=ss_amplitude):
+        return None
+    return s2_results.apd(90)
+
+
+def refine_restitution(
+    solve_s2: Callable[[Sequence[float]], List[Optional[float]]],
+    dyastolic_intervals: npt.NDArray[np.float_],
+    coarse_step: int,
+    apd_threshold: float,
+) -> Tuple[npt.NDArray[np.float_], List[Optional[float]]]:
+    """Sample the restitution curve at a subset of :param dyastolic_intervals:, starting with every
+    :param coarse_step: and bisecting the intervals where the APD90 changes by more than
+    :param apd_threshold: or where only one end elicits an action potential.
+    :param solve_s2: returns the APD90 of the S2 beats at the DIs given, as s2_apd does.
+    :returns: the DIs that were solved and their APD90.
+    """
+    last = len(dyastolic_intervals) - 1
+    indices = sorted(set(range(0, last, coarse_step)) | {last})
+    apds = dict(zip(indices, solve_s2(dyastolic_intervals[indices])))
+    while True:
+        new_indices = []
+        for low, high in zip(indices[:-1], indices[1:]):
+            if high - low < 2:
+                continue
+            low_apd, high_apd = apds[low], apds[high]
+            if (low_apd is None) != (high_apd is None) or (
+                low_apd is not None and abs(high_apd - low_apd) > apd_threshold
+            ):
+                new_indices.append((low + high) // 2)
+        if not new_indices:
+            break
+        apds.update(zip(new_indices, solve_s2(dyastolic_intervals[new_indices])))
+        indices = sorted(apds)
+    return dyastolic_intervals[indices], [apds[idx] for idx in indices]
+
+
+def find_erp(
+    solve_s2: Callable[[Sequence[float]], List[Optional[float]]],
+    refractory_di: float,
+    excitable_di: float,
+    tolerance: float,
+    points_per_round: int = 1,
+) -> float:
+    """Find the shortest DI at which an S2 stimulus elicits an action potential by bisecting the
+    interval between :param refractory_di:, which does not elicit one, and :param excitable_di:,
+    which does, until it is shorter than :param tolerance:. Each round solves
+    :param points_per_round: S2 beats with :param solve_s2:, as in refine_restitution.
+    """
+    while excitable_di - refractory_di > tolerance:
+        dis = np.linspace(refractory_di, excitable_di, points_per_round + 2)[1:-1]
+        for di, apd in zip(dis, solve_s2(dis)):
+            if apd is None:
+                refractory_di = di
+            else:
+                excitable_di = di
+                break
+    return excitable_di
+
+
+def _init_s2_worker(worker_args: Dict[str, Any]) -> None:
+    """Store the arguments shared by all the S2 beats solved in this process."""
+    _S2_WORKER_ARGS.update(worker_args)
+
+
+def _s2_worker(di: float) -> Optional[float]:
+    """Solve the S2 beat at :param di: using the arguments shared with this process."""
+    return s2_apd(di=di, **_S2_WORKER_ARGS)
 
 
 @click.command()
@@ -37,6 +155,91 @@ from cardiac_cells_py.experiments.utils import run_model
     help="Number of S1 stimuli required to reach steady state.",
     show_default=True,
 )
+@click.option(
+    "--steady-state-tolerance",
+    default=None,
+    type=float,
+    help=(
+        "Stop the S1 stimuli once the state variables at the end of consecutive beats differ by "
+        "less than this value. --steady-state-steps is then the maximum number of stimuli."
+    ),
+)
+@click.option(
+    "--steady-state-apd-tolerance",
+    default=None,
+    type=float,
+    help=(
+        "When using --steady-state-tolerance, also require the APD90 of consecutive beats to "
+        "differ by less than this value."
+    ),
+)
+@click.option(
+    "--shooting",
+    is_flag=True,
+    help=(
+        "Find the limit cycle of the cell with Newton's method instead of applying "
+        "--steady-state-steps S1 stimuli."
+    ),
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes used to solve the S2 beats.",
+    show_default=True,
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or store the steady state in the cache.",
+)
+@click.option(
+    "--cache-dir",
+    default=DEFAULT_CACHE_DIR,
+    type=click.Path(file_okay=False),
+    help="Directory where steady states are cached.",
+    show_default=True,
+)
+@click.option(
+    "--adaptive",
+    is_flag=True,
+    help=(
+        "Solve a coarse grid of DIs and refine it only where APD90 changes rapidly or where the "
+        "S2 stimulus stops eliciting an action potential. The ERP is also reported."
+    ),
+)
+@click.option(
+    "--coarse-step",
+    default=None,
+    type=int,
+    help="Step size, in milliseconds, of the initial grid of --adaptive. [default: 8*DI_STEP]",
+)
+@click.option(
+    "--apd-threshold",
+    default=5.,
+    type=float,
+    help="Change of APD90, in milliseconds, between DIs that triggers refinement in --adaptive.",
+    show_default=True,
+)
+@click.option(
+    "--erp-tolerance",
+    default=1.,
+    type=float,
+    help="Accuracy, in milliseconds, with which --adaptive finds the ERP.",
+    show_default=True,
+)
+@click.option(
+    "--stim-amplitude",
+    default=None,
+    type=float,
+    help="Amplitude of the stimulus current. [default: stimulus of the model]",
+)
+@click.option(
+    "--stim-duration",
+    default=None,
+    type=float,
+    help="Duration of the stimulus in milliseconds. [default: stimulus of the model]",
+)
 def ap_restitution(
     cell_model,
     cell_type,
@@ -46,10 +249,23 @@ def ap_restitution(
     outdir,
     s1_cl,
     steady_state_steps,
+    steady_state_tolerance,
+    steady_state_apd_tolerance,
+    shooting,
+    workers,
+    no_cache,
+    cache_dir,
+    adaptive,
+    coarse_step,
+    apd_threshold,
+    erp_tolerance,
+    stim_amplitude,
+    stim_duration,
 ):
     """Perform an action potential restitution experiment. The experiment will do an S1 stimulation
     at the specified cycle length and then perform an S2 stimulation at the specified dyastolic
-    interval. Results will be reported on APD90 restitution at the desired DIs.
+    interval. Results will be reported on APD90 restitution at the desired DIs. DIs at which the S2
+    stimulus does not elicit an action potential are left out of the restitution curve.
 
     \b
     CELL_MODEL is the cell model to use. Must be a supported CellTypes model.
@@ -61,13 +277,23 @@ def ap_restitution(
     """
     assert max_di < s1_cl, "Cannot compute DI longer than the S1 cycle length"
     dyastolic_intervals = np.arange(min_di, max_di, di_step)
-    model = CellModels[cell_model.upper()].value()
+    model = CellModels[cell_model.upper()].create()
+    stimulus = Stimulus(
+        amplitude=model.STIMULUS.amplitude if stim_amplitude is None else stim_amplitude,
+        duration=model.STIMULUS.duration if stim_duration is None else stim_duration,
+    )
     click.echo("Obtaining steady state result")
-    ss_solution = run_model(
+    ss_solution = solve_steady_state(
         cell_model=model,
         cell_type=cell_type,
-        num_cycles=steady_state_steps,
+        num_cycles=1 if shooting else steady_state_steps,
         cycle_length=s1_cl,
+        tolerance=steady_state_tolerance,
+        apd_tolerance=steady_state_apd_tolerance,
+        shooting=shooting,
+        cache=None if no_cache else SteadyStateCache(cache_dir=cache_dir),
+        stimulus=stimulus,
+        keep_dense_output=True,
     )
     ss_results = ExperimentResult(
         model=model,
@@ -76,31 +302,81 @@ def ap_restitution(
         experiment_id="ap_res_ss",
     )
     ss_apd_90 = ss_results.apd(90)
-    apd_res = []
+    ss_ap_signal = ss_results.last_beat.state_vars[:, model.AP_INDEX]
     click.echo("Solving model at required dyastolic intervals")
-    for di in dyastolic_intervals:
-        s2_time = ss_apd_90 + di
-        s2_idx = np.nonzero(ss_results.last_beat.t >= s2_time)[0][0]
-        initial_conditions = ss_results.last_beat.state_vars[s2_idx, :]
-        s2_results = ExperimentResult(
-            model=model,
-            model_solution=run_model(
-                cell_model=model,
-                cell_type=cell_type,
-                num_cycles=1,
-                cycle_length=1000,
-                initial_conditions=initial_conditions,
-            ),
-            cycle_length=1000,
-            experiment_id=f"ap_res_{di}di"
-        )
-        apd_res.append(s2_results.apd(90))
+    # The steady state beat is sent to each worker once rather than with every DI
+    worker_args = dict(
+        model=model,
+        cell_type=cell_type,
+        ss_apd_90=ss_apd_90,
+        ss_amplitude=np.max(ss_ap_signal) - np.min(ss_ap_signal),
+        ss_dense_output=ss_solution.dense_output,
+        stimulus=stimulus,
+    )
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_s2_worker,
+                initargs=(worker_args,),
+            ))
+            map_s2 = executor.map
+        else:
+            _init_s2_worker(worker_args)
+            map_s2 = map
+
+        def solve_s2(dis: Sequence[float]) -> List[Optional[float]]:
+            with click.progressbar(
+                map_s2(_s2_worker, dis),
+                length=len(dis),
+                label="Computing S2 beats",
+            ) as results:
+                return list(results)
+
+        if adaptive:
+            dyastolic_intervals, apd_res = refine_restitution(
+                solve_s2=solve_s2,
+                dyastolic_intervals=dyastolic_intervals,
+                coarse_step=max(1, (coarse_step or 8*di_step) // di_step),
+                apd_threshold=apd_threshold,
+            )
+            click.echo(f"Solved {len(dyastolic_intervals)} S2 beats")
+            excitable = [di for di, apd in zip(dyastolic_intervals, apd_res) if apd is not None]
+            if excitable:
+                refractory = [di for di in dyastolic_intervals if di < excitable[0]]
+                erp_di = find_erp(
+                    solve_s2=solve_s2,
+                    # An S2 stimulus at the peak of the action potential cannot elicit another one
+                    refractory_di=refractory[-1] if refractory else (
+                        ss_results.last_beat.t[np.argmax(ss_ap_signal)] - ss_apd_90
+                    ),
+                    excitable_di=excitable[0],
+                    tolerance=erp_tolerance,
+                    points_per_round=workers,
+                )
+                click.echo(
+                    f"Effective refractory period: {ss_apd_90 + erp_di:.2f} ms S1-S2 coupling "
+                    f"interval ({erp_di:.2f} ms DI)"
+                )
+            else:
+                erp_di = None
+                click.echo("No S2 stimulus elicited an action potential, ERP not found")
+        else:
+            apd_res = solve_s2(dyastolic_intervals)
 
     fig_base = f"apd_res_{cell_model}_{cell_type}_{s1_cl}s1cl"
 
     if outdir is not None:
+        plt = pyplot()
         plt.figure()
-        plt.plot(dyastolic_intervals, apd_res)
+        plt.plot(
+            dyastolic_intervals,
+            [np.nan if apd is None else apd for apd in apd_res],
+            marker="." if adaptive else None,
+        )
+        if adaptive and erp_di is not None:
+            plt.axvline(erp_di, color="k", linestyle="--", label="ERP")
+            plt.legend()
         plt.xlabel("Dyastolic interval (ms)")
         plt.ylabel("APD90 (ms)")
         plt.title("Action potential restitution curve")
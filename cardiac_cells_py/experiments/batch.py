@@ -0,0 +1,213 @@
+"""Solve a cell model for a population of cells at once. All the cells in the population share the
+same cell model but may use different parameters and initial conditions. The state of the whole
+population is integrated as a single system so that the cost of the solver is shared by all cells.
+"""
+from typing import Any, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.integrators import solve_cycle
+from cardiac_cells_py.experiments.measurements import measure_beats
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+from cardiac_cells_py.experiments.profiling import SolverStats, record_stats
+from cardiac_cells_py.experiments.utils import (
+    cells_have_converged,
+    collect_solver_stats,
+    retain_beats,
+)
+
+
+class BatchModelSolution(NamedTuple):
+    """Tuple containing the solution to the PDEs of a population of cells solved together.
+    """
+    # Time, shared by all the cells
+    t: npt.NDArray[np.float_]
+    # State variables with shape (num_cells, len(t), num_state_vars)
+    state_vars: npt.NDArray[np.float_]
+    # Resulting currents with shape (num_cells, len(t), num_currents)
+    currents: npt.NDArray[np.float_]
+    # Number of cycles that were solved
+    num_cycles: Optional[int] = None
+    # Whether all the cells reached steady state, if convergence was checked
+    converged: Optional[bool] = None
+    # Statistics of the solver over each of the beats solved, shared by all the cells
+    solver_stats: Optional[List[SolverStats]] = None
+    # Whether each cell reached steady state, if convergence was checked
+    cells_converged: Optional[npt.NDArray[np.bool_]] = None
+    # Number of cycles each cell took to reach steady state, or num_cycles if it did not, if
+    # convergence was checked
+    cells_num_cycles: Optional[npt.NDArray[np.int_]] = None
+
+    @property
+    def num_cells(self) -> int:
+        """Number of cells in the solution."""
+        return self.state_vars.shape[0]
+
+    def cell(self, index: int) -> ModelSolution:
+        """Return the solution of a single cell of the population."""
+        return ModelSolution(
+            t=self.t,
+            state_vars=self.state_vars[index],
+            currents=self.currents[index],
+            num_cycles=self.num_cycles,
+            converged=(
+                bool(self.cells_converged[index])
+                if self.cells_converged is not None else self.converged
+            ),
+            solver_stats=self.solver_stats,
+        )
+
+
+def iter_beats_batch(
+    cell_model: CellModel,
+    num_cycles: int,
+    cycle_length: int,
+    params: Sequence[Any],
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+) -> Iterator[BatchModelSolution]:
+    """Solve a population of cells beat by beat, yielding the solution of each beat as soon as it
+    is computed. Arguments are the same as for run_model_batch.
+    """
+    num_cells = len(params)
+    num_state_vars = len(cell_model.STATE_VARS_NAMES)
+    batch_params = cell_model.stack_parameters(params)
+    # The integrators expect the state with shape (num_state_vars, num_cells)
+    y0 = np.broadcast_to(
+        initial_conditions if initial_conditions is not None else cell_model.INITIAL_CONDITIONS,
+        (num_cells, num_state_vars),
+    ).T
+    converged = None if tolerance is None else False
+    cells_converged = None if tolerance is None else np.zeros(num_cells, dtype=np.bool_)
+    cells_num_cycles = None if tolerance is None else np.zeros(num_cells, dtype=np.int_)
+    apd = None
+    for cycle_num in range(num_cycles):
+        solver_stats: List[SolverStats] = []
+        this_t, this_y = solve_cycle(
+            cell_model=cell_model,
+            cycle_length=cycle_length,
+            y0=y0,
+            params=batch_params,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            stimulus=stimulus,
+            backend=backend,
+            stats=solver_stats,
+        )
+        record_stats(solver_stats[-1])
+        this_currents = cell_model.cell_model(
+            t=this_t[:, np.newaxis],
+            state_vars=this_y.transpose(0, 2, 1),
+            params=batch_params,
+            ret_ode=False,
+            stimulus=stimulus,
+        )
+        if tolerance is not None:
+            previous_apd = apd
+            if apd_tolerance is not None:
+                apd = measure_beats(
+                    t=this_t,
+                    ap_signal=this_y[cell_model.AP_INDEX],
+                    beat_starts=this_t[:1],
+                    repolarisation_percents=(90,),
+                ).apd_at(90)
+            now_converged = cells_have_converged(
+                previous_state=y0,
+                state=this_y[..., -1],
+                tolerance=tolerance,
+                previous_apd=previous_apd,
+                apd=apd,
+                apd_tolerance=apd_tolerance,
+            )
+            # A cell reached steady state at the first beat since which it has stayed converged
+            cells_num_cycles = np.where(
+                now_converged & cells_converged, cells_num_cycles, cycle_num + 1
+            )
+            cells_converged = now_converged
+            converged = bool(np.all(cells_converged))
+        y0 = this_y[..., -1]
+        yield BatchModelSolution(
+            t=this_t + cycle_length*cycle_num,
+            state_vars=this_y.transpose(1, 2, 0),
+            currents=this_currents,
+            num_cycles=cycle_num + 1,
+            converged=converged,
+            solver_stats=solver_stats,
+            cells_converged=cells_converged,
+            cells_num_cycles=cells_num_cycles,
+        )
+        if converged:
+            return
+
+
+def run_model_batch(
+    cell_model: CellModel,
+    num_cycles: int,
+    cycle_length: int,
+    params: Sequence[Any],
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    keep: Union[str, int] = "all",
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+) -> BatchModelSolution:
+    """Solve the partial differential equations of a cell model for a population of cells, one for
+    each set of parameters in :param params:. The initial conditions can be given per cell, with
+    shape (num_cells, num_state_vars), or shared by all the cells. If no initial conditions are
+    provided, the standard conditions from the model will be used.
+
+    The :param integrator:, :param dt:, :param method:, :param max_step:, :param keep:,
+    :param stimulus: and :param backend: are used as in run_model. Adaptive solvers use a single
+    step size for the whole population, so all cells share the same time vector. If a
+    :param tolerance: is given, the population is solved until all of its cells reach steady
+    state, as in run_model.
+    """
+    with click.progressbar(
+        iter_beats_batch(
+            cell_model=cell_model,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            params=params,
+            initial_conditions=initial_conditions,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            tolerance=tolerance,
+            apd_tolerance=apd_tolerance,
+            stimulus=stimulus,
+            backend=backend,
+        ),
+        length=num_cycles,
+        label=f"Computing AP signals for {len(params)} cells",
+    ) as beats:
+        solver_stats: List[SolverStats] = []
+        kept = retain_beats(beats=collect_solver_stats(beats, solver_stats), keep=keep)
+    return BatchModelSolution(
+        t=np.concatenate([beat.t for beat in kept]),
+        state_vars=np.concatenate([beat.state_vars for beat in kept], axis=1),
+        currents=np.concatenate([beat.currents for beat in kept], axis=1),
+        num_cycles=kept[-1].num_cycles,
+        converged=kept[-1].converged,
+        solver_stats=solver_stats,
+        cells_converged=kept[-1].cells_converged,
+        cells_num_cycles=kept[-1].cells_num_cycles,
+    )
@@ -0,0 +1,300 @@
+"""Persistent cache of steady state solutions. Steady states are stored on disk, keyed by a hash of
+everything that determines them, so that repeated experiments on the same cell can start from a
+warm state. The size of the cache is bounded by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Optional, Sequence
+
+import click
+import numpy as np
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.events import ThresholdCrossings
+from cardiac_cells_py.experiments.limit_cycle import find_limit_cycle
+from cardiac_cells_py.experiments.measurements import extract_last_beat
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+from cardiac_cells_py.experiments.protocols import PacingProtocol, run_protocol
+from cardiac_cells_py.experiments.storage import SolutionWriter
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "cardiac_cells_py",
+)
+# Maximum size of the cache in bytes
+DEFAULT_MAX_SIZE = 256 * 1024**2
+# Increase when the contents of the entries change so that old entries are not used
+CACHE_VERSION = 3
+
+
+class SteadyStateCache:
+    """On-disk cache of the last beat of steady state solutions."""
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+        """Construct a cache that stores up to :param max_size: bytes in :param cache_dir:."""
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(cell_model: CellModel, params: Any, **settings: Any) -> str:
+        """Hash of the model, its parameters and any other :param settings: that determine the
+        steady state, e.g. the cycle length, the number of beats and the solver settings."""
+        model_class = type(cell_model)
+        description = {
+            "version": CACHE_VERSION,
+            "model": f"{model_class.__module__}.{model_class.__qualname__}",
+            "initial_conditions": np.asarray(cell_model.INITIAL_CONDITIONS).tolist(),
+            "params": params._asdict() if hasattr(params, "_asdict") else params,
+            **settings,
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True, default=repr).encode()
+        ).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Location of the entry for :param key:."""
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[ModelSolution]:
+        """Return the solution stored for :param key:, if any, and mark it as recently used."""
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                solution = ModelSolution(
+                    t=entry["t"],
+                    state_vars=entry["state_vars"],
+                    currents=entry["currents"],
+                    num_cycles=int(entry["num_cycles"]) if "num_cycles" in entry else None,
+                    converged=bool(entry["converged"]) if "converged" in entry else None,
+                    crossings=ThresholdCrossings(
+                        resting=float(entry["crossings_resting"]),
+                        peak=float(entry["crossings_peak"]),
+                        peak_time=float(entry["crossings_peak_time"]),
+                        upstroke_time=float(entry["crossings_upstroke_time"]),
+                        repolarisation_percents=tuple(
+                            int(percent) for percent in entry["crossings_percents"]
+                        ),
+                        apd=entry["crossings_apd"],
+                    ) if "crossings_apd" in entry else None,
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(path)
+        return solution
+
+    def put(self, key: str, solution: ModelSolution) -> None:
+        """Store :param solution: for :param key: and evict old entries if the cache is full."""
+        entry = {
+            "t": solution.t,
+            "state_vars": solution.state_vars,
+            "currents": solution.currents,
+            # Final state of the cell, so that it can be used as initial conditions
+            "final_state": solution.state_vars[-1],
+        }
+        if solution.num_cycles is not None:
+            entry["num_cycles"] = np.array(solution.num_cycles)
+        if solution.converged is not None:
+            entry["converged"] = np.array(solution.converged)
+        if solution.crossings is not None:
+            entry.update(
+                crossings_resting=np.array(solution.crossings.resting),
+                crossings_peak=np.array(solution.crossings.peak),
+                crossings_peak_time=np.array(solution.crossings.peak_time),
+                crossings_upstroke_time=np.array(solution.crossings.upstroke_time),
+                crossings_percents=np.array(solution.crossings.repolarisation_percents),
+                crossings_apd=np.asarray(solution.crossings.apd),
+            )
+        # Write to a temporary file first so that concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.savez(tmp_file, **entry)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in its maximum size."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def resolve_beat(
+    cell_model: CellModel,
+    cell_type: str,
+    beat: ModelSolution,
+    stimulus: Stimulus,
+    crossing_percents: Optional[Sequence[int]] = None,
+    **solver_settings: Any,
+) -> ModelSolution:
+    """Solve :param beat:, whose times start at zero, again from its initial state to obtain the
+    dense output of the solver and, at :param crossing_percents:, its threshold crossings. The
+    :param solver_settings: (integrator, method, tolerances, etc.) are passed to run_protocol and
+    must be those with which the beat was solved."""
+    cycle_length = float(beat.t[-1])
+    solution = run_protocol(
+        cell_model=cell_model,
+        protocol=PacingProtocol.constant(cycle_length=cycle_length, num_beats=1),
+        cell_type=cell_type,
+        initial_conditions=np.asarray(beat.state_vars[0]),
+        stimulus=stimulus,
+        crossing_percents=crossing_percents,
+        keep_dense_output=True,
+        **solver_settings,
+    )
+    return solution._replace(num_cycles=beat.num_cycles, converged=beat.converged)
+
+
+def solve_steady_state(
+    cell_model: CellModel,
+    cell_type: str,
+    num_cycles: int,
+    cycle_length: int,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    shooting: bool = False,
+    cache: Optional[SteadyStateCache] = None,
+    stimulus: Optional[Stimulus] = None,
+    crossing_percents: Optional[Sequence[int]] = None,
+    keep_dense_output: bool = False,
+    writer: Optional[SolutionWriter] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    rtol: float = 1e-3,
+    atol: float = 1e-6,
+    backend: str = "numpy",
+) -> ModelSolution:
+    """Return the last beat of the steady state of a cell, reading it from :param cache: when
+    available. The steady state is reached by pacing the cell for :param num_cycles: at a constant
+    cycle length (see run_protocol) or, if :param shooting: is set, by finding its limit cycle and
+    pacing it from there.
+    The :param stimulus: defaults to the stimulus of the model. The threshold crossings at
+    :param crossing_percents: are detected while solving the last beat (see run_model) and are
+    cached with it, so that a warm run reports the same crossings as a cold one. A cached beat
+    whose crossings do not include :param crossing_percents: is solved again from its initial
+    state to detect them.
+    If :param keep_dense_output: is set, the last beat is returned with the dense output of the
+    solver, with times measured from its start. Dense outputs are not cached, so a cached last beat
+    is solved again from its initial state to obtain it.
+    If a :param writer: is given, every beat of the pacing is written to it, so the cache is not
+    read but the steady state is still stored in it.
+    The :param integrator:, :param dt:, :param method:, :param max_step:, :param rtol:,
+    :param atol: and :param backend: are used as in run_protocol and are part of the cache key.
+    """
+    stimulus = stimulus or cell_model.STIMULUS
+    solver_settings = dict(
+        integrator=integrator,
+        dt=dt,
+        method=method,
+        max_step=max_step,
+        rtol=rtol,
+        atol=atol,
+        backend=backend,
+    )
+    if cache is not None:
+        key = cache.key(
+            cell_model=cell_model,
+            params=cell_model.parameters(cell_type=cell_type),
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            tolerance=tolerance,
+            apd_tolerance=apd_tolerance,
+            shooting=shooting,
+            stimulus=stimulus._asdict(),
+            **solver_settings,
+        )
+        last_beat = cache.get(key) if writer is None else None
+        if last_beat is not None:
+            click.echo(f"Steady state loaded from {cache.path(key)}")
+            # Crossings cached at other percentages are detected again, and none are returned
+            # unless they were asked for, as when the beat is solved
+            crossings = last_beat.crossings
+            if crossing_percents is None or (
+                crossings is not None and
+                not set(crossing_percents) <= set(crossings.repolarisation_percents)
+            ):
+                crossings = None
+            if keep_dense_output or (crossing_percents is not None and crossings is None):
+                resolved = resolve_beat(
+                    cell_model=cell_model,
+                    cell_type=cell_type,
+                    beat=last_beat,
+                    stimulus=stimulus,
+                    crossing_percents=crossing_percents if crossings is None else None,
+                    **solver_settings,
+                )
+                last_beat = resolved._replace(
+                    dense_output=resolved.dense_output if keep_dense_output else None,
+                )
+                if crossings is None:
+                    crossings = resolved.crossings
+            last_beat = last_beat._replace(crossings=crossings)
+            return last_beat
+    initial_conditions = None
+    if shooting:
+        click.echo("Finding limit cycle")
+        limit_cycle = find_limit_cycle(
+            cell_model=cell_model,
+            cycle_length=cycle_length,
+            cell_type=cell_type,
+            stimulus=stimulus,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            backend=backend,
+        )
+        click.echo(
+            f"Limit cycle {'found' if limit_cycle.converged else 'not found'} after "
+            f"{limit_cycle.num_iterations} iterations. Floquet multipliers: "
+            f"{np.round(limit_cycle.floquet_multipliers, 4)}"
+        )
+        initial_conditions = limit_cycle.initial_conditions
+    model_solution = run_protocol(
+        cell_model=cell_model,
+        protocol=PacingProtocol.constant(cycle_length=cycle_length, num_beats=num_cycles),
+        cell_type=cell_type,
+        initial_conditions=initial_conditions,
+        tolerance=tolerance,
+        apd_tolerance=apd_tolerance,
+        keep="last",
+        stimulus=stimulus,
+        crossing_percents=crossing_percents,
+        keep_dense_output=keep_dense_output,
+        writer=writer,
+        **solver_settings,
+    )
+    if model_solution.converged is not None:
+        click.echo(
+            f"Steady state {'reached' if model_solution.converged else 'not reached'} after "
+            f"{model_solution.num_cycles} cycles"
+        )
+    last_beat = extract_last_beat(model_solution=model_solution, cycle_length=cycle_length)
+    last_beat = last_beat._replace(
+        num_cycles=model_solution.num_cycles,
+        converged=model_solution.converged,
+        crossings=model_solution.crossings,
+        solver_stats=model_solution.solver_stats,
+        dense_output=(
+            model_solution.dense_output.shifted(model_solution.t[-1] - last_beat.t[-1])
+            if model_solution.dense_output is not None else None
+        ),
+    )
+    if cache is not None:
+        cache.put(key, last_beat)
+    return last_beat
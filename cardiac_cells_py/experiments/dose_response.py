@@ -0,0 +1,118 @@
+"""Dose-response curves of the biomarkers of a cell at steady state to the block of its currents,
+e.g. by a drug. Every blocked current gets its own curve. The curves are followed by continuation:
+the doses are solved in increasing order, all the currents at the same dose together as one
+population, and each population starts from the steady states of the previous dose, which are
+close to its own, so it only needs a few beats to reach steady state.
+"""
+from typing import List, NamedTuple, Optional, Sequence
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.batch import run_model_batch
+from cardiac_cells_py.experiments.measurements import BIOMARKER_NAMES, measure_beats
+
+
+class DoseResponse(NamedTuple):
+    """Tuple containing the dose-response curves of the biomarkers of a cell."""
+    # Names of the currents blocked, one curve each
+    currents: List[str]
+    # Fractions of the currents blocked, in increasing order and starting with no block
+    block_fractions: npt.NDArray[np.float_]
+    # Names of the biomarkers
+    biomarker_names: List[str]
+    # Value of each biomarker for each current and block fraction, with shape
+    # (len(biomarker_names), len(currents), len(block_fractions))
+    values: npt.NDArray[np.float_]
+    # Number of beats solved at each block fraction
+    num_cycles: npt.NDArray[np.int_]
+    # Whether all the cells reached steady state at each block fraction
+    converged: npt.NDArray[np.bool_]
+
+    def of(self, biomarker: str) -> npt.NDArray[np.float_]:
+        """Curves of :param biomarker:, with shape (len(currents), len(block_fractions))."""
+        if biomarker not in self.biomarker_names:
+            raise ValueError(f"Biomarker ({biomarker}) not recognised")
+        return self.values[self.biomarker_names.index(biomarker)]
+
+
+def dose_response(
+    cell_model: CellModel,
+    cell_type: str,
+    block_fractions: Sequence[float],
+    currents: Optional[Sequence[str]] = None,
+    num_cycles: int = 50,
+    cycle_length: int = 1000,
+    tolerance: Optional[float] = 1e-4,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+) -> DoseResponse:
+    """Biomarkers in BIOMARKER_NAMES of the last beat at steady state of the :param cell_type:
+    given with each of :param currents:, all of CellModel.CURRENT_TIME_CONSTANTS by default,
+    blocked by each of :param block_fractions: (see CellModel.block_currents). The cell without
+    block is always solved first, starting from :param initial_conditions:, and then each block
+    fraction starts from the steady states of the previous one. Every population is paced for up
+    to :param num_cycles: or until it reaches steady state within :param tolerance:, and the
+    remaining arguments are used as in run_model_batch.
+    """
+    currents = list(currents if currents is not None else cell_model.CURRENT_TIME_CONSTANTS)
+    params = cell_model.parameters(cell_type=cell_type)
+    # Check the currents and the fractions before solving anything
+    for fraction in block_fractions:
+        cell_model.block_currents(params, {current: fraction for current in currents})
+    fractions = np.union1d([0.], np.asarray(block_fractions, dtype=np.float_))
+    values = np.empty((len(BIOMARKER_NAMES), len(currents), len(fractions)))
+    num_cycles_solved = np.zeros(len(fractions), dtype=np.int_)
+    converged = np.zeros(len(fractions), dtype=np.bool_)
+    state = initial_conditions
+    for dose_num, fraction in enumerate(fractions):
+        click.echo(f"Solving {fraction:.0%} block")
+        # Without block all the currents give the same cell, which is solved only once
+        population = [params] if fraction == 0 else [
+            cell_model.block_currents(params, {current: fraction}) for current in currents
+        ]
+        last_beat = run_model_batch(
+            cell_model=cell_model,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            params=population,
+            initial_conditions=state,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            tolerance=tolerance,
+            keep="last",
+            stimulus=stimulus,
+            backend=backend,
+        )
+        biomarkers = measure_beats(
+            t=last_beat.t,
+            ap_signal=last_beat.state_vars[..., cell_model.AP_INDEX],
+            beat_starts=last_beat.t[:1],
+            repolarisation_percents=(30, 50, 90),
+        )
+        values[:, :, dose_num] = np.stack(
+            [biomarkers.named(name)[:, 0] for name in BIOMARKER_NAMES]
+        )
+        num_cycles_solved[dose_num] = last_beat.num_cycles
+        converged[dose_num] = bool(last_beat.converged)
+        state = np.broadcast_to(
+            last_beat.state_vars[:, -1], (len(currents), last_beat.state_vars.shape[-1])
+        )
+    return DoseResponse(
+        currents=currents,
+        block_fractions=fractions,
+        biomarker_names=list(BIOMARKER_NAMES),
+        values=values,
+        num_cycles=num_cycles_solved,
+        converged=converged,
+    )
@@ -0,0 +1,141 @@
+"""Compute the dose-response curves of the biomarkers of a cell at steady state to the block of its
+currents."""
+import click
+import os
+
+import numpy as np
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.dose_response import dose_response
+from cardiac_cells_py.experiments.plotting import pyplot
+
+
+@click.command("dose-response")
+@click.argument(
+    "cell_model",
+    type=click.Choice(
+        CellModels.valid_models(),
+        case_sensitive=False
+    )
+)
+@click.argument("cell_type", type=str)
+@click.argument("outdir", type=click.Path(exists=True))
+@click.option(
+    "--current",
+    "currents",
+    multiple=True,
+    help="Current of the model to block, e.g. Jsi. Can be repeated. [default: all the currents "
+    "that can be blocked]",
+)
+@click.option(
+    "--block",
+    "block_fractions",
+    multiple=True,
+    default=(0.1, 0.25, 0.5, 0.75, 0.9),
+    type=click.FloatRange(min=0, max=1, max_open=True),
+    help="Fraction of the currents blocked. Can be repeated. The cell without block is always "
+    "solved.",
+    show_default=True,
+)
+@click.option(
+    "--num-cycles",
+    default=50,
+    type=int,
+    help="Maximum number of cycles used to reach steady state at each block fraction.",
+    show_default=True,
+)
+@click.option(
+    "--cycle-length",
+    default=1000,
+    type=int,
+    help="Cycle length in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--tolerance",
+    default=1e-4,
+    type=float,
+    help=(
+        "Move on to the next block fraction once the state variables of all the cells at the end "
+        "of consecutive beats differ by less than this value."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--backend",
+    default="numpy",
+    type=click.Choice(["numpy", "jit"]),
+    help="Backend used to evaluate the cell model.",
+    show_default=True,
+)
+def dose_response_experiment(
+    cell_model,
+    cell_type,
+    outdir,
+    currents,
+    block_fractions,
+    num_cycles,
+    cycle_length,
+    tolerance,
+    backend,
+):
+    """Block a fraction of the currents of the model, e.g. to simulate a drug, and report the
+    biomarkers of the last beat at steady state (APDs, peak, resting value, maximum upstroke and
+    triangulation) as a function of the block fraction of each current. All the currents are
+    solved together at each block fraction, starting from the steady states of the previous one.
+    The curves are saved as a CSV table and a figure.
+
+    \b
+    CELL_MODEL is the cell model to use in the experiment. Must be a supported CellModels.
+    CELL_TYPE is the type of cell to use in the experiment. Must be supported by the cell model.
+    OUTDIR specify an output directory to save the results
+    """
+    model = CellModels[cell_model.upper()].create()
+    try:
+        curves = dose_response(
+            cell_model=model,
+            cell_type=cell_type,
+            block_fractions=block_fractions,
+            currents=currents or None,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            tolerance=tolerance,
+            backend=backend,
+        )
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--current")
+    if not curves.converged.all():
+        click.echo(
+            "Steady state not reached at block fractions "
+            f"{curves.block_fractions[~curves.converged]}, consider increasing --num-cycles"
+        )
+    click.echo(f"Beats solved: {np.sum(curves.num_cycles)}")
+    for current, apd90 in zip(curves.currents, curves.of("apd90")):
+        click.echo(f"APD90 with {current} blocked: {np.round(apd90, 2)}")
+
+    fig_base = f"dose_response_{cell_model}_{cell_type}_{cycle_length}cl"
+    click.echo(f"Saving results in {outdir}")
+    with open(f"{os.path.join(outdir, fig_base)}.csv", "w") as csv_file:
+        csv_file.write(",".join(["current", "block", *curves.biomarker_names]) + "\n")
+        for current_num, current in enumerate(curves.currents):
+            for dose_num, fraction in enumerate(curves.block_fractions):
+                values = curves.values[:, current_num, dose_num]
+                csv_file.write(
+                    ",".join([current, f"{fraction:g}", *(f"{value:.6g}" for value in values)])
+                    + "\n"
+                )
+
+    plt = pyplot()
+    fig, axes = plt.subplots(2, 4, figsize=(16, 7))
+    for ax, name in zip(axes.flat, curves.biomarker_names):
+        for current, curve in zip(curves.currents, curves.of(name)):
+            ax.plot(100*curves.block_fractions, curve, marker="o", label=current)
+        ax.set_xlabel("Block (%)")
+        ax.set_ylabel(name)
+    axes.flat[0].legend()
+    for ax in axes.flat[len(curves.biomarker_names):]:
+        ax.axis("off")
+    fig.suptitle("Dose-response of the biomarkers")
+    fig.tight_layout()
+    fig.savefig(f"{os.path.join(outdir, fig_base)}.png")
+    plt.close("all")
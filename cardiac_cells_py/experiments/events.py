@@ -0,0 +1,152 @@
+"""Threshold crossings of the action potential detected from the dense output of the solver, i.e.
+the interpolant that the solver builds over each of its steps. Crossing times are found by root
+finding on the interpolant, as solve_ivp does for its events, so their accuracy is that of the
+solver and does not depend on how densely the solution is stored. This allows coarse steps, and
+little stored output, without losing accuracy in the APDs.
+
+The thresholds of the repolarisation crossings depend on the peak of the beat, which is not known
+in advance, so they cannot be given to solve_ivp as events. Instead, the dense output of the steps
+of a beat is kept while the beat is solved and the crossings are found once it ends.
+"""
+from typing import TYPE_CHECKING, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.experiments.profiling import timed
+
+if TYPE_CHECKING:
+    from scipy.integrate import OdeSolution
+
+
+class ThresholdCrossings(NamedTuple):
+    """Tuple containing the threshold crossings of the action potential of a beat. Times are
+    measured from the start of the beat."""
+    # Value of the action potential at the start of the beat
+    resting: float
+    # Maximum value of the action potential
+    peak: float
+    # Time at which the peak is reached
+    peak_time: float
+    # Time at which the action potential rises above half of its amplitude, i.e. the middle of
+    # the upstroke
+    upstroke_time: float
+    # Repolarisation percentages whose crossings were detected
+    repolarisation_percents: Tuple[int, ...]
+    # APD at each of the repolarisation percentages, NaN if the beat did not repolarise
+    apd: npt.NDArray[np.float_]
+
+    def apd_at(self, repolarisation_percent: int) -> float:
+        """APD at the :param repolarisation_percent: given."""
+        if repolarisation_percent not in self.repolarisation_percents:
+            raise ValueError(
+                f"Repolarisation percentage ({repolarisation_percent}) not detected"
+            )
+        return float(self.apd[self.repolarisation_percents.index(repolarisation_percent)])
+
+
+class DenseOutput(NamedTuple):
+    """Interpolant of the state variables over a beat, built from the dense output of the solver,
+    that can be evaluated at any time of the beat in O(log(steps)). Times are those of the solver
+    minus :param offset:, so that the interpolant follows the beat when its times are shifted."""
+    # Dense output of the solver over the beat
+    solution: "OdeSolution"
+    # Time of the solver at which the times of the interpolant start
+    offset: float = 0.
+
+    def __call__(self, t: npt.ArrayLike) -> npt.NDArray[np.float_]:
+        """State variables at :param t:, with shape (num_state_vars,) or
+        (num_state_vars, len(t))."""
+        return self.solution(np.asarray(t) + self.offset)
+
+    @property
+    def t_span(self) -> Tuple[float, float]:
+        """First and last times of the beat."""
+        return self.solution.t_min - self.offset, self.solution.t_max - self.offset
+
+    def shifted(self, offset: float) -> "DenseOutput":
+        """Interpolant whose times are measured from :param offset: instead."""
+        return self._replace(offset=self.offset + offset)
+
+
+def join_dense_outputs(solutions: Sequence["OdeSolution"]) -> "OdeSolution":
+    """Join the dense outputs of consecutive segments, each starting where the previous one
+    ended, into a single dense output."""
+    from scipy.integrate import OdeSolution
+
+    ts = np.concatenate([solutions[0].ts] + [solution.ts[1:] for solution in solutions[1:]])
+    interpolants = [
+        interpolant for solution in solutions for interpolant in solution.interpolants
+    ]
+    return OdeSolution(ts, interpolants)
+
+
+@timed("measurements")
+def threshold_crossings(
+    t: npt.NDArray[np.float_],
+    ap_signal: npt.NDArray[np.float_],
+    repolarisation_percents: Sequence[int],
+    dense_output: Optional[Callable[[float], npt.NDArray[np.float_]]] = None,
+    ap_index: int = 0,
+) -> ThresholdCrossings:
+    """Find the threshold crossings of a beat that starts at t[0], where :param ap_signal: is
+    the action potential at the steps of the solver :param t:. The peak and the crossings are
+    located between steps with :param dense_output:, which returns the state variables at any
+    time of the beat and whose :param ap_index: entry is the action potential. Without it the
+    action potential is interpolated linearly between steps.
+    The APD at p% is the time until the action potential first falls below
+    peak - p/100*(peak - resting) after its peak, as in measure_beats.
+    """
+    from scipy.optimize import brentq, minimize_scalar
+
+    if dense_output is None:
+        def ap_at(time: float) -> float:
+            return float(np.interp(time, t, ap_signal))
+    else:
+        def ap_at(time: float) -> float:
+            return float(dense_output(time)[ap_index])
+
+    def crossing(start: int, end: int, threshold: float) -> float:
+        low, high = t[start], t[end]
+        if dense_output is None or (ap_at(low) - threshold)*(ap_at(high) - threshold) > 0:
+            # The interpolant does not bracket the crossing, e.g. at a refined peak
+            fraction = (threshold - ap_signal[start]) / (ap_signal[end] - ap_signal[start])
+            return low + fraction*(high - low)
+        return brentq(lambda time: ap_at(time) - threshold, low, high)
+
+    peak_step = int(np.argmax(ap_signal))
+    peak, peak_time = float(ap_signal[peak_step]), float(t[peak_step])
+    if dense_output is not None:
+        # The peak can fall between the steps on either side of the highest step
+        bounds = (t[max(peak_step - 1, 0)], t[min(peak_step + 1, len(t) - 1)])
+        if bounds[1] > bounds[0]:
+            refined = minimize_scalar(
+                lambda time: -ap_at(time), bounds=bounds, method="bounded"
+            )
+            if -refined.fun > peak:
+                peak, peak_time = float(-refined.fun), float(refined.x)
+    resting = float(ap_signal[0])
+
+    upstroke_time = np.nan
+    upstroke_threshold = resting + 0.5*(peak - resting)
+    above = np.nonzero(ap_signal[:peak_step + 1] >= upstroke_threshold)[0]
+    if len(above) and above[0] > 0:
+        upstroke_time = crossing(above[0] - 1, above[0], upstroke_threshold) - t[0]
+
+    apd: List[float] = []
+    for percent in repolarisation_percents:
+        threshold = peak - percent/100*(peak - resting)
+        below = np.nonzero(ap_signal[peak_step + 1:] <= threshold)[0]
+        if not len(below):
+            apd.append(np.nan)
+            continue
+        end = peak_step + 1 + below[0]
+        apd.append(crossing(end - 1, end, threshold) - t[0])
+    return ThresholdCrossings(
+        resting=resting,
+        peak=peak,
+        peak_time=peak_time - t[0],
+        upstroke_time=upstroke_time,
+        repolarisation_percents=tuple(repolarisation_percents),
+        apd=np.array(apd),
+    )
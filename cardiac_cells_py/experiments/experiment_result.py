@@ -1,12 +1,20 @@
 """Class specifying the results of an experiment"""
 from cardiac_cells_py.cell_models.cell_model import CellModel
-from typing import Dict, Optional
+from typing import List, Optional, Sequence
 
 import numpy as np
 import numpy.typing as npt
 
-from .measurements import measure_apd, extract_last_beat
-from .utils import ModelSolution
+from .measurements import (
+    DEFAULT_REPOLARISATION_PERCENTS,
+    BeatBiomarkers,
+    cycle_starts,
+    extract_last_beat,
+    measure_beats,
+)
+from .model_solution import ModelSolution
+from .profiling import SolverStats
+from .storage import load_solution, read_metadata
 
 class ExperimentResult:
     """Container for results of an experiment. The object also performs measurements and stores them
@@ -21,21 +29,63 @@ class ExperimentResult:
         """Construct the experiment result object."""
         self.model = model
         self.experiment_id = experiment_id
+        self.model_solution = model_solution
+        self.cycle_length = cycle_length
         self.ap_signal = model_solution.state_vars[:,0]
         self.last_beat = extract_last_beat(
             model_solution=model_solution,
             cycle_length=cycle_length,
         )
-        self.apd_x: Dict[int, float] = {}
+        self._biomarkers: Optional[BeatBiomarkers] = None
 
-    def apd(self, repolarisation_percent: int) -> float:
-        """If not computed already, compute the APDX value of the resulting signal"""
-        apd_x = self.apd_x.get(repolarisation_percent, None)
-        if apd_x is None:
-            apd_x = measure_apd(
-                t=self.last_beat.t,
-                ap_signal=self.last_beat.state_vars[:, self.model.AP_INDEX],
-                repolarisation_percent=repolarisation_percent,
+    @classmethod
+    def load(
+        cls,
+        model: CellModel,
+        path: str,
+        experiment_id: str,
+        cycle_length: Optional[int] = None,
+    ) -> "ExperimentResult":
+        """Result of the solution stored in :param path: (see storage.SolutionWriter), whose
+        arrays are memory-mapped so that only the parts measured are read. The
+        :param cycle_length: defaults to the one stored with the solution."""
+        if cycle_length is None:
+            cycle_length = read_metadata(path)["cycle_length"]
+            if cycle_length is None:
+                raise ValueError(f"No cycle length stored in {path}")
+        return cls(
+            model=model,
+            model_solution=load_solution(path),
+            cycle_length=cycle_length,
+            experiment_id=experiment_id,
+        )
+
+    @property
+    def solver_stats(self) -> Optional[List[SolverStats]]:
+        """Statistics of the solver over each of the beats solved, if they were recorded."""
+        return self.model_solution.solver_stats
+
+    def biomarkers(
+        self,
+        repolarisation_percents: Sequence[int] = DEFAULT_REPOLARISATION_PERCENTS,
+    ) -> BeatBiomarkers:
+        """Biomarkers of every beat kept in the resulting signal (see measure_beats), including the
+        APDs at :param repolarisation_percents:. All beats are measured in a single pass, which is
+        only repeated when APDs at new percentages are requested."""
+        measured = () if self._biomarkers is None else self._biomarkers.repolarisation_percents
+        if not set(repolarisation_percents) <= set(measured):
+            self._biomarkers = measure_beats(
+                t=self.model_solution.t,
+                ap_signal=self.model_solution.state_vars[:, self.model.AP_INDEX],
+                beat_starts=cycle_starts(self.model_solution.t, self.cycle_length),
+                repolarisation_percents=sorted(set(measured) | set(repolarisation_percents)),
             )
-            self.apd_x[repolarisation_percent] = apd_x
-        return apd_x
+        return self._biomarkers
+
+    def apd(self, repolarisation_percent: int) -> float:
+        """APDX value of the last beat of the resulting signal, NaN if it does not repolarise. It is
+        taken from the threshold crossings detected while solving the beat when available."""
+        crossings = self.model_solution.crossings
+        if crossings is not None and repolarisation_percent in crossings.repolarisation_percents:
+            return crossings.apd_at(repolarisation_percent)
+        return float(self.biomarkers((repolarisation_percent,)).apd_at(repolarisation_percent)[-1])
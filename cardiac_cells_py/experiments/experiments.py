@@ -1,15 +1,37 @@
 """CLI containing all the experiments that can be performed in this module"""
 import click
 
+from cardiac_cells_py.experiments import profiling
 from cardiac_cells_py.experiments.ap_restitution import ap_restitution
+from cardiac_cells_py.experiments.dose_response_experiment import dose_response_experiment
+from cardiac_cells_py.experiments.sensitivity_experiment import sensitivity
 from cardiac_cells_py.experiments.steady_state import steady_state
+from cardiac_cells_py.experiments.sweep import sweep
+from cardiac_cells_py.experiments.tissue_experiment import tissue
 
 @click.group()
-def cell_experiments():
+@click.option(
+    "--profile",
+    is_flag=True,
+    help=(
+        "Print where the time of the experiment went: calls to and time in the model, the "
+        "solvers and the measurements, and the statistics of the solvers. Work done in other "
+        "processes, e.g. with --workers, is not included."
+    ),
+)
+@click.pass_context
+def cell_experiments(ctx, profile):
     """Command line group for cell experiments"""
+    if profile:
+        experiment_profile = ctx.with_resource(profiling.profile())
+        ctx.call_on_close(lambda: click.echo(experiment_profile.summary(), err=True))
 
 cell_experiments.add_command(ap_restitution)
+cell_experiments.add_command(dose_response_experiment)
+cell_experiments.add_command(sensitivity)
 cell_experiments.add_command(steady_state)
+cell_experiments.add_command(sweep)
+cell_experiments.add_command(tissue)
 
 if __name__ == "__main__":
     cell_experiments()
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""Integrators that can be used to solve a cell model over one cycle. All integrators accept the
+state of a single cell, with shape (num_state_vars,), or of a population of cells, with shape
+(num_state_vars, num_cells), and return the state variables with time as the last axis.
+"""
+import functools
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import AnyStimulus
+from cardiac_cells_py.experiments.jit import JitKernels, jit_kernels, params_array
+from cardiac_cells_py.experiments.profiling import SolverStats, profiled, section, sum_stats
+
+# SciPy takes a good part of the start up time of the command line, so it is only imported by the
+# functions that solve a model
+if TYPE_CHECKING:
+    from scipy import sparse
+    from scipy.integrate import OdeSolution
+
+INTEGRATORS = ["solve_ivp", "rush_larsen"]
+# Backends used to evaluate the cell model, see experiments.jit
+BACKENDS = ["numpy", "jit"]
+# Implicit methods from solve_ivp that make use of the jacobian of the model
+STIFF_METHODS = ["Radau", "BDF", "LSODA"]
+
+
+def batch_cell_model(
+    t: float,
+    state_vars: npt.NDArray[np.float_],
+    cell_model: CellModel,
+    params: Any,
+    shape: Tuple[int, ...],
+    stimulus: AnyStimulus,
+    workspace: Any = None,
+) -> npt.NDArray[np.float_]:
+    """Derivative of the state variables of a population of cells. The state of the population
+    is flattened into a single vector, as required by SciPy's solvers. The derivative is written
+    into a new buffer with the layout of the state, so flattening it does not copy it again. The
+    buffer cannot be reused between calls, since the solvers keep the derivatives they receive,
+    but the scratch arrays of the model in :param workspace:, owned by the solver, are.
+    """
+    return cell_model.cell_model(
+        t,
+        state_vars.reshape(shape),
+        params,
+        True,
+        stimulus,
+        out=np.empty(shape),
+        workspace=workspace,
+    ).T.ravel()
+
+
+def jit_cell_model(
+    t: float,
+    state_vars: npt.NDArray[np.float_],
+    kernels: JitKernels,
+    params: npt.NDArray[np.float_],
+    shape: Tuple[int, ...],
+    stimulus: AnyStimulus,
+) -> npt.NDArray[np.float_]:
+    """Derivative of the state variables of one or more cells computed with the compiled
+    :param kernels:, with the state flattened as in batch_cell_model and :param params: as
+    returned by params_array.
+    """
+    state_vars = state_vars.reshape(shape[0], -1).T
+    out = np.empty(state_vars.shape)
+    kernels.cell_model(state_vars, params, float(stimulus.current(t)), out)
+    return out.T.ravel()
+
+
+def get_kernels(cell_model: CellModel, backend: str) -> Optional[JitKernels]:
+    """Compiled kernels of :param cell_model: if the :param backend: requested is "jit" and they
+    are available, otherwise None so that the model is evaluated with NumPy."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend ({backend}) not recognised")
+    return jit_kernels(type(cell_model)) if backend == "jit" else None
+
+
+def batch_jacobian(
+    t: float,
+    state_vars: npt.NDArray[np.float_],
+    cell_model: CellModel,
+    params: Any,
+    shape: Tuple[int, ...],
+    stimulus: AnyStimulus,
+    workspace: Any = None,
+) -> "sparse.csc_matrix":
+    """Jacobian of a population of cells whose state has been flattened as in batch_cell_model,
+    which receives the same arguments. Cells are independent of each other, so only the entries
+    within each cell can be non-zero.
+    """
+    from scipy import sparse
+
+    num_state_vars, num_cells = shape[0], int(np.prod(shape[1:]))
+    jac = cell_model.jacobian(t, state_vars.reshape(shape), params).reshape(
+        num_cells, num_state_vars, num_state_vars
+    )
+    cells = np.arange(num_cells)
+    rows, cols = np.nonzero(
+        cell_model.JACOBIAN_SPARSITY if cell_model.JACOBIAN_SPARSITY is not None
+        else np.ones((num_state_vars, num_state_vars), dtype=bool)
+    )
+    return sparse.csc_matrix(
+        (
+            jac[:, rows, cols].T.ravel(),
+            (
+                (rows[:, np.newaxis]*num_cells + cells).ravel(),
+                (cols[:, np.newaxis]*num_cells + cells).ravel(),
+            ),
+        ),
+        shape=(num_state_vars*num_cells, num_state_vars*num_cells),
+    )
+
+
+def _numpy_jacobian(
+    t: float,
+    state_vars: npt.NDArray[np.float_],
+    *args: Any,
+    jac: Callable[..., Any],
+    numpy_args: Tuple[Any, ...],
+) -> Any:
+    """Call the jacobian :param jac: from stiff_solver_options with the arguments of the NumPy
+    model, ignoring the arguments that solve_ivp passes to the JIT model."""
+    return jac(t, state_vars, *numpy_args)
+
+
+def stiff_solver_options(
+    cell_model: CellModel,
+    method: str,
+    shape: Tuple[int, ...],
+) -> Dict[str, Any]:
+    """Keyword arguments for solve_ivp that provide implicit methods with the jacobian of the
+    model, or with its sparsity pattern when the model does not implement the jacobian."""
+    if method not in STIFF_METHODS:
+        return {}
+    if len(shape) == 1:
+        if cell_model.has_jacobian():
+            # The jacobian receives the same arguments as the function passed to solve_ivp
+            return {
+                "jac": lambda t, y, params, ret_ode, stimulus: cell_model.jacobian(t, y, params)
+            }
+        return {}
+    # LSODA only accepts dense jacobians, which do not scale with the number of cells
+    if method == "LSODA":
+        return {}
+    if cell_model.has_jacobian():
+        return {"jac": batch_jacobian}
+    if cell_model.JACOBIAN_SPARSITY is not None:
+        from scipy import sparse
+        return {
+            "jac_sparsity": sparse.kron(
+                cell_model.JACOBIAN_SPARSITY, sparse.identity(int(np.prod(shape[1:]))),
+                format="csc",
+            )
+        }
+    return {}
+
+
+def rush_larsen(
+    cell_model: CellModel,
+    t_span: Tuple[float, float],
+    y0: npt.NDArray[np.float_],
+    params: Any,
+    dt: float,
+    stimulus: AnyStimulus,
+    backend: str = "numpy",
+) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.float_]]:
+    """Solve the cell model with a fixed time step using the Rush-Larsen scheme. The gates of the
+    model are updated with their exact exponential solution over the time step, while the
+    remaining state variables use explicit Euler. The derivative of the state is written into the
+    same buffer at every step. With the "jit" :param backend: the whole time loop is compiled.
+    """
+    model_derivative = profiled("rhs", cell_model.cell_model)
+    gate_dynamics = profiled("gate_dynamics", cell_model.gate_dynamics)
+    num_steps = int(np.ceil((t_span[1] - t_span[0]) / dt - 1e-9))
+    t = np.minimum(t_span[0] + dt*np.arange(num_steps + 1), t_span[1])
+    gates = cell_model.GATE_INDICES
+    kernels = get_kernels(cell_model=cell_model, backend=backend)
+    if kernels is not None:
+        num_cells = int(np.prod(y0.shape[1:]))
+        y = np.empty((num_steps + 1, num_cells, len(y0)))
+        y[0] = y0.reshape(len(y0), num_cells).T
+        kernels.rush_larsen(
+            t,
+            y,
+            params_array(params, num_cells),
+            np.asarray(stimulus.current(t[:-1]), dtype=np.float_),
+            np.array(gates, dtype=np.int_),
+        )
+        return t, np.moveaxis(y, 0, -1).swapaxes(0, 1).reshape(*y0.shape, num_steps + 1)
+    y = np.empty((num_steps + 1, *y0.shape))
+    y[0] = y0
+    derivative = np.empty_like(y[0])
+    workspace = cell_model.workspace(y0.shape[1:])
+    for step, h in enumerate(np.diff(t)):
+        state = y[step]
+        x_inf, tau = gate_dynamics(t[step], state, params)
+        model_derivative(
+            t[step], state, params, True, stimulus, out=derivative, workspace=workspace
+        )
+        np.multiply(derivative, h, out=y[step + 1])
+        y[step + 1] += state
+        y[step + 1, gates] = x_inf + (state[gates] - x_inf)*np.exp(-h/tau)
+    return t, np.moveaxis(y, 0, -1)
+
+
+def solve_cycle(
+    cell_model: CellModel,
+    cycle_length: float,
+    y0: npt.NDArray[np.float_],
+    params: Any,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    rtol: float = 1e-3,
+    atol: float = 1e-6,
+    stimulus: Optional[AnyStimulus] = None,
+    backend: str = "numpy",
+    dense_output: Optional[List["OdeSolution"]] = None,
+    stats: Optional[List[SolverStats]] = None,
+) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.float_]]:
+    """Solve one cycle of the cell model starting from :param y0: with the integrator requested.
+    The cycle is split at the times where the stimulus switches on or off and each segment is
+    solved separately, so that solvers never step across the discontinuities of the stimulus.
+    :param dt: time step used by fixed step integrators.
+    :param method: method used by solve_ivp. The jacobian of the model is used by the methods in
+    STIFF_METHODS.
+    :param max_step: maximum step size allowed to solve_ivp.
+    :param rtol: relative tolerance of solve_ivp.
+    :param atol: absolute tolerance of solve_ivp.
+    :param stimulus: stimulus applied to the cell, defaults to the stimulus of the model.
+    :param backend: one of BACKENDS. The "jit" backend compiles the model, and the loop of fixed
+    step integrators, when Numba is installed and the model defines scalar kernels. Otherwise the
+    model is evaluated with NumPy.
+    :param dense_output: list to which the dense output of each segment solved by solve_ivp is
+    appended, e.g. to locate threshold crossings between steps (see events.threshold_crossings).
+    :param stats: list to which the statistics of the solver over the cycle are appended.
+    :returns: the time and the state variables, with time as the last axis.
+    """
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Integrator ({integrator}) not recognised")
+    stimulus = stimulus or cell_model.STIMULUS
+    kernels = get_kernels(cell_model=cell_model, backend=backend)
+    if kernels is not None:
+        jit_params = params_array(params, int(np.prod(y0.shape[1:])))
+    edges = [0, *stimulus.breakpoints((0, cycle_length)), cycle_length]
+    t = []
+    y = []
+    segment_stats = []
+    start_time = time.perf_counter()
+    for segment_num, t_span in enumerate(zip(edges[:-1], edges[1:])):
+        if integrator == "rush_larsen":
+            with section("solver"):
+                this_t, this_y = rush_larsen(
+                    cell_model=cell_model,
+                    t_span=t_span,
+                    y0=y0,
+                    params=params,
+                    dt=dt,
+                    stimulus=stimulus,
+                    backend=backend,
+                )
+            segment_stats.append(SolverStats(nfev=len(this_t) - 1, num_steps=len(this_t) - 1))
+        else:
+            from scipy.integrate import solve_ivp
+            if y0.ndim == 1:
+                fun, args = cell_model.cell_model, (params, True, stimulus)
+            else:
+                fun, args = batch_cell_model, (
+                    cell_model, params, y0.shape, stimulus, cell_model.workspace(y0.shape[1:])
+                )
+            options = stiff_solver_options(cell_model=cell_model, method=method, shape=y0.shape)
+            if kernels is not None:
+                # The jacobian is still evaluated with NumPy, so it keeps the original arguments
+                if "jac" in options:
+                    options["jac"] = functools.partial(
+                        _numpy_jacobian, jac=options["jac"], numpy_args=args
+                    )
+                fun, args = jit_cell_model, (kernels, jit_params, y0.shape, stimulus)
+            if callable(options.get("jac")):
+                options["jac"] = profiled("jacobian", options["jac"])
+            with section("solver"):
+                this_segment = solve_ivp(
+                    fun=profiled("rhs", fun),
+                    t_span=t_span,
+                    y0=y0.ravel(),
+                    method=method,
+                    args=args,
+                    max_step=max_step,
+                    rtol=rtol,
+                    atol=atol,
+                    dense_output=dense_output is not None,
+                    **options,
+                )
+            segment_stats.append(SolverStats(
+                nfev=this_segment.nfev,
+                njev=this_segment.njev,
+                nlu=this_segment.nlu,
+                num_steps=len(this_segment.t) - 1,
+            ))
+            if dense_output is not None:
+                dense_output.append(this_segment.sol)
+            this_t, this_y = this_segment.t, this_segment.y.reshape(*y0.shape, -1)
+        # Each segment starts where the previous one ended
+        first = 0 if segment_num == 0 else 1
+        t.append(this_t[first:])
+        y.append(this_y[..., first:])
+        y0 = this_y[..., -1]
+    if stats is not None:
+        stats.append(
+            sum_stats(segment_stats)._replace(wall_time=time.perf_counter() - start_time)
+        )
+    return np.concatenate(t), np.concatenate(y, axis=-1)
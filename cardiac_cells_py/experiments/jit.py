@@ -0,0 +1,100 @@
+"""Optional backend that compiles cell models with Numba. Models opt in by implementing the scalar
+kernels of CellModel (see CellModel.scalar_cell_model), which are compiled together with a loop
+over the cells of a population and with the time loop of the Rush-Larsen integrator. When Numba
+is not installed, or the model does not opt in, the integrators fall back to NumPy.
+
+Install Numba with ``pip install -e .[jit]`` to use it.
+"""
+import functools
+import importlib.util
+import warnings
+from typing import Any, Callable, List, NamedTuple, Optional, Type
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+
+# Whether the JIT backend can be used in this environment. Numba itself is only imported when a
+# model is compiled, as importing it is slow
+JIT_AVAILABLE = importlib.util.find_spec("numba") is not None
+
+
+class JitKernels(NamedTuple):
+    """Tuple containing the compiled kernels of a cell model."""
+    # Derivative of a population of cells, called as
+    # cell_model(state_vars, params, stimulus_current, out) with state_vars and out of shape
+    # (num_cells, num_state_vars) and params of shape (num_cells, num_params). Keeping the values
+    # of each cell contiguous is faster than the layout used by the integrators.
+    cell_model: Callable[..., None]
+    # Rush-Larsen time loop, called as rush_larsen(t, y, params, stimulus_current, gate_indices)
+    # with y of shape (len(t), num_cells, num_state_vars) holding the initial state in y[0] and
+    # stimulus_current holding the current at each time step
+    rush_larsen: Callable[..., None]
+
+
+# Last parameters converted by params_array, so that integrators that call the kernels once per
+# time step, e.g. in tissue simulations, only convert them once
+_LAST_PARAMS: List[Any] = [None, None, None]
+
+
+def params_array(params: Any, num_cells: int) -> npt.NDArray[np.float_]:
+    """Parameters of a cell, or stacked parameters of a population of cells, as a float array of
+    shape (num_cells, num_params) as required by the compiled kernels."""
+    if params is not _LAST_PARAMS[0] or num_cells != _LAST_PARAMS[1]:
+        array = np.asarray(params, dtype=np.float_)
+        _LAST_PARAMS[:] = [
+            params,
+            num_cells,
+            np.ascontiguousarray(
+                np.broadcast_to(array.reshape(len(array), -1), (len(array), num_cells)).T
+            ),
+        ]
+    return _LAST_PARAMS[2]
+
+
+@functools.lru_cache(maxsize=None)
+def jit_kernels(cell_model: Type[CellModel]) -> Optional[JitKernels]:
+    """Compile the kernels of the :param cell_model: class. Returns None, with a warning, when the
+    kernels cannot be compiled so that callers can fall back to NumPy."""
+    if not JIT_AVAILABLE:
+        warnings.warn("Numba is not installed, falling back to NumPy")
+        return None
+    if not cell_model.has_scalar_kernel():
+        warnings.warn(
+            f"{cell_model.__name__} does not define scalar kernels, falling back to NumPy"
+        )
+        return None
+    import numba
+
+    # Inlining the kernels into the loops avoids creating array views on every call
+    scalar_cell_model = numba.njit(inline="always")(cell_model.scalar_cell_model)
+    scalar_gate_dynamics = numba.njit(inline="always")(cell_model.scalar_gate_dynamics)
+
+    @numba.njit
+    def population_cell_model(state_vars, params, stimulus_current, out):
+        for cell in range(state_vars.shape[0]):
+            scalar_cell_model(state_vars[cell], params[cell], stimulus_current, out[cell])
+
+    @numba.njit
+    def rush_larsen(t, y, params, stimulus_current, gate_indices):
+        num_cells, num_state_vars = y.shape[1], y.shape[2]
+        derivative = np.empty(num_state_vars)
+        x_inf = np.empty(len(gate_indices))
+        tau = np.empty(len(gate_indices))
+        for step in range(len(t) - 1):
+            h = t[step + 1] - t[step]
+            for cell in range(num_cells):
+                state = y[step, cell]
+                scalar_cell_model(state, params[cell], stimulus_current[step], derivative)
+                for var in range(num_state_vars):
+                    y[step + 1, cell, var] = state[var] + h*derivative[var]
+                if len(gate_indices):
+                    scalar_gate_dynamics(state, params[cell], x_inf, tau)
+                for gate in range(len(gate_indices)):
+                    var = gate_indices[gate]
+                    y[step + 1, cell, var] = (
+                        x_inf[gate] + (state[var] - x_inf[gate])*np.exp(-h/tau[gate])
+                    )
+
+    return JitKernels(cell_model=population_cell_model, rush_larsen=rush_larsen)
@@ -0,0 +1,116 @@
+"""Find the limit cycle of a paced cell directly, instead of pacing the cell until it reaches steady
+state. The limit cycle is the fixed point y0 = phi(y0) of the map phi that takes the state of the
+cell at the start of a beat to its state at the end of the beat. The fixed point is found with
+Newton's method, which also yields the Floquet multipliers of the limit cycle.
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.integrators import solve_cycle
+
+
+class LimitCycle(NamedTuple):
+    """Tuple containing the limit cycle of a paced cell.
+    """
+    # State variables at the start of a beat in the limit cycle
+    initial_conditions: npt.NDArray[np.float_]
+    # Eigenvalues of the jacobian of the one beat map at the limit cycle
+    floquet_multipliers: npt.NDArray[np.complex_]
+    # Number of beat maps evaluated to find the limit cycle
+    num_iterations: int
+    # Whether the limit cycle was found within the tolerance requested
+    converged: bool
+
+    @property
+    def stable(self) -> bool:
+        """Whether perturbations of the limit cycle decay from beat to beat."""
+        return bool(np.all(np.abs(self.floquet_multipliers) < 1))
+
+    def alternans_prone(self, threshold: float = 0.9) -> bool:
+        """Whether the limit cycle has a multiplier close to -1, i.e. perturbations that alternate
+        in sign from beat to beat and decay slowly."""
+        return bool(np.any(
+            (self.floquet_multipliers.real < 0) & (np.abs(self.floquet_multipliers) >= threshold)
+        ))
+
+
+def find_limit_cycle(
+    cell_model: CellModel,
+    cycle_length: int,
+    cell_type: str,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    tolerance: float = 1e-6,
+    max_iterations: int = 20,
+    perturbation: float = 1e-6,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    rtol: float = 1e-8,
+    atol: float = 1e-10,
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+) -> LimitCycle:
+    """Find the limit cycle of a cell paced at :param cycle_length: starting from the
+    :param initial_conditions: given, or the standard conditions of the model. Newton's method is
+    applied to phi(y0) - y0 until its largest component is below :param tolerance:, using a
+    finite difference jacobian with the :param perturbation: given. The unperturbed and perturbed
+    beats are solved together as a population of cells, so they share the same solver steps. When
+    a Newton step does not reduce the residual, the cell is paced for one beat instead. The
+    remaining arguments are used as in run_model.
+    """
+    params = cell_model.parameters(cell_type=cell_type)
+    y0 = np.array(
+        initial_conditions if initial_conditions is not None else cell_model.INITIAL_CONDITIONS,
+        dtype=np.float_,
+    )
+    num_state_vars = len(y0)
+    batch_params = cell_model.stack_parameters([params]*(num_state_vars + 1))
+    identity = np.eye(num_state_vars)
+    best = None
+    previous = None
+    for iteration in range(1, max_iterations + 1):
+        # Columns are the state at the start of the beat followed by its perturbations
+        _, this_y = solve_cycle(
+            cell_model=cell_model,
+            cycle_length=cycle_length,
+            y0=np.column_stack([y0, y0[:, np.newaxis] + perturbation*identity]),
+            params=batch_params,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            rtol=rtol,
+            atol=atol,
+            stimulus=stimulus,
+            backend=backend,
+        )
+        y_end = this_y[:, 0, -1]
+        monodromy = (this_y[:, 1:, -1] - y_end[:, np.newaxis]) / perturbation
+        residual = y_end - y0
+        error = np.max(np.abs(residual))
+        if best is None or error < best[1]:
+            best = (y0, error, monodromy)
+        if error < tolerance:
+            break
+        if previous is not None and error >= previous[1]:
+            # The Newton step did not help, pace the cell from the previous state instead
+            y0 = previous[0]
+            previous = None
+            continue
+        previous = (y_end, error)
+        try:
+            y0 = y0 - np.linalg.solve(monodromy - identity, residual)
+        except np.linalg.LinAlgError:
+            y0 = y_end
+            previous = None
+    return LimitCycle(
+        initial_conditions=best[0],
+        floquet_multipliers=np.linalg.eigvals(best[2]),
+        num_iterations=iteration,
+        converged=bool(best[1] < tolerance),
+    )
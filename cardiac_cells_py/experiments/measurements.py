@@ -1,9 +1,147 @@
 """Measurements that can be done on an action potential"""
-from typing import Tuple
+from typing import NamedTuple, Sequence, Tuple
 import numpy as np
 import numpy.typing as npt
 
-from cardiac_cells_py.experiments.utils import ModelSolution
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+from cardiac_cells_py.experiments.profiling import timed
+
+# Repolarisation percentages measured by default by measure_beats
+DEFAULT_REPOLARISATION_PERCENTS = (30, 50, 90)
+
+
+# Biomarkers of a beat that can be looked up by name, see BeatBiomarkers.named
+BIOMARKER_NAMES = ["apd30", "apd50", "apd90", "peak", "resting", "max_upstroke", "triangulation"]
+
+
+class BeatBiomarkers(NamedTuple):
+    """Tuple containing the biomarkers of every beat of one or more action potential signals, as
+    returned by measure_beats. Fields other than beat_start and repolarisation_percents have shape
+    (..., num_beats), where ... are the leading dimensions of the signals (e.g. the cells of a
+    population)."""
+    # Time at which each beat starts, i.e. at which its stimulus is applied
+    beat_start: npt.NDArray[np.float_]
+    # Maximum value of the action potential
+    peak: npt.NDArray[np.float_]
+    # Value of the action potential at the start of the beat
+    resting: npt.NDArray[np.float_]
+    # Maximum rate of rise of the action potential
+    max_upstroke: npt.NDArray[np.float_]
+    # Repolarisation percentages at which the APDs were measured
+    repolarisation_percents: Tuple[int, ...]
+    # APD at each repolarisation percentage, with shape (len(repolarisation_percents), ...,
+    # num_beats). NaN for beats that do not repolarise before the next beat starts.
+    apd: npt.NDArray[np.float_]
+
+    def apd_at(self, repolarisation_percent: int) -> npt.NDArray[np.float_]:
+        """APD of every beat at the :param repolarisation_percent: given."""
+        if repolarisation_percent not in self.repolarisation_percents:
+            raise ValueError(
+                f"Repolarisation percentage ({repolarisation_percent}) not measured"
+            )
+        return self.apd[self.repolarisation_percents.index(repolarisation_percent)]
+
+    @property
+    def triangulation(self) -> npt.NDArray[np.float_]:
+        """Triangulation of every beat, i.e. APD90 - APD30."""
+        return self.apd_at(90) - self.apd_at(30)
+
+    def named(self, name: str) -> npt.NDArray[np.float_]:
+        """Biomarker :param name: of every beat, one of BIOMARKER_NAMES or "apd<percent>" for any
+        of the repolarisation percentages measured."""
+        if name in ("peak", "resting", "max_upstroke", "triangulation"):
+            return getattr(self, name)
+        if name.startswith("apd") and name[3:].isdigit():
+            return self.apd_at(int(name[3:]))
+        raise ValueError(f"Biomarker ({name}) not recognised")
+
+    @property
+    def alternans(self) -> npt.NDArray[np.float_]:
+        """Absolute difference between the APD90 of consecutive beats, with shape
+        (..., num_beats - 1)."""
+        return np.abs(np.diff(self.apd_at(90), axis=-1))
+
+
+def cycle_starts(t: npt.NDArray[np.float_], cycle_length: float) -> npt.NDArray[np.float_]:
+    """Start of the beats of a signal sampled at :param t: and paced every :param cycle_length:
+    milliseconds from t[0]. Beats without samples of their own, e.g. those dropped between the
+    beats kept by retain_beats, are skipped, so each beat runs until the next one that was kept."""
+    num_beats = max(1, int(np.ceil((t[-1] - t[0]) / cycle_length - 1e-9)))
+    starts = t[0] + cycle_length*np.arange(num_beats)
+    num_samples = np.diff(np.searchsorted(t, np.append(starts, np.inf)))
+    # The first beat always starts at t[0], and the last sample of a kept beat can fall on the
+    # start of the next beat when that one was dropped
+    return starts[(num_samples >= 2) | (starts == starts[0])]
+
+
+@timed("measurements")
+def measure_beats(
+    t: npt.NDArray[np.float_],
+    ap_signal: npt.NDArray[np.float_],
+    beat_starts: Sequence[float],
+    repolarisation_percents: Sequence[int] = DEFAULT_REPOLARISATION_PERCENTS,
+) -> BeatBiomarkers:
+    """Measure the biomarkers of every beat of :param ap_signal:, sampled at :param t:, in a
+    single vectorised pass. Leading dimensions of :param ap_signal: are treated as independent
+    signals sampled at the same times, e.g. the cells of a population.
+    :param beat_starts: times at which the beats start, e.g. as given by cycle_starts or
+    PacingProtocol.beat_boundaries. Each beat lasts until the next one starts.
+    :param repolarisation_percents: percentages at which the APDs are measured. The APD at p% is
+    the time from the start of the beat until the action potential first falls below
+    peak - p/100*(peak - resting) after its peak, interpolated between samples.
+    """
+    t = np.asarray(t)
+    ap_signal = np.asarray(ap_signal)
+    beat_starts = np.asarray(beat_starts, dtype=np.float_)
+    starts = np.searchsorted(t, beat_starts)
+    ends = np.append(starts[1:], len(t))
+    lengths = ends - starts
+    if np.any(lengths < 2):
+        raise ValueError("Every beat must contain at least two samples")
+    # Samples of each beat, padded to the length of the longest beat by repeating its last sample,
+    # which changes neither the peak nor the first crossing of any threshold
+    offsets = np.arange(np.max(lengths))
+    samples = np.minimum(starts[:, np.newaxis] + offsets, ends[:, np.newaxis] - 1)
+    beat_t = t[samples]
+    beat_ap = ap_signal[..., samples]
+
+    peak_index = np.argmax(beat_ap, axis=-1)[..., np.newaxis]
+    peak = np.take_along_axis(beat_ap, peak_index, axis=-1)[..., 0]
+    resting = beat_ap[..., 0]
+    dt = np.diff(beat_t, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Repeated times, at the padding or where beats are joined, do not count
+        max_upstroke = np.max(
+            np.where(dt > 0, np.diff(beat_ap, axis=-1) / dt, -np.inf), axis=-1
+        )
+
+    repolarisation_percents = tuple(repolarisation_percents)
+    fraction = np.reshape(repolarisation_percents, (-1,) + (1,)*peak.ndim) / 100
+    thresholds = (peak - fraction*(peak - resting))[..., np.newaxis]
+    below = (offsets >= peak_index) & (beat_ap <= thresholds)
+    crossing = np.argmax(below, axis=-1)[..., np.newaxis]
+    repolarised = np.take_along_axis(below, crossing, axis=-1)
+    before = np.maximum(crossing - 1, 0)
+    all_t = np.broadcast_to(beat_t, below.shape)
+    all_ap = np.broadcast_to(beat_ap, below.shape)
+    t_before = np.take_along_axis(all_t, before, axis=-1)
+    t_after = np.take_along_axis(all_t, crossing, axis=-1)
+    ap_before = np.take_along_axis(all_ap, before, axis=-1)
+    ap_after = np.take_along_axis(all_ap, crossing, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        step_fraction = np.where(
+            ap_after != ap_before, (thresholds - ap_before) / (ap_after - ap_before), 1.
+        )
+    crossing_t = t_before + step_fraction*(t_after - t_before)
+    apd = np.where(repolarised, crossing_t, np.nan)[..., 0] - beat_starts
+    return BeatBiomarkers(
+        beat_start=beat_starts,
+        peak=peak,
+        resting=resting,
+        max_upstroke=max_upstroke,
+        repolarisation_percents=repolarisation_percents,
+        apd=apd,
+    )
 
 def measure_apd(
     t: npt.NDArray[np.float_],
@@ -19,6 +157,18 @@ def measure_apd(
     return t[max_location+apd_x]
 
 
+def elicits_ap(
+    ap_signal: npt.NDArray[np.float_],
+    reference_amplitude: float,
+    min_fraction: float = 0.5,
+) -> bool:
+    """Whether a stimulus applied at the start of :param ap_signal: elicited an action potential,
+    i.e. the signal rose by at least :param min_fraction: of the amplitude of a reference action
+    potential.
+    """
+    return bool(np.max(ap_signal) - ap_signal[0] >= min_fraction * reference_amplitude)
+
+
 def extract_last_beat(
     model_solution: ModelSolution,
     cycle_length: int,
@@ -0,0 +1,31 @@
+"""Container for the solution of a cell model."""
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.experiments.events import DenseOutput, ThresholdCrossings
+from cardiac_cells_py.experiments.profiling import SolverStats
+
+
+class ModelSolution(NamedTuple):
+    """Tuple containing the solution to the PDEs of a cardiac cell model.
+    """
+    # Time
+    t: npt.NDArray[np.float_]
+    # State variables
+    state_vars: npt.NDArray[np.float_]
+    # Resulting currents computed from the state variables
+    currents: npt.NDArray[np.float_]
+    # Number of cycles that were solved, if known
+    num_cycles: Optional[int] = None
+    # Whether the solution reached steady state, if convergence was checked
+    converged: Optional[bool] = None
+    # Threshold crossings of the last beat, if they were detected while solving it
+    crossings: Optional[ThresholdCrossings] = None
+    # Statistics of the solver over each of the beats solved: only the beat itself for the beats
+    # yielded while solving, every beat solved for the solutions returned by run_model
+    solver_stats: Optional[List[SolverStats]] = None
+    # Interpolant of the state variables over the last beat, at the times of t, if it was kept
+    # while solving it
+    dense_output: Optional[DenseOutput] = None
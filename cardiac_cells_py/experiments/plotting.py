@@ -0,0 +1,18 @@
+"""Plotting backend of the experiments, which only ever save their figures to files. Matplotlib is
+imported when the first figure is made rather than with the experiments, since it dominates the
+start up time of the command line, and uses the non-interactive Agg backend unless another one is
+set with MPLBACKEND, so figures can be made without a display.
+"""
+import functools
+import os
+from typing import Any
+
+
+@functools.lru_cache(maxsize=None)
+def pyplot() -> Any:
+    """The matplotlib.pyplot module, set up to render figures to files."""
+    import matplotlib
+    if "MPLBACKEND" not in os.environ:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
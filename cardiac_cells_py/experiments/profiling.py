@@ -0,0 +1,130 @@
+"""Instrumentation of the experiments. Every beat solved records the statistics of its solver in a
+SolverStats, which is returned with its ModelSolution. On top of that, a Profile can be activated
+with profile() to find out where the time goes: while it is active, it aggregates the calls to
+the derivative of the model and the time spent in it, in the solvers and in the measurements,
+together with the statistics of all the beats solved. Nothing is timed when no profile is active.
+"""
+import collections
+import contextlib
+import functools
+import time
+from typing import Any, Callable, DefaultDict, Iterable, Iterator, List, NamedTuple, TypeVar
+
+FunctionT = TypeVar("FunctionT", bound=Callable[..., Any])
+
+
+class SolverStats(NamedTuple):
+    """Tuple containing the statistics of the solver over a beat."""
+    # Number of evaluations of the derivative of the model
+    nfev: int = 0
+    # Number of evaluations of the jacobian of the model
+    njev: int = 0
+    # Number of LU decompositions
+    nlu: int = 0
+    # Number of steps taken by the solver
+    num_steps: int = 0
+    # Wall-clock time spent solving, in seconds
+    wall_time: float = 0.
+
+
+def sum_stats(stats: Iterable[SolverStats]) -> SolverStats:
+    """Statistics of several beats, or segments of a beat, combined."""
+    return SolverStats(*(sum(values) for values in zip(SolverStats(), *stats)))
+
+
+class Profile:
+    """Calls made to, and time spent in, each section of the code while the profile is active."""
+    def __init__(self):
+        """Construct an empty profile."""
+        self.calls: DefaultDict[str, int] = collections.defaultdict(int)
+        self.time: DefaultDict[str, float] = collections.defaultdict(float)
+        self.solver_stats: List[SolverStats] = []
+
+    def summary(self) -> str:
+        """Table with the calls and the time of each section, followed by the solver statistics
+        of all the beats."""
+        lines = [f"{'Section':<24}{'Calls':>10}{'Time (s)':>12}"]
+        for name in sorted(self.time, key=self.time.get, reverse=True):
+            lines.append(f"{name:<24}{self.calls[name]:>10}{self.time[name]:>12.3f}")
+        if "solver" in self.time:
+            # The solvers call the model, so the time in the solvers themselves is the difference
+            overhead = (
+                self.time["solver"] - self.time.get("rhs", 0.) - self.time.get("jacobian", 0.)
+            )
+            lines.append(f"{'solver excluding model':<24}{'':>10}{overhead:>12.3f}")
+        total = sum_stats(self.solver_stats)
+        lines.append(
+            f"{len(self.solver_stats)} beats solved: {total.nfev} RHS evaluations, "
+            f"{total.njev} jacobian evaluations, {total.nlu} LU decompositions, "
+            f"{total.num_steps} steps"
+        )
+        return "\n".join(lines)
+
+
+# Profiles currently active, see profile()
+_ACTIVE: List[Profile] = []
+
+
+@contextlib.contextmanager
+def profile() -> Iterator[Profile]:
+    """Context manager that collects a Profile of the code run within it."""
+    this_profile = Profile()
+    _ACTIVE.append(this_profile)
+    try:
+        yield this_profile
+    finally:
+        _ACTIVE.remove(this_profile)
+
+
+def _add_time(name: str, elapsed: float) -> None:
+    """Add a call to :param name: that took :param elapsed: seconds to the active profiles."""
+    for active in _ACTIVE:
+        active.calls[name] += 1
+        active.time[name] += elapsed
+
+
+@contextlib.contextmanager
+def section(name: str) -> Iterator[None]:
+    """Time the code within it as a call to the section :param name: of the active profiles."""
+    if not _ACTIVE:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_time(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[FunctionT], FunctionT]:
+    """Decorator that times every call to a function as a call to the section :param name:."""
+    def decorator(function: FunctionT) -> FunctionT:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled(name: str, function: FunctionT) -> FunctionT:
+    """:param function: timed as the section :param name: if a profile is active, otherwise the
+    function itself, so that hot functions such as the derivative of the model only pay for the
+    instrumentation when it is requested."""
+    if not _ACTIVE:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _add_time(name, time.perf_counter() - start)
+    return wrapper
+
+
+def record_stats(stats: SolverStats) -> None:
+    """Add the statistics of a beat to the active profiles."""
+    for active in _ACTIVE:
+        active.solver_stats.append(stats)
@@ -0,0 +1,561 @@
+"""Pacing protocols, i.e. the times at which a cell is stimulated, and an engine that solves a whole
+protocol as a single continuous run. Adaptive solvers are built once for the whole protocol, so
+they keep their step size and history from one beat to the next rather than learning them again
+at the start of every beat. The beats are split off the steps of the solver as they are computed.
+"""
+import functools
+import time
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus, StimulusTrain
+from cardiac_cells_py.experiments.events import DenseOutput, threshold_crossings
+from cardiac_cells_py.experiments.integrators import (
+    INTEGRATORS,
+    STIFF_METHODS,
+    get_kernels,
+    jit_cell_model,
+    rush_larsen,
+)
+from cardiac_cells_py.experiments.jit import params_array
+from cardiac_cells_py.experiments.measurements import measure_beats
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+from cardiac_cells_py.experiments.profiling import (
+    SolverStats,
+    profiled,
+    record_stats,
+    section,
+)
+from cardiac_cells_py.experiments.storage import SolutionWriter
+from cardiac_cells_py.experiments.utils import (
+    beat_has_converged,
+    collect_solver_stats,
+    retain_beats,
+)
+
+# Methods accepted by solve_ivp, each implemented by the solver of the same name in
+# scipy.integrate, which is only imported once a protocol is solved
+SOLVERS = ["RK23", "RK45", "DOP853", "Radau", "BDF", "LSODA"]
+
+
+class PacingProtocol(NamedTuple):
+    """Times at which a cell is stimulated. Each stimulus starts a new beat, which lasts until the
+    next stimulus or the end of the protocol. Times are in milliseconds from the start of the
+    protocol.
+    """
+    # Times at which the stimuli are applied, in increasing order
+    stimulus_times: npt.NDArray[np.float_]
+    # Time at which the protocol ends
+    end_time: float
+
+    @classmethod
+    def constant(cls, cycle_length: float, num_beats: int) -> "PacingProtocol":
+        """Pace the cell :param num_beats: times at a constant :param cycle_length:."""
+        return cls(
+            stimulus_times=cycle_length*np.arange(num_beats, dtype=np.float_),
+            end_time=float(cycle_length*num_beats),
+        )
+
+    @classmethod
+    def s1s2(
+        cls,
+        s1_cycle_length: float,
+        num_s1: int,
+        s2_interval: float,
+        s2_cycle_length: float = 1000,
+    ) -> "PacingProtocol":
+        """Pace the cell :param num_s1: times at :param s1_cycle_length:, then apply an S2 stimulus
+        :param s2_interval: after the last S1 stimulus and follow the S2 beat for
+        :param s2_cycle_length:."""
+        s1_times = s1_cycle_length*np.arange(num_s1, dtype=np.float_)
+        s2_time = s1_times[-1] + s2_interval
+        return cls(
+            stimulus_times=np.append(s1_times, s2_time),
+            end_time=float(s2_time + s2_cycle_length),
+        )
+
+    @classmethod
+    def dynamic(
+        cls,
+        cycle_lengths: Sequence[float],
+        beats_per_cycle_length: int,
+    ) -> "PacingProtocol":
+        """Pace the cell :param beats_per_cycle_length: times at each of the
+        :param cycle_lengths:, in the order given, as in dynamic restitution protocols."""
+        beat_lengths = np.repeat(np.asarray(cycle_lengths, dtype=np.float_), beats_per_cycle_length)
+        boundaries = np.concatenate([[0.], np.cumsum(beat_lengths)])
+        return cls(stimulus_times=boundaries[:-1], end_time=float(boundaries[-1]))
+
+    @classmethod
+    def from_times(cls, stimulus_times: Sequence[float], end_time: float) -> "PacingProtocol":
+        """Stimulate the cell at arbitrary :param stimulus_times: until :param end_time:."""
+        stimulus_times = np.sort(np.asarray(stimulus_times, dtype=np.float_))
+        if len(stimulus_times) and not 0 <= stimulus_times[0] <= stimulus_times[-1] < end_time:
+            raise ValueError(f"Stimulus times must be within the protocol (0, {end_time})")
+        return cls(stimulus_times=stimulus_times, end_time=float(end_time))
+
+    @property
+    def beat_boundaries(self) -> npt.NDArray[np.float_]:
+        """Start and end times of the beats of the protocol."""
+        return np.unique(np.concatenate([[0.], self.stimulus_times, [self.end_time]]))
+
+    @property
+    def num_beats(self) -> int:
+        """Number of beats in the protocol."""
+        return len(self.beat_boundaries) - 1
+
+    def stimulus_train(self, pulse: Stimulus) -> StimulusTrain:
+        """Stimulus that applies :param pulse: at each of the stimulus times of the protocol."""
+        return StimulusTrain(pulse=pulse, times=self.stimulus_times)
+
+
+class SolverStep(NamedTuple):
+    """Tuple containing one or more consecutive steps of an integrator."""
+    # Times at the end of the steps
+    t: npt.NDArray[np.float_]
+    # State variables at those times, with time as the last axis
+    y: npt.NDArray[np.float_]
+    # Statistics of the integrator from the start of the run to the end of the steps
+    total_stats: SolverStats
+    # State variables at any time within the step, only for single steps of adaptive solvers
+    dense_output: Optional[Callable[[float], npt.NDArray[np.float_]]] = None
+
+
+def _rush_larsen_segments(
+    cell_model: CellModel,
+    edges: npt.NDArray[np.float_],
+    train: StimulusTrain,
+    y0: npt.NDArray[np.float_],
+    params: Any,
+    dt: float,
+    backend: str,
+) -> Iterator[SolverStep]:
+    """Solve the cell model from the first to the last of :param edges: with the Rush-Larsen
+    scheme, yielding the steps between consecutive edges at once. The scheme keeps no state
+    between steps, so it is restarted at each edge at no cost, which keeps its steps from crossing
+    the discontinuities of the stimulus."""
+    num_steps = 0
+    for t_start, t_end in zip(edges[:-1], edges[1:]):
+        # Between two edges only the last stimulus applied can be active, so the model receives it
+        # as a single pulse, which is cheaper to evaluate than the whole train
+        last = np.searchsorted(train.times, t_start, side="right") - 1
+        with section("solver"):
+            this_t, this_y = rush_larsen(
+                cell_model=cell_model,
+                t_span=(t_start, t_end),
+                y0=y0,
+                params=params,
+                dt=dt,
+                stimulus=train.pulse._replace(
+                    start=train.pulse.start + (train.times[last] if last >= 0 else -np.inf)
+                ),
+                backend=backend,
+            )
+        num_steps += len(this_t) - 1
+        y0 = this_y[:, -1]
+        yield SolverStep(
+            t=this_t[1:],
+            y=this_y[:, 1:],
+            total_stats=SolverStats(nfev=num_steps, num_steps=num_steps),
+        )
+
+
+def _solver_steps(
+    cell_model: CellModel,
+    edges: npt.NDArray[np.float_],
+    train: StimulusTrain,
+    y0: npt.NDArray[np.float_],
+    params: Any,
+    method: str,
+    max_step: float,
+    rtol: float,
+    atol: float,
+    backend: str,
+    dense_output: bool,
+) -> Iterator[SolverStep]:
+    """Solve the cell model from the first to the last of :param edges: with a single solver of
+    scipy.integrate, yielding its steps one at a time. Ahead of each edge the maximum step of the
+    solver is reduced so that its steps end on the edge rather than cross the discontinuity of the
+    stimulus there. LSODA fixes its maximum step when it is built, so its steps can cross edges
+    and it relies on its error control instead. The dense output of each step is returned if
+    :param dense_output: is set or the step crosses an edge.
+    """
+    from scipy import integrate
+
+    kernels = get_kernels(cell_model=cell_model, backend=backend)
+    if kernels is not None:
+        fun = functools.partial(
+            jit_cell_model,
+            kernels=kernels,
+            params=params_array(params, 1),
+            shape=y0.shape,
+            stimulus=train,
+        )
+    else:
+        fun = functools.partial(
+            cell_model.cell_model,
+            params=params,
+            ret_ode=True,
+            stimulus=train,
+        )
+    solver_options = {}
+    if method in STIFF_METHODS and cell_model.has_jacobian():
+        solver_options["jac"] = profiled(
+            "jacobian", lambda t, y: cell_model.jacobian(t, y, params)
+        )
+    solver = getattr(integrate, method)(
+        fun=profiled("rhs", fun),
+        t0=edges[0],
+        y0=y0,
+        t_bound=edges[-1],
+        max_step=max_step,
+        rtol=rtol,
+        atol=atol,
+        **solver_options,
+    )
+    edges = edges.tolist()
+    edge_num = 1
+    num_steps = 0
+    while solver.status == "running":
+        # Edges up to the end of the last step, give or take rounding, have been reached
+        while edge_num < len(edges) - 1 and edges[edge_num] - solver.t <= _time_tolerance(solver.t):
+            edge_num += 1
+        next_edge = edges[edge_num]
+        solver.max_step = min(max_step, max(next_edge - solver.t, _time_tolerance(next_edge)))
+        with section("solver"):
+            message = solver.step()
+        if solver.status == "failed":
+            raise RuntimeError(f"Solver failed at t={solver.t}: {message}")
+        num_steps += 1
+        yield SolverStep(
+            t=np.array([solver.t]),
+            y=solver.y[:, np.newaxis],
+            total_stats=SolverStats(
+                nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu, num_steps=num_steps
+            ),
+            dense_output=(
+                solver.dense_output()
+                if dense_output or solver.t > next_edge + _time_tolerance(next_edge) else None
+            ),
+        )
+
+
+def _time_tolerance(t: float) -> float:
+    """Distance below which times around :param t: are taken to be the same, e.g. the end of a
+    step and an edge it was meant to land on, well above rounding errors."""
+    return 1e-12*max(1., abs(t))
+
+
+def iter_protocol_beats(
+    cell_model: CellModel,
+    protocol: PacingProtocol,
+    cell_type: str,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    rtol: float = 1e-3,
+    atol: float = 1e-6,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+    crossing_percents: Optional[Sequence[int]] = None,
+    keep_dense_output: bool = False,
+    stop_at_repolarisation: Optional[int] = None,
+) -> Iterator[ModelSolution]:
+    """Solve the cell model over the whole :param protocol: as one continuous run, yielding the
+    solution of each beat as soon as it is computed. Adaptive solvers use a single solver from the
+    start to the end of the protocol, which keeps its step size and history across beats, and the
+    beats are split off its steps at their boundaries. The :param stimulus: is the pulse applied
+    at each stimulus time and defaults to the stimulus of the model. The remaining arguments are
+    used as in run_model and solve_cycle. Time is measured from the start of the protocol and each
+    beat includes the states at both of its boundaries. The dense output of the steps of each beat
+    is kept until the beat ends to locate its threshold crossings when :param crossing_percents:
+    are given, and it is returned with the beat if :param keep_dense_output: is set.
+    If :param stop_at_repolarisation: is given, the last beat of the protocol ends as soon as its
+    action potential falls below that percentage of repolarisation from its peak after the
+    stimulus, e.g. when only its APD is needed, rather than at the end of the protocol.
+    """
+    if integrator not in INTEGRATORS:
+        raise ValueError(f"Integrator ({integrator}) not recognised")
+    if integrator == "solve_ivp" and method not in SOLVERS:
+        raise ValueError(f"Method ({method}) not recognised")
+    from scipy import integrate
+
+    # The dense output of the steps is kept to locate crossings or to return it
+    dense_output = crossing_percents is not None or keep_dense_output
+    y0 = np.array(
+        initial_conditions if initial_conditions is not None else cell_model.INITIAL_CONDITIONS,
+        dtype=np.float_,
+    )
+    params = cell_model.parameters(cell_type=cell_type)
+    train = protocol.stimulus_train(stimulus or cell_model.STIMULUS)
+    beat_boundaries = protocol.beat_boundaries
+    # Steps end at the beat boundaries and wherever the stimulus is discontinuous
+    edges = np.union1d(beat_boundaries, train.breakpoints((0, protocol.end_time)))
+    if integrator == "rush_larsen":
+        steps = _rush_larsen_segments(
+            cell_model=cell_model,
+            edges=edges,
+            train=train,
+            y0=y0,
+            params=params,
+            dt=dt,
+            backend=backend,
+        )
+    else:
+        steps = _solver_steps(
+            cell_model=cell_model,
+            edges=edges,
+            train=train,
+            y0=y0,
+            params=params,
+            method=method,
+            max_step=max_step,
+            rtol=rtol,
+            atol=atol,
+            backend=backend,
+            dense_output=dense_output,
+        )
+    # The action potential of the last beat is only checked for repolarisation once its stimulus
+    # has ended
+    repolarisation_start = max(
+        beat_boundaries[-2],
+        train.times[-1] + train.pulse.start + train.pulse.duration if len(train.times) else 0.,
+    )
+
+    converged = None if tolerance is None else False
+    apd = None
+    beat_num = 0
+    beat_t = [np.array([0.])]
+    beat_y = [y0[:, np.newaxis]]
+    beat_dense_output = []
+    # Highest action potential of the beat so far, to detect its repolarisation
+    beat_peak = y0[cell_model.AP_INDEX]
+    start_stats = SolverStats()
+    beat_start_time = time.perf_counter()
+    for step in steps:
+        beat_end = beat_boundaries[beat_num + 1]
+        repolarised = False
+        if step.t[-1] > beat_end + _time_tolerance(beat_end):
+            # The step crossed the end of the beat, which ends with the state at its boundary and
+            # the dense output of the step, and the next beat starts from that state
+            boundary_y = step.dense_output(beat_end)[:, np.newaxis]
+            beat_t.append(np.array([beat_end]))
+            beat_y.append(boundary_y)
+            if dense_output:
+                beat_dense_output.append(step.dense_output)
+            next_t, next_y = [np.array([beat_end]), step.t], [boundary_y, step.y]
+        else:
+            check_repolarisation = (
+                stop_at_repolarisation is not None and beat_num == protocol.num_beats - 1 and
+                beat_t[-1][-1] >= repolarisation_start
+            )
+            this_t, this_y = step.t, step.y
+            peaks = np.maximum.accumulate(np.maximum(this_y[cell_model.AP_INDEX], beat_peak))
+            if check_repolarisation:
+                resting = beat_y[0][cell_model.AP_INDEX, 0]
+                below = np.nonzero(
+                    this_y[cell_model.AP_INDEX] <=
+                    peaks - stop_at_repolarisation/100*(peaks - resting)
+                )[0]
+                if len(below):
+                    this_t, this_y = this_t[:below[0] + 1], this_y[:, :below[0] + 1]
+                    repolarised = True
+            beat_peak = peaks[-1]
+            beat_t.append(this_t)
+            beat_y.append(this_y)
+            if dense_output and step.dense_output is not None:
+                beat_dense_output.append(step.dense_output)
+            if not repolarised and this_t[-1] < beat_end - _time_tolerance(beat_end):
+                continue
+            next_t, next_y = [this_t[-1:]], [this_y[:, -1:]]
+        beat_num += 1
+        this_t, this_y = np.concatenate(beat_t), np.concatenate(beat_y, axis=1)
+        solver_stats = [SolverStats(*(
+            total - start for total, start in zip(step.total_stats, start_stats)
+        ))._replace(wall_time=time.perf_counter() - beat_start_time)]
+        record_stats(solver_stats[0])
+        if tolerance is not None:
+            previous_apd = apd
+            if apd_tolerance is not None:
+                apd = measure_beats(
+                    t=this_t,
+                    ap_signal=this_y[cell_model.AP_INDEX],
+                    beat_starts=this_t[:1],
+                    repolarisation_percents=(90,),
+                ).apd_at(90)
+            converged = beat_has_converged(
+                previous_state=this_y[:, 0],
+                state=this_y[:, -1],
+                tolerance=tolerance,
+                previous_apd=previous_apd,
+                apd=apd,
+                apd_tolerance=apd_tolerance,
+            )
+        beat_interpolant = (
+            integrate.OdeSolution(this_t, beat_dense_output) if beat_dense_output else None
+        )
+        crossings = None
+        if crossing_percents is not None:
+            crossings = threshold_crossings(
+                t=this_t,
+                ap_signal=this_y[cell_model.AP_INDEX],
+                repolarisation_percents=crossing_percents,
+                dense_output=beat_interpolant,
+                ap_index=cell_model.AP_INDEX,
+            )
+        yield ModelSolution(
+            t=this_t,
+            state_vars=this_y.T,
+            currents=cell_model.cell_model(
+                t=this_t,
+                state_vars=this_y,
+                params=params,
+                ret_ode=False,
+                stimulus=train,
+            ),
+            num_cycles=beat_num,
+            converged=converged,
+            crossings=crossings,
+            solver_stats=solver_stats,
+            dense_output=(
+                DenseOutput(beat_interpolant)
+                if keep_dense_output and beat_interpolant is not None else None
+            ),
+        )
+        if converged or repolarised or beat_num == protocol.num_beats:
+            return
+        beat_t, beat_y = next_t, next_y
+        beat_dense_output = [step.dense_output] if dense_output and len(next_t) > 1 else []
+        beat_peak = np.max(np.concatenate(next_y, axis=1)[cell_model.AP_INDEX])
+        start_stats = step.total_stats
+        beat_start_time = time.perf_counter()
+
+
+def run_protocol(
+    cell_model: CellModel,
+    protocol: PacingProtocol,
+    cell_type: str,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    rtol: float = 1e-3,
+    atol: float = 1e-6,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    keep: Union[str, int] = "all",
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+    crossing_percents: Optional[Sequence[int]] = None,
+    keep_dense_output: bool = False,
+    writer: Optional[SolutionWriter] = None,
+) -> ModelSolution:
+    """Solve the cell model over the whole :param protocol:, see iter_protocol_beats. Only the
+    beats selected by :param keep: are returned, and every beat is written to :param writer:, as
+    in run_model. With :param keep_dense_output:, the dense output of the last beat is returned.
+    """
+    with click.progressbar(
+        iter_protocol_beats(
+            cell_model=cell_model,
+            protocol=protocol,
+            cell_type=cell_type,
+            initial_conditions=initial_conditions,
+            integrator=integrator,
+            dt=dt,
+            method=method,
+            max_step=max_step,
+            rtol=rtol,
+            atol=atol,
+            tolerance=tolerance,
+            apd_tolerance=apd_tolerance,
+            stimulus=stimulus,
+            backend=backend,
+            crossing_percents=crossing_percents,
+            keep_dense_output=keep_dense_output,
+        ),
+        length=protocol.num_beats,
+        label="Computing AP signals",
+    ) as beats:
+        solver_stats: List[SolverStats] = []
+        beats = collect_solver_stats(beats, solver_stats)
+        kept = retain_beats(beats=writer.record(beats) if writer else beats, keep=keep)
+    return ModelSolution(
+        t=np.concatenate([beat.t for beat in kept]),
+        state_vars=np.concatenate([beat.state_vars for beat in kept], axis=0),
+        currents=np.concatenate([beat.currents for beat in kept], axis=0),
+        num_cycles=kept[-1].num_cycles,
+        converged=kept[-1].converged,
+        crossings=kept[-1].crossings,
+        solver_stats=solver_stats,
+        dense_output=kept[-1].dense_output,
+    )
+
+
+def run_model(
+    cell_model: CellModel,
+    num_cycles: int,
+    cycle_length: int,
+    cell_type: str,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    tolerance: Optional[float] = None,
+    apd_tolerance: Optional[float] = None,
+    keep: Union[str, int] = "all",
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+    crossing_percents: Optional[Sequence[int]] = None,
+    writer: Optional[SolutionWriter] = None,
+) -> ModelSolution:
+    """Solve the partial differential equations of a cell model using the input parameters
+    specified by the user, pacing it :param num_cycles: times at a constant :param cycle_length:
+    (see run_protocol). If no initial conditions are provided, the standard conditions from the
+    model will be used. The :param integrator: must be one of INTEGRATORS, :param dt: is the time
+    step used by fixed step integrators. The :param method: and :param max_step: are passed to the
+    solver of scipy.integrate, which receives the jacobian of the model when a stiff method is
+    chosen.
+
+    If a :param tolerance: is given, the model is solved until it reaches steady state (see
+    beat_has_converged) or for :param num_cycles:, whichever happens first. Only the beats
+    selected by :param keep: are returned (see retain_beats), so memory does not grow with the
+    number of cycles unless all beats are kept. The :param stimulus: defaults to the stimulus of
+    the model. The :param backend: evaluates the model with NumPy or, if available, compiles it
+    (see solve_cycle).
+
+    If :param crossing_percents: are given, the upstroke and the repolarisation crossings at
+    those percentages are located on the dense output of the solver as each beat is solved (see
+    events.threshold_crossings) and those of the last beat are returned, so that APDs are
+    accurate even with coarse steps.
+
+    The statistics of the solver over every beat solved, including those that are not kept, are
+    returned in ModelSolution.solver_stats. If a :param writer: is given, every beat solved is
+    written to it as well, whatever the beats kept.
+    """
+    return run_protocol(
+        cell_model=cell_model,
+        protocol=PacingProtocol.constant(cycle_length=cycle_length, num_beats=num_cycles),
+        cell_type=cell_type,
+        initial_conditions=initial_conditions,
+        integrator=integrator,
+        dt=dt,
+        method=method,
+        max_step=max_step,
+        tolerance=tolerance,
+        apd_tolerance=apd_tolerance,
+        keep=keep,
+        stimulus=stimulus,
+        backend=backend,
+        crossing_percents=crossing_percents,
+        writer=writer,
+    )
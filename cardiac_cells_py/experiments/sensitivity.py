@@ -0,0 +1,123 @@
+"""Sensitivity of the biomarkers of a cell at steady state to the parameters of its model, computed
+with central finite differences. The perturbed cells are solved together as a single population,
+so they share the steps of the solver: the discretisation error is then nearly the same for all of
+them and it cancels in the differences, which would not happen with separate adaptive runs.
+"""
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.batch import run_model_batch
+from cardiac_cells_py.experiments.measurements import BIOMARKER_NAMES, measure_beats
+
+# Biomarkers of the last beat whose sensitivities are computed, followed by the state variables at
+# the end of the beat
+BIOMARKERS = BIOMARKER_NAMES
+
+
+class Sensitivities(NamedTuple):
+    """Tuple containing the sensitivities of the biomarkers of a cell to its parameters."""
+    # Names of the parameters, in the order of the columns
+    param_names: List[str]
+    # Names of the biomarkers, in the order of the rows
+    biomarker_names: List[str]
+    # Values of the parameters
+    param_values: npt.NDArray[np.float_]
+    # Values of the biomarkers with the unperturbed parameters
+    baseline: npt.NDArray[np.float_]
+    # Derivative of each biomarker with respect to each parameter, with shape
+    # (len(biomarker_names), len(param_names))
+    matrix: npt.NDArray[np.float_]
+
+    @property
+    def relative(self) -> npt.NDArray[np.float_]:
+        """Normalised sensitivities, i.e. the relative change of each biomarker per relative change
+        of each parameter. NaN where the biomarker or the parameter is zero, since a relative
+        change of a parameter that is zero does not change it (see matrix for those)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                (self.baseline[:, np.newaxis] != 0) & (self.param_values != 0),
+                self.matrix*self.param_values / self.baseline[:, np.newaxis],
+                np.nan,
+            )
+
+    def of(self, biomarker: str) -> npt.NDArray[np.float_]:
+        """Sensitivities of :param biomarker: to each parameter."""
+        if biomarker not in self.biomarker_names:
+            raise ValueError(f"Biomarker ({biomarker}) not recognised")
+        return self.matrix[self.biomarker_names.index(biomarker)]
+
+
+def parameter_sensitivities(
+    cell_model: CellModel,
+    cell_type: str,
+    param_names: Optional[Sequence[str]] = None,
+    relative_step: float = 1e-3,
+    num_cycles: int = 50,
+    cycle_length: int = 1000,
+    tolerance: Optional[float] = 1e-4,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    integrator: str = "solve_ivp",
+    dt: float = 0.1,
+    method: str = "RK45",
+    max_step: float = 1,
+    stimulus: Optional[Stimulus] = None,
+    backend: str = "numpy",
+) -> Sensitivities:
+    """Sensitivities of the biomarkers in BIOMARKERS, and of the state variables at the end of the
+    last beat, to the parameters :param param_names: of the :param cell_type: given, all of them
+    by default. Each parameter is perturbed by :param relative_step: times its value, or by
+    :param relative_step: if it is zero, in both directions. The unperturbed and the perturbed
+    cells are paced together for :param num_cycles: or until they all reach steady state within
+    :param tolerance:, and the remaining arguments are used as in run_model_batch.
+    """
+    params = cell_model.parameters(cell_type=cell_type)
+    param_names = list(param_names if param_names is not None else params._fields)
+    for name in param_names:
+        if name not in params._fields:
+            raise ValueError(f"Parameter ({name}) not recognised")
+    param_values = np.array([getattr(params, name) for name in param_names], dtype=np.float_)
+    steps = np.where(param_values != 0, relative_step*np.abs(param_values), relative_step)
+    population: List[Any] = [params]
+    for direction in (1, -1):
+        population.extend(
+            params._replace(**{name: value + direction*step})
+            for name, value, step in zip(param_names, param_values, steps)
+        )
+    last_beat = run_model_batch(
+        cell_model=cell_model,
+        num_cycles=num_cycles,
+        cycle_length=cycle_length,
+        params=population,
+        initial_conditions=initial_conditions,
+        integrator=integrator,
+        dt=dt,
+        method=method,
+        max_step=max_step,
+        tolerance=tolerance,
+        keep="last",
+        stimulus=stimulus,
+        backend=backend,
+    )
+    biomarkers = measure_beats(
+        t=last_beat.t,
+        ap_signal=last_beat.state_vars[..., cell_model.AP_INDEX],
+        beat_starts=last_beat.t[:1],
+        repolarisation_percents=(30, 50, 90),
+    )
+    values = np.concatenate([
+        np.stack([biomarkers.named(name)[:, 0] for name in BIOMARKERS]),
+        last_beat.state_vars[:, -1].T,
+    ])
+    num_params = len(param_names)
+    forward, backward = values[:, 1:num_params + 1], values[:, num_params + 1:]
+    return Sensitivities(
+        param_names=param_names,
+        biomarker_names=BIOMARKERS + list(cell_model.STATE_VARS_NAMES),
+        param_values=param_values,
+        baseline=values[:, 0],
+        matrix=(forward - backward) / (2*steps),
+    )
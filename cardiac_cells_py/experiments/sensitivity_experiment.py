@@ -0,0 +1,136 @@
+"""Compute the sensitivity of the biomarkers of a cell at steady state to the parameters of its
+model."""
+import click
+import os
+
+import numpy as np
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.plotting import pyplot
+from cardiac_cells_py.experiments.sensitivity import parameter_sensitivities
+
+
+@click.command()
+@click.argument(
+    "cell_model",
+    type=click.Choice(
+        CellModels.valid_models(),
+        case_sensitive=False
+    )
+)
+@click.argument("cell_type", type=str)
+@click.argument("outdir", type=click.Path(exists=True))
+@click.option(
+    "--param",
+    "param_names",
+    multiple=True,
+    help="Parameter of the model to perturb. Can be repeated. [default: all the parameters]",
+)
+@click.option(
+    "--relative-step",
+    default=1e-3,
+    type=float,
+    help="Perturbation of each parameter relative to its value.",
+    show_default=True,
+)
+@click.option(
+    "--num-cycles",
+    default=50,
+    type=int,
+    help="Maximum number of cycles used to reach steady state.",
+    show_default=True,
+)
+@click.option(
+    "--cycle-length",
+    default=1000,
+    type=int,
+    help="Cycle length in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--tolerance",
+    default=1e-4,
+    type=float,
+    help=(
+        "Stop once the state variables of all the perturbed cells at the end of consecutive beats "
+        "differ by less than this value."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--backend",
+    default="numpy",
+    type=click.Choice(["numpy", "jit"]),
+    help="Backend used to evaluate the cell model.",
+    show_default=True,
+)
+def sensitivity(
+    cell_model,
+    cell_type,
+    outdir,
+    param_names,
+    relative_step,
+    num_cycles,
+    cycle_length,
+    tolerance,
+    backend,
+):
+    """Compute the sensitivity of the biomarkers of the last beat at steady state (APDs, peak,
+    resting value, maximum upstroke and triangulation) and of the final state variables to the
+    parameters of the model. The perturbed models are solved together as a population and the
+    normalised sensitivities, i.e. d(log biomarker)/d(log parameter), are saved as a CSV table and
+    a heat map. They are NaN for parameters whose value is zero.
+
+    \b
+    CELL_MODEL is the cell model to use in the experiment. Must be a supported CellModels.
+    CELL_TYPE is the type of cell to use in the experiment. Must be supported by the cell model.
+    OUTDIR specify an output directory to save the results
+    """
+    model = CellModels[cell_model.upper()].create()
+    try:
+        sensitivities = parameter_sensitivities(
+            cell_model=model,
+            cell_type=cell_type,
+            param_names=param_names or None,
+            relative_step=relative_step,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            tolerance=tolerance,
+            backend=backend,
+        )
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--param")
+    relative = sensitivities.relative
+
+    apd90 = relative[sensitivities.biomarker_names.index("apd90")]
+    click.echo("Parameters with the largest effect on APD90:")
+    ranked = [idx for idx in np.argsort(-np.abs(np.nan_to_num(apd90))) if not np.isnan(apd90[idx])]
+    for idx in ranked[:5]:
+        click.echo(f"  {sensitivities.param_names[idx]}: {apd90[idx]:.4f}")
+    zero_params = np.flatnonzero(sensitivities.param_values == 0)
+    if len(zero_params):
+        click.echo(
+            "Parameters whose value is zero have no normalised sensitivity and are reported as "
+            "NaN. Derivatives of APD90 with respect to them:"
+        )
+        for idx in zero_params:
+            click.echo(f"  {sensitivities.param_names[idx]}: {sensitivities.of('apd90')[idx]:.4f}")
+
+    fig_base = f"sensitivity_{cell_model}_{cell_type}_{cycle_length}cl"
+    click.echo(f"Saving results in {outdir}")
+    with open(f"{os.path.join(outdir, fig_base)}.csv", "w") as csv_file:
+        csv_file.write(",".join(["biomarker", *sensitivities.param_names]) + "\n")
+        for name, row in zip(sensitivities.biomarker_names, relative):
+            csv_file.write(",".join([name, *(f"{value:.6g}" for value in row)]) + "\n")
+
+    plt = pyplot()
+    plt.figure(figsize=(max(6, 0.4*len(sensitivities.param_names)), 5))
+    limit = np.nanmax(np.abs(relative))
+    plt.imshow(relative, cmap="RdBu_r", vmin=-limit, vmax=limit, aspect="auto")
+    plt.colorbar(label="Normalised sensitivity")
+    plt.xticks(range(len(sensitivities.param_names)), sensitivities.param_names, rotation=90)
+    plt.yticks(range(len(sensitivities.biomarker_names)), sensitivities.biomarker_names)
+    plt.title("Sensitivity of the biomarkers to the parameters")
+    plt.tight_layout()
+    plt.savefig(f"{os.path.join(outdir, fig_base)}.png")
+    plt.close("all")
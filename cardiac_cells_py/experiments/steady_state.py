@@ -1,12 +1,18 @@
 """Stimulate a cell for a number of cycles and observe the results."""
 import click
+import contextlib
 import os
 
-import matplotlib.pyplot as plt
-
 from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.cache import (
+    DEFAULT_CACHE_DIR,
+    SteadyStateCache,
+    solve_steady_state,
+)
 from cardiac_cells_py.experiments.experiment_result import ExperimentResult
-from cardiac_cells_py.experiments.utils import run_model
+from cardiac_cells_py.experiments.plotting import pyplot
+from cardiac_cells_py.experiments.storage import STORAGE_DTYPES, SolutionWriter
 
 
 @click.command()
@@ -21,7 +27,98 @@ from cardiac_cells_py.experiments.utils import run_model
 @click.argument("num_cycles", type=int)
 @click.argument("cycle_length", type=int)
 @click.argument("outdir", type=click.Path(exists=True))
-def steady_state(cell_model, cell_type, num_cycles, cycle_length, outdir):
+@click.option(
+    "--tolerance",
+    default=None,
+    type=float,
+    help=(
+        "Stop once the state variables at the end of consecutive beats differ by less than this "
+        "value. NUM_CYCLES is then the maximum number of cycles."
+    ),
+)
+@click.option(
+    "--apd-tolerance",
+    default=None,
+    type=float,
+    help=(
+        "When using --tolerance, also require the APD90 of consecutive beats to differ by less "
+        "than this value."
+    ),
+)
+@click.option(
+    "--shooting",
+    is_flag=True,
+    help=(
+        "Find the limit cycle of the cell with Newton's method and start pacing from it. "
+        "NUM_CYCLES can then be as low as 1."
+    ),
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or store the steady state in the cache.",
+)
+@click.option(
+    "--cache-dir",
+    default=DEFAULT_CACHE_DIR,
+    type=click.Path(file_okay=False),
+    help="Directory where steady states are cached.",
+    show_default=True,
+)
+@click.option(
+    "--stim-amplitude",
+    default=None,
+    type=float,
+    help="Amplitude of the stimulus current. [default: stimulus of the model]",
+)
+@click.option(
+    "--stim-duration",
+    default=None,
+    type=float,
+    help="Duration of the stimulus in milliseconds. [default: stimulus of the model]",
+)
+@click.option(
+    "--save-solution",
+    default=None,
+    type=click.Path(file_okay=False),
+    help=(
+        "Directory where every beat of the pacing is stored as memory-mapped .npy files. The "
+        "steady state is then not read from the cache."
+    ),
+)
+@click.option(
+    "--storage-dtype",
+    default="float64",
+    type=click.Choice(STORAGE_DTYPES),
+    help="Data type of the stored state variables and currents. Times are always float64.",
+    show_default=True,
+)
+@click.option(
+    "--resample-dt",
+    default=None,
+    type=click.FloatRange(min=0, min_open=True),
+    help=(
+        "Store the solution on a uniform grid with this step in milliseconds. [default: steps "
+        "of the solver]"
+    ),
+)
+def steady_state(
+    cell_model,
+    cell_type,
+    num_cycles,
+    cycle_length,
+    outdir,
+    tolerance,
+    apd_tolerance,
+    shooting,
+    no_cache,
+    cache_dir,
+    stim_amplitude,
+    stim_duration,
+    save_solution,
+    storage_dtype,
+    resample_dt,
+):
     """Perform a steady state experiment and report measurements observed in the last beat.
 
     \b
@@ -31,13 +128,34 @@ def steady_state(cell_model, cell_type, num_cycles, cycle_length, outdir):
     CYCLE_LENGTH the spacing between stimulation signals.
     OUTDIR specify an output directory to save plots
     """
-    model = CellModels[cell_model.upper()].value()
-    model_solution = run_model(
-        cell_model=model,
-        num_cycles=num_cycles,
-        cycle_length=cycle_length,
-        cell_type=cell_type,
+    model = CellModels[cell_model.upper()].create()
+    stimulus = Stimulus(
+        amplitude=model.STIMULUS.amplitude if stim_amplitude is None else stim_amplitude,
+        duration=model.STIMULUS.duration if stim_duration is None else stim_duration,
     )
+    writer = None
+    if save_solution is not None:
+        writer = SolutionWriter(
+            path=save_solution,
+            cycle_length=cycle_length,
+            dtype=storage_dtype,
+            resample_dt=resample_dt,
+        )
+    with writer or contextlib.nullcontext():
+        model_solution = solve_steady_state(
+            cell_model=model,
+            cell_type=cell_type,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            tolerance=tolerance,
+            apd_tolerance=apd_tolerance,
+            shooting=shooting,
+            cache=None if no_cache else SteadyStateCache(cache_dir=cache_dir),
+            stimulus=stimulus,
+            writer=writer,
+        )
+    if save_solution is not None:
+        click.echo(f"Solution saved in {save_solution}")
     experiment_result = ExperimentResult(
         model=model,
         model_solution=model_solution,
@@ -49,6 +167,7 @@ def steady_state(cell_model, cell_type, num_cycles, cycle_length, outdir):
     fig_base = f"{experiment_result.experiment_id}_{cell_model}_{cell_type}_"
     fig_base += f"{num_cycles}cycles_{cycle_length}cl"
     click.echo(f"Saving figures in {outdir}")
+    plt = pyplot()
     plt.figure()
     plt.plot(experiment_result.last_beat.t, ap_signal)
     plt.title("Steady state action potential signal")
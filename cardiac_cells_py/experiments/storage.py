@@ -0,0 +1,258 @@
+"""Compact storage of solutions on disk. A SolutionWriter appends the beats of a solution to .npy
+files as they are solved, so long pacing runs can be archived without holding them in memory, and
+load_solution maps them back lazily: the arrays of the ModelSolution returned are memory-mapped, so
+only the parts that are used are ever read from disk. Solutions can be stored in single precision
+and resampled onto a uniform time grid to reduce their size further. Times are always stored in
+double precision, since single precision cannot resolve the steps of the upstroke after a few
+hours of pacing.
+
+A stored solution is a directory with a .npy file for each of the time, the state variables and the
+currents, plus a JSON file with its metadata, which is written last: a directory without it holds
+a solution that was not completed and cannot be loaded.
+"""
+import json
+import os
+import struct
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+
+# Data types in which solutions can be stored
+STORAGE_DTYPES = ["float64", "float32"]
+# Arrays of a ModelSolution stored, each in its own .npy file
+ARRAYS = ["t", "state_vars", "currents"]
+METADATA_FILE = "solution.json"
+# Increase when the layout of stored solutions changes so that old ones are not misread
+STORAGE_VERSION = 1
+# Start of the header of version 1.0 .npy files
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# Largest number of rows that the header reserved in the .npy files can describe
+MAX_ROWS = np.iinfo(np.int64).max
+
+
+def resample(
+    solution: ModelSolution,
+    dt: float,
+    include_end: bool = True,
+    origin: Optional[float] = None,
+) -> ModelSolution:
+    """Interpolate :param solution: linearly onto the times :param origin: + k*:param dt: within
+    it, with the last time as the final point if :param include_end: is set. The
+    :param origin: defaults to the first time of the solution, and should be shared by
+    consecutive parts of a solution so that they are resampled onto the same uniform grid."""
+    t = np.asarray(solution.t)
+    origin = t[0] if origin is None else origin
+    first, last = np.ceil((t[0] - origin)/dt - 1e-9), np.ceil((t[-1] - origin)/dt - 1e-9)
+    grid = origin + dt*np.arange(first, last)
+    if include_end:
+        grid = np.append(grid, t[-1])
+    idx = np.clip(np.searchsorted(t, grid, side="right") - 1, 0, max(len(t) - 2, 0))
+    next_idx = np.minimum(idx + 1, len(t) - 1)
+    span = t[next_idx] - t[idx]
+    weight = np.divide(grid - t[idx], span, out=np.zeros_like(grid), where=span > 0)
+
+    def interpolate(values: npt.NDArray[np.float_]) -> npt.NDArray[np.float_]:
+        values = np.asarray(values)
+        return values[idx] + weight[:, np.newaxis]*(values[next_idx] - values[idx])
+
+    return solution._replace(
+        t=grid,
+        state_vars=interpolate(solution.state_vars),
+        currents=interpolate(solution.currents),
+    )
+
+
+def npy_header(dtype: np.dtype, shape: tuple, size: Optional[int] = None) -> bytes:
+    """Header of a version 1.0 .npy file holding a C ordered array of :param dtype: and
+    :param shape:, padded with spaces to :param size: bytes, by default the smallest multiple of
+    64 bytes that fits it, as np.save does."""
+    header = repr({
+        "descr": np.lib.format.dtype_to_descr(dtype),
+        "fortran_order": False,
+        "shape": tuple(shape),
+    }).encode("latin1")
+    # The length of the header, its contents and the newline that ends it
+    min_size = len(NPY_MAGIC) + 2 + len(header) + 1
+    if size is None:
+        size = -(-min_size // 64)*64
+    if min_size > size:
+        raise ValueError(f"Header of shape {shape} does not fit in {size} bytes")
+    return (
+        NPY_MAGIC + struct.pack("<H", size - len(NPY_MAGIC) - 2) + header +
+        b" "*(size - min_size) + b"\n"
+    )
+
+
+class SolutionWriter:
+    """Writer of the beats of a solution to the directory :param path:, see the module docstring.
+    The state variables and currents are stored with :param dtype:, one of STORAGE_DTYPES, and
+    the times in double precision. If :param resample_dt: is given, the beats are stored on a
+    uniform grid with that step, from the first time written (see resample), instead of the
+    steps of the solver.
+    The :param cycle_length: is stored so that the solution can be loaded as an ExperimentResult.
+    """
+    def __init__(
+        self,
+        path: str,
+        cycle_length: Optional[int] = None,
+        dtype: str = "float64",
+        resample_dt: Optional[float] = None,
+    ):
+        """Construct a writer and create the directory that holds the solution."""
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Storage data type ({dtype}) not recognised")
+        if resample_dt is not None and resample_dt <= 0:
+            raise ValueError(f"Resampling step ({resample_dt}) must be positive")
+        self.path = path
+        self.cycle_length = cycle_length
+        self.dtype = np.dtype(dtype)
+        self.resample_dt = resample_dt
+        self.num_beats = 0
+        self.num_cycles: Optional[int] = None
+        self.converged: Optional[bool] = None
+        os.makedirs(path, exist_ok=True)
+        # A stale metadata file would make a partially written solution look complete
+        if os.path.exists(os.path.join(path, METADATA_FILE)):
+            os.remove(os.path.join(path, METADATA_FILE))
+        self._files: Dict[str, BinaryIO] = {}
+        self._shapes: Dict[str, tuple] = {}
+        self._header_sizes: Dict[str, int] = {}
+        # Last point of the latest beat, which is the first point of the next one when resampling
+        # and is only written if no other beat follows
+        self._pending_end: Optional[ModelSolution] = None
+        # Origin of the grid onto which the beats are resampled
+        self._origin: Optional[float] = None
+
+    def __enter__(self) -> "SolutionWriter":
+        """Return the writer itself, which is closed on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Close the writer, marking the solution as complete unless an exception was raised."""
+        self.close(complete=exc_type is None)
+
+    def _append(self, solution: ModelSolution) -> None:
+        """Append the arrays of :param solution: to their files."""
+        for name in ARRAYS:
+            values = np.ascontiguousarray(getattr(solution, name), dtype=self._dtype(name))
+            if name not in self._files:
+                self._files[name] = open(os.path.join(self.path, f"{name}.npy"), "wb")
+                self._shapes[name] = (0, *values.shape[1:])
+                # Reserve room for the header of the largest array, so that it can always be
+                # rewritten in place
+                self._header_sizes[name] = len(
+                    npy_header(values.dtype, (MAX_ROWS, *values.shape[1:]))
+                )
+                self._write_header(name)
+            elif values.shape[1:] != self._shapes[name][1:]:
+                raise ValueError(
+                    f"Shape of {name} ({values.shape}) does not match the stored beats"
+                )
+            values.tofile(self._files[name])
+            self._shapes[name] = (self._shapes[name][0] + len(values), *values.shape[1:])
+
+    def _dtype(self, name: str) -> np.dtype:
+        """Data type in which the array :param name: is stored."""
+        return np.dtype(np.float64) if name == "t" else self.dtype
+
+    def _write_header(self, name: str) -> None:
+        """Write the header of the .npy file of :param name: with its current shape, padded to the
+        size reserved for it, so that it is rewritten in place as the first axis grows."""
+        npy_file = self._files[name]
+        position = npy_file.tell()
+        npy_file.seek(0)
+        npy_file.write(
+            npy_header(self._dtype(name), self._shapes[name], self._header_sizes[name])
+        )
+        npy_file.seek(max(position, self._header_sizes[name]))
+
+    def write(self, beat: ModelSolution) -> None:
+        """Append :param beat:, which must follow the beats already written."""
+        if self.resample_dt is not None:
+            if len(beat.t) < 2:
+                return
+            if self._origin is None:
+                self._origin = float(beat.t[0])
+            beat = resample(beat, dt=self.resample_dt, origin=self._origin)
+            self._pending_end = beat._replace(
+                t=beat.t[-1:], state_vars=beat.state_vars[-1:], currents=beat.currents[-1:]
+            )
+            beat = beat._replace(
+                t=beat.t[:-1], state_vars=beat.state_vars[:-1], currents=beat.currents[:-1]
+            )
+        self._append(beat)
+        self.num_beats += 1
+        self.num_cycles = beat.num_cycles
+        self.converged = beat.converged
+
+    def record(self, beats: Iterable[ModelSolution]) -> Iterator[ModelSolution]:
+        """Write each of :param beats: as it is yielded, passing it through unchanged."""
+        for beat in beats:
+            self.write(beat)
+            yield beat
+
+    def close(self, complete: bool = True) -> None:
+        """Finish the files and, if the solution is :param complete:, write its metadata."""
+        if self._pending_end is not None:
+            self._append(self._pending_end)
+            self._pending_end = None
+        for name in list(self._files):
+            self._write_header(name)
+            self._files.pop(name).close()
+        if not complete or not self.num_beats:
+            return
+        metadata = {
+            "version": STORAGE_VERSION,
+            "dtype": self.dtype.name,
+            "resample_dt": self.resample_dt,
+            "cycle_length": self.cycle_length,
+            "num_beats": self.num_beats,
+            "num_cycles": self.num_cycles,
+            "converged": self.converged,
+        }
+        with open(os.path.join(self.path, METADATA_FILE), "w") as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+
+
+def read_metadata(path: str) -> dict:
+    """Metadata of the solution stored in :param path:."""
+    try:
+        with open(os.path.join(path, METADATA_FILE)) as metadata_file:
+            metadata = json.load(metadata_file)
+    except FileNotFoundError:
+        raise ValueError(f"No complete solution stored in {path}")
+    if metadata.get("version") != STORAGE_VERSION:
+        raise ValueError(f"Storage version ({metadata.get('version')}) not recognised")
+    return metadata
+
+
+def load_solution(path: str, mmap: bool = True) -> ModelSolution:
+    """Solution stored in :param path:. Its arrays are memory-mapped read-only if :param mmap: is
+    set, so nothing is read until it is used, and loaded into memory otherwise."""
+    metadata = read_metadata(path)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+        for name in ARRAYS
+    }
+    return ModelSolution(
+        **arrays,
+        num_cycles=metadata["num_cycles"],
+        converged=metadata["converged"],
+    )
+
+
+def save_solution(
+    path: str,
+    solution: ModelSolution,
+    cycle_length: Optional[int] = None,
+    dtype: str = "float64",
+    resample_dt: Optional[float] = None,
+) -> None:
+    """Store :param solution:, which is already in memory, in :param path:, see SolutionWriter."""
+    with SolutionWriter(
+        path=path, cycle_length=cycle_length, dtype=dtype, resample_dt=resample_dt
+    ) as writer:
+        writer.write(solution)
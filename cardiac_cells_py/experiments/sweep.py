@@ -0,0 +1,330 @@
+"""Sweep the parameters of a cell model, e.g. to mimic the block of ionic channels or to build a
+population of models. The parameters are scaled on a grid or by random sampling, each sample is
+paced to steady state and the biomarkers of its last beat are stored. Samples are solved in
+chunks, spread over a pool of processes, and every completed chunk is written to disk at once, so
+an interrupted sweep resumes from the chunks that were already completed.
+"""
+import click
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.batch import iter_beats_batch
+from cardiac_cells_py.experiments.measurements import measure_beats
+from cardiac_cells_py.experiments.utils import retain_beats
+
+# Name of the files written in the output directory of a sweep
+MANIFEST_FILE = "sweep.json"
+SAMPLES_FILE = "samples.npy"
+RESULTS_FILE = "sweep.npz"
+
+
+def parse_scale(value: str) -> Tuple[str, float, float, int]:
+    """Parse a scaling specification NAME=MIN:MAX[:NUM] into its name, range and number of points.
+    The number of points defaults to 1 and is ignored when sampling at random."""
+    name, _, scale_range = value.partition("=")
+    bounds = scale_range.split(":")
+    if not name or len(bounds) not in (2, 3):
+        raise ValueError(f"Scaling ({value}) not recognised, expected NAME=MIN:MAX[:NUM]")
+    return name, float(bounds[0]), float(bounds[1]), int(bounds[2]) if len(bounds) == 3 else 1
+
+
+def sample_scales(
+    scales: Sequence[Tuple[str, float, float, int]],
+    num_samples: int = 0,
+    seed: int = 0,
+) -> npt.NDArray[np.float_]:
+    """Scaling factors of each sample, with shape (num_samples, len(scales)). With
+    :param num_samples: the factors are sampled uniformly within the range of each scaling using
+    :param seed:, otherwise they form a grid with the number of points of each scaling."""
+    if num_samples:
+        rng = np.random.default_rng(seed)
+        return rng.uniform(
+            [low for _, low, _, _ in scales],
+            [high for _, _, high, _ in scales],
+            size=(num_samples, len(scales)),
+        )
+    return np.array(list(itertools.product(
+        *(np.linspace(low, high, num) for _, low, high, num in scales)
+    ))).reshape(-1, len(scales))
+
+
+def solve_chunk(
+    cell_model: str,
+    cell_type: str,
+    param_names: Sequence[str],
+    scales: npt.NDArray[np.float_],
+    num_cycles: int,
+    cycle_length: int,
+    tolerance: float,
+    method: str,
+) -> Dict[str, npt.NDArray[np.float_]]:
+    """Pace the samples of a chunk, given by their :param scales: of :param param_names:, to
+    steady state as a population of cells and return the columns of its results: the scaling
+    factors, the biomarkers of the last beat, whether each sample converged and the number of
+    cycles it took to converge."""
+    model = CellModels[cell_model.upper()].create()
+    base_params = model.parameters(cell_type=cell_type)
+    params = [
+        base_params._replace(**{
+            name: getattr(base_params, name)*scale for name, scale in zip(param_names, row)
+        })
+        for row in scales
+    ]
+    last_beat = retain_beats(
+        iter_beats_batch(
+            cell_model=model,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            params=params,
+            method=method,
+            max_step=np.inf if method in ("Radau", "BDF", "LSODA") else 1,
+            tolerance=tolerance,
+        ),
+        keep="last",
+    )[-1]
+    biomarkers = measure_beats(
+        t=last_beat.t,
+        ap_signal=last_beat.state_vars[..., model.AP_INDEX],
+        beat_starts=last_beat.t[:1],
+        repolarisation_percents=(30, 50, 90),
+    )
+    columns = {name: scales[:, col] for col, name in enumerate(param_names)}
+    columns.update(
+        apd30=biomarkers.apd_at(30)[:, 0],
+        apd50=biomarkers.apd_at(50)[:, 0],
+        apd90=biomarkers.apd_at(90)[:, 0],
+        peak=biomarkers.peak[:, 0],
+        resting=biomarkers.resting[:, 0],
+        max_upstroke=biomarkers.max_upstroke[:, 0],
+        triangulation=biomarkers.triangulation[:, 0],
+    )
+    columns["converged"] = last_beat.cells_converged
+    columns["num_cycles"] = last_beat.cells_num_cycles
+    return columns
+
+
+def chunk_path(outdir: str, chunk: int) -> str:
+    """Location of the results of :param chunk: in :param outdir:."""
+    return os.path.join(outdir, f"chunk_{chunk:05d}.npz")
+
+
+def write_atomically(path: str, columns: Dict[str, Any]) -> None:
+    """Write :param columns: to :param path: so that an interruption never leaves partial files."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmp_file:
+        np.savez(tmp_file, **columns)
+    os.replace(tmp_path, path)
+
+
+def load_or_create_manifest(
+    outdir: str,
+    settings: Dict[str, Any],
+    samples: npt.NDArray[np.float_],
+) -> None:
+    """Store the :param settings: and :param samples: of a sweep in :param outdir:, or check that
+    they match those of the sweep that is being resumed there."""
+    manifest_path = os.path.join(outdir, MANIFEST_FILE)
+    samples_path = os.path.join(outdir, SAMPLES_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            previous_settings = json.load(manifest_file)
+        if previous_settings != settings or not np.array_equal(np.load(samples_path), samples):
+            raise click.ClickException(
+                f"{outdir} contains a sweep with different settings, use another directory"
+            )
+        return
+    np.save(samples_path, samples)
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(settings, manifest_file, indent=2)
+
+
+@click.command()
+@click.argument(
+    "cell_model",
+    type=click.Choice(
+        CellModels.valid_models(),
+        case_sensitive=False
+    )
+)
+@click.argument("cell_type", type=str)
+@click.argument("outdir", type=click.Path(file_okay=False))
+@click.option(
+    "--scale",
+    "scale_specs",
+    multiple=True,
+    required=True,
+    help=(
+        "Scaling of a parameter of the model as NAME=MIN:MAX:NUM, e.g. tau_fi=0.5:2:4. Can be "
+        "repeated, the samples form a grid over all the scalings."
+    ),
+)
+@click.option(
+    "--samples",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Sample this many scalings uniformly within the ranges given by --scale instead of using "
+        "a grid. NUM can then be left out."
+    ),
+)
+@click.option(
+    "--seed",
+    default=0,
+    type=int,
+    help="Seed used to sample the scalings with --samples.",
+    show_default=True,
+)
+@click.option(
+    "--num-cycles",
+    default=50,
+    type=int,
+    help="Maximum number of cycles used to reach steady state.",
+    show_default=True,
+)
+@click.option(
+    "--cycle-length",
+    default=1000,
+    type=int,
+    help="Cycle length in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--tolerance",
+    default=1e-4,
+    type=float,
+    help=(
+        "Stop pacing a chunk once the state variables of all its samples at the end of "
+        "consecutive beats differ by less than this value."
+    ),
+    show_default=True,
+)
+@click.option(
+    "--method",
+    default="BDF",
+    type=click.Choice(["RK45", "Radau", "BDF", "LSODA"]),
+    help="Method used by solve_ivp.",
+    show_default=True,
+)
+@click.option(
+    "--chunk-size",
+    default=32,
+    type=click.IntRange(min=1),
+    help="Number of samples solved together and written to disk at once.",
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    type=click.IntRange(min=1),
+    help="Number of processes used to solve the chunks. [default: number of CPUs]",
+)
+def sweep(
+    cell_model,
+    cell_type,
+    outdir,
+    scale_specs,
+    samples,
+    seed,
+    num_cycles,
+    cycle_length,
+    tolerance,
+    method,
+    chunk_size,
+    workers,
+):
+    """Sweep the parameters of a cell model and store the biomarkers (APD30, APD50, APD90, peak,
+    resting value, maximum upstroke velocity and triangulation of the action potential) of each
+    sample at steady state. Running the same
+    command again on the same OUTDIR resumes an interrupted sweep.
+
+    \b
+    CELL_MODEL is the cell model to use. Must be a supported CellModels.
+    CELL_TYPE is the cell type to use. Must be supported by the cell model specified.
+    OUTDIR directory where the results are written, it is created if needed.
+    """
+    try:
+        scales = [parse_scale(spec) for spec in scale_specs]
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--scale")
+    model_class = CellModels[cell_model.upper()].model_class()
+    param_fields = model_class.parameters(cell_type=cell_type)._fields
+    for name, _, _, _ in scales:
+        if name not in param_fields:
+            raise click.BadParameter(
+                f"Parameter ({name}) not recognised", param_hint="--scale"
+            )
+    param_names = [name for name, _, _, _ in scales]
+    all_samples = sample_scales(scales=scales, num_samples=samples, seed=seed)
+    os.makedirs(outdir, exist_ok=True)
+    load_or_create_manifest(
+        outdir=outdir,
+        settings=dict(
+            cell_model=cell_model,
+            cell_type=cell_type,
+            param_names=param_names,
+            num_cycles=num_cycles,
+            cycle_length=cycle_length,
+            tolerance=tolerance,
+            method=method,
+            chunk_size=chunk_size,
+        ),
+        samples=all_samples,
+    )
+    num_chunks = int(np.ceil(len(all_samples) / chunk_size))
+    pending = [
+        chunk for chunk in range(num_chunks) if not os.path.exists(chunk_path(outdir, chunk))
+    ]
+    click.echo(
+        f"Sweeping {len(all_samples)} samples in {num_chunks} chunks, "
+        f"{num_chunks - len(pending)} already completed"
+    )
+    with contextlib.ExitStack() as stack:
+        executor = stack.enter_context(
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        )
+        futures = {
+            executor.submit(
+                solve_chunk,
+                cell_model=cell_model,
+                cell_type=cell_type,
+                param_names=param_names,
+                scales=all_samples[chunk*chunk_size:(chunk + 1)*chunk_size],
+                num_cycles=num_cycles,
+                cycle_length=cycle_length,
+                tolerance=tolerance,
+                method=method,
+            ): chunk
+            for chunk in pending
+        }
+        with click.progressbar(
+            concurrent.futures.as_completed(futures),
+            length=len(futures),
+            label="Solving chunks",
+        ) as completed:
+            for future in completed:
+                chunk = futures[future]
+                columns = future.result()
+                columns["sample"] = np.arange(
+                    chunk*chunk_size, chunk*chunk_size + len(columns["apd90"])
+                )
+                write_atomically(chunk_path(outdir, chunk), columns)
+
+    results: Dict[str, List[npt.NDArray[Any]]] = {}
+    for chunk in range(num_chunks):
+        with np.load(chunk_path(outdir, chunk)) as chunk_columns:
+            for name in chunk_columns.files:
+                results.setdefault(name, []).append(chunk_columns[name])
+    write_atomically(
+        os.path.join(outdir, RESULTS_FILE),
+        {name: np.concatenate(column) for name, column in results.items()},
+    )
+    click.echo(f"Results saved in {os.path.join(outdir, RESULTS_FILE)}")
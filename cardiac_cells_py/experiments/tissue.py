@@ -0,0 +1,271 @@
+"""Simulate a 1D cable or a 2D sheet of cells coupled by diffusion, as described by the monodomain
+equation du/dt = D*laplacian(u) + reaction(u, ...). Every node of the tissue is a cell of the
+same CellModel, although the parameters (e.g. the cell type) may differ between nodes.
+
+The equation is solved with operator splitting. At every time step the reaction term is solved
+for all nodes at once with the Rush-Larsen integrator, then the diffusion term is solved with an
+implicit (backward Euler) step. The sparse system of the implicit step does not change between
+steps. For cables it is factorised once, while for sheets, where the factors would fill in, it is
+solved with conjugate gradients starting from the current potential, which only takes a few
+iterations since the system is well conditioned.
+"""
+import inspect
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple, Optional, Tuple
+
+import click
+import numpy as np
+import numpy.typing as npt
+
+from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.cell_models.stimulus import Stimulus
+from cardiac_cells_py.experiments.integrators import rush_larsen
+from cardiac_cells_py.experiments.protocols import PacingProtocol
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+# Diffusion coefficient of the minimal model in mm^2/ms (1.171 cm^2/s, Bueno-Orovio et al. 2008)
+DEFAULT_DIFFUSION = 0.1171
+# Relative tolerance of the conjugate gradient solves of the diffusion step
+DIFFUSION_RTOL = 1e-10
+
+
+class Tissue(NamedTuple):
+    """Tuple describing a cable or a sheet of cells."""
+    # Cell type of each node, with the shape of the tissue: (num_nodes,) for a cable or
+    # (num_rows, num_cols) for a sheet
+    cell_types: npt.NDArray[np.str_]
+    # Distance between neighbouring nodes in mm
+    dx: float = 0.25
+    # Diffusion coefficient in mm^2/ms
+    diffusion: float = DEFAULT_DIFFUSION
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Number of nodes along each dimension of the tissue."""
+        return self.cell_types.shape
+
+    @property
+    def num_nodes(self) -> int:
+        """Total number of nodes in the tissue."""
+        return self.cell_types.size
+
+
+class TissueSolution(NamedTuple):
+    """Tuple containing the solution of a tissue simulation."""
+    # Times at which the action potential was stored
+    t: npt.NDArray[np.float_]
+    # Action potential state variable with shape (len(t), *tissue.shape)
+    ap_signal: npt.NDArray[np.float_]
+    # Time at which each node was last activated, NaN for nodes that were never activated
+    activation_times: npt.NDArray[np.float_]
+    # State variables at the end of the simulation with shape (num_state_vars, *tissue.shape)
+    final_state: npt.NDArray[np.float_]
+
+
+def transmural_cell_types(
+    shape: Tuple[int, ...],
+    endo_fraction: float = 0.3,
+    m_fraction: float = 0.3,
+    axis: int = -1,
+) -> npt.NDArray[np.str_]:
+    """Cell types of a tissue of the :param shape: given with strips of endo, m and epi cells along
+    :param axis:. The first :param endo_fraction: of the nodes are endo cells, followed by
+    :param m_fraction: of m cells, and the rest are epi cells."""
+    num_nodes = shape[axis]
+    position = np.arange(num_nodes) / num_nodes
+    strips = np.where(
+        position < endo_fraction,
+        "endo",
+        np.where(position < endo_fraction + m_fraction, "m", "epi"),
+    )
+    strips_shape = [1]*len(shape)
+    strips_shape[axis] = num_nodes
+    return np.broadcast_to(strips.reshape(strips_shape), shape).copy()
+
+
+def node_parameters(cell_model: CellModel, cell_types: npt.NDArray[np.str_]) -> Any:
+    """Stacked parameters (see CellModel.stack_parameters) for the nodes of a tissue with the
+    :param cell_types: given. The parameters of each cell type are only computed once."""
+    unique_types, node_type = np.unique(cell_types.ravel(), return_inverse=True)
+    params = cell_model.stack_parameters(
+        [cell_model.parameters(cell_type=cell_type) for cell_type in unique_types]
+    )
+    return type(params)(*(np.asarray(field)[node_type] for field in params))
+
+
+def laplacian(shape: Tuple[int, ...], dx: float) -> "sparse.csc_matrix":
+    """Discrete laplacian of a cable or sheet of the :param shape: given, with nodes separated by
+    :param dx: and no flux through the boundaries. Nodes are numbered in C order."""
+    from scipy import sparse
+
+    def second_difference(num_nodes: int) -> sparse.csc_matrix:
+        diagonal = np.full(num_nodes, -2.)
+        diagonal[[0, -1]] = -1.
+        return sparse.diags(
+            [np.ones(num_nodes - 1), diagonal, np.ones(num_nodes - 1)],
+            offsets=[-1, 0, 1],
+            format="csc",
+        )
+    operator = sparse.csc_matrix((1, 1))
+    for dim, num_nodes in enumerate(shape):
+        identity_before = sparse.identity(int(np.prod(shape[:dim])), format="csc")
+        identity_after = sparse.identity(int(np.prod(shape[dim + 1:])), format="csc")
+        term = sparse.kron(
+            sparse.kron(identity_before, second_difference(num_nodes)), identity_after
+        )
+        operator = term if dim == 0 else operator + term
+    return sparse.csc_matrix(operator) / dx**2
+
+
+def diffusion_solver(
+    tissue: Tissue,
+    dt: float,
+) -> Callable[[npt.NDArray[np.float_]], npt.NDArray[np.float_]]:
+    """Function that takes the potential of the nodes of :param tissue: and returns it after a
+    backward Euler step of length :param dt: of the diffusion term."""
+    from scipy import sparse
+    from scipy.sparse.linalg import cg, factorized
+
+    matrix = (
+        sparse.identity(tissue.num_nodes, format="csc") -
+        dt*tissue.diffusion*laplacian(tissue.shape, tissue.dx)
+    )
+    if len(tissue.shape) == 1:
+        return factorized(sparse.csc_matrix(matrix))
+    matrix = sparse.csr_matrix(matrix)
+    # SciPy 1.12 renamed the relative tolerance of cg from tol to rtol and 1.14 dropped tol
+    tolerance = {
+        "rtol" if "rtol" in inspect.signature(cg).parameters else "tol": DIFFUSION_RTOL
+    }
+
+    def solve(potential: npt.NDArray[np.float_]) -> npt.NDArray[np.float_]:
+        solution, info = cg(matrix, potential, x0=potential, **tolerance)
+        if info != 0:
+            raise RuntimeError("Conjugate gradients did not converge in the diffusion step")
+        return solution
+    return solve
+
+
+def edge_stimulus_mask(shape: Tuple[int, ...], width: int) -> npt.NDArray[np.bool_]:
+    """Nodes within :param width: nodes of the start of the last axis of a tissue, e.g. the left
+    edge of a sheet, where plane waves are usually started."""
+    mask = np.zeros(shape, dtype=bool)
+    mask[..., :width] = True
+    return mask
+
+
+def simulate_tissue(
+    cell_model: CellModel,
+    tissue: Tissue,
+    duration: float,
+    protocol: Optional[PacingProtocol] = None,
+    stimulus_mask: Optional[npt.NDArray[np.bool_]] = None,
+    stimulus: Optional[Stimulus] = None,
+    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
+    dt: float = 0.05,
+    save_interval: float = 1.,
+    activation_threshold: float = 0.5,
+    backend: str = "numpy",
+) -> TissueSolution:
+    """Simulate :param tissue: for :param duration: milliseconds.
+    :param protocol: times at which the tissue is stimulated, defaults to a single stimulus at the
+    start of the simulation.
+    :param stimulus_mask: nodes that receive the stimulus, defaults to the 5 nodes closest to the
+    start of the last axis (see edge_stimulus_mask).
+    :param stimulus: pulse applied at each stimulus time, defaults to the stimulus of the model.
+    :param initial_conditions: state of the nodes, either shared by all nodes with shape
+    (num_state_vars,) or with shape (num_state_vars, *tissue.shape). Defaults to the initial
+    conditions of the model.
+    :param dt: time step of the splitting scheme.
+    :param save_interval: interval between the stored values of the action potential.
+    :param activation_threshold: value of the action potential state variable that marks the
+    activation of a node when crossed upwards.
+    :param backend: backend used to evaluate the cell model, see solve_cycle.
+    """
+    protocol = protocol or PacingProtocol.from_times([0.], end_time=duration)
+    stimulus_mask = (
+        stimulus_mask if stimulus_mask is not None else edge_stimulus_mask(tissue.shape, width=5)
+    ).ravel()
+    train = protocol.stimulus_train(stimulus or cell_model.STIMULUS)
+    # The stimulus is applied only to some nodes, so it is added outside the cell model
+    no_stimulus = Stimulus(amplitude=0.)
+    params = node_parameters(cell_model=cell_model, cell_types=tissue.cell_types)
+    num_state_vars = len(cell_model.STATE_VARS_NAMES)
+    state = np.array(np.broadcast_to(
+        np.reshape(
+            initial_conditions if initial_conditions is not None
+            else cell_model.INITIAL_CONDITIONS,
+            (num_state_vars, -1),
+        ),
+        (num_state_vars, tissue.num_nodes),
+    ))
+    ap_index = cell_model.AP_INDEX
+    solve_diffusion = diffusion_solver(tissue=tissue, dt=dt)
+
+    num_steps = int(np.ceil(duration / dt - 1e-9))
+    save_every = max(1, int(round(save_interval / dt)))
+    saved_t = [0.]
+    saved_ap = [state[ap_index].copy()]
+    activation_times = np.full(tissue.num_nodes, np.nan)
+    with click.progressbar(range(num_steps), label="Simulating tissue") as steps:
+        for step in steps:
+            t = step*dt
+            previous_ap = state[ap_index].copy()
+            _, this_y = rush_larsen(
+                cell_model=cell_model,
+                t_span=(t, t + dt),
+                y0=state,
+                params=params,
+                dt=dt,
+                stimulus=no_stimulus,
+                backend=backend,
+            )
+            state = this_y[..., -1]
+            state[ap_index, stimulus_mask] += dt*train.current(t)
+            state[ap_index] = solve_diffusion(state[ap_index])
+            # Activation times are interpolated between the steps
+            activated = (
+                (previous_ap < activation_threshold) & (state[ap_index] >= activation_threshold)
+            )
+            fraction = (
+                (activation_threshold - previous_ap[activated]) /
+                (state[ap_index, activated] - previous_ap[activated])
+            )
+            activation_times[activated] = t + fraction*dt
+            if (step + 1) % save_every == 0:
+                saved_t.append(t + dt)
+                saved_ap.append(state[ap_index].copy())
+    return TissueSolution(
+        t=np.array(saved_t),
+        ap_signal=np.array(saved_ap).reshape(-1, *tissue.shape),
+        activation_times=activation_times.reshape(tissue.shape),
+        final_state=state.reshape(num_state_vars, *tissue.shape),
+    )
+
+
+def conduction_velocity(
+    activation_times: npt.NDArray[np.float_],
+    dx: float,
+    margin: float = 0.2,
+) -> float:
+    """Conduction velocity, in mm/ms (i.e. m/s), of a wave travelling along the last axis of a
+    tissue with the :param activation_times: given. The position of the nodes is fitted against
+    their activation time by least squares, leaving out a :param margin: fraction of the nodes at
+    each end to avoid the effects of the stimulus and of the boundary. For a sheet the velocity is
+    the median over its rows. NaN is returned if the wave did not reach enough nodes.
+    """
+    activation_times = np.atleast_2d(activation_times)
+    num_nodes = activation_times.shape[-1]
+    start = int(margin*num_nodes)
+    end = max(start + 2, num_nodes - start)
+    position = dx*np.arange(num_nodes)[start:end]
+    velocities = []
+    for row in activation_times[:, start:end]:
+        reached = np.isfinite(row)
+        if np.count_nonzero(reached) < 2 or np.ptp(row[reached]) == 0:
+            continue
+        slope = np.polyfit(row[reached], position[reached], 1)[0]
+        velocities.append(slope)
+    return float(np.median(velocities)) if velocities else np.nan
+
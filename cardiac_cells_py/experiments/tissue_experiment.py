@@ -0,0 +1,176 @@
+"""Propagate action potentials along a cable or a sheet of cells and measure conduction velocity."""
+import click
+import os
+
+import numpy as np
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.plotting import pyplot
+from cardiac_cells_py.experiments.protocols import PacingProtocol
+from cardiac_cells_py.experiments.tissue import (
+    DEFAULT_DIFFUSION,
+    Tissue,
+    conduction_velocity,
+    simulate_tissue,
+    transmural_cell_types,
+)
+
+
+@click.command()
+@click.argument(
+    "cell_model",
+    type=click.Choice(
+        CellModels.valid_models(),
+        case_sensitive=False
+    )
+)
+@click.argument("outdir", type=click.Path(exists=True))
+@click.option(
+    "--cell-type",
+    default="epi",
+    type=str,
+    help="Cell type of all the nodes. Ignored with --transmural.",
+    show_default=True,
+)
+@click.option(
+    "--transmural",
+    is_flag=True,
+    help="Use strips of endo, m and epi cells, in that order, along the direction of propagation.",
+)
+@click.option(
+    "--num-nodes",
+    default=200,
+    type=click.IntRange(min=2),
+    help="Number of nodes along the direction of propagation.",
+    show_default=True,
+)
+@click.option(
+    "--num-rows",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of rows of nodes. A single row simulates a cable, more simulate a sheet.",
+    show_default=True,
+)
+@click.option(
+    "--dx",
+    default=0.25,
+    type=float,
+    help="Distance between neighbouring nodes in mm.",
+    show_default=True,
+)
+@click.option(
+    "--diffusion",
+    default=DEFAULT_DIFFUSION,
+    type=float,
+    help="Diffusion coefficient in mm^2/ms.",
+    show_default=True,
+)
+@click.option(
+    "--dt",
+    default=0.05,
+    type=float,
+    help="Time step in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--duration",
+    default=400.,
+    type=float,
+    help="Duration of the simulation in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--num-beats",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of stimuli applied to the first nodes of the tissue.",
+    show_default=True,
+)
+@click.option(
+    "--cycle-length",
+    default=1000.,
+    type=float,
+    help="Interval between stimuli in milliseconds.",
+    show_default=True,
+)
+@click.option(
+    "--backend",
+    default="numpy",
+    type=click.Choice(["numpy", "jit"]),
+    help="Backend used to evaluate the cell model.",
+    show_default=True,
+)
+def tissue(
+    cell_model,
+    outdir,
+    cell_type,
+    transmural,
+    num_nodes,
+    num_rows,
+    dx,
+    diffusion,
+    dt,
+    duration,
+    num_beats,
+    cycle_length,
+    backend,
+):
+    """Stimulate one end of a cable or a sheet of cells, follow the propagation of the action
+    potential and report the conduction velocity of the last wave that crossed the tissue.
+
+    \b
+    CELL_MODEL is the cell model to use in the experiment. Must be a supported CellModels.
+    OUTDIR specify an output directory to save plots
+    """
+    model = CellModels[cell_model.upper()].create()
+    shape = (num_nodes,) if num_rows == 1 else (num_rows, num_nodes)
+    tissue_desc = Tissue(
+        cell_types=(
+            transmural_cell_types(shape) if transmural else np.full(shape, cell_type)
+        ),
+        dx=dx,
+        diffusion=diffusion,
+    )
+    solution = simulate_tissue(
+        cell_model=model,
+        tissue=tissue_desc,
+        duration=duration,
+        protocol=PacingProtocol.constant(cycle_length=cycle_length, num_beats=num_beats),
+        dt=dt,
+        backend=backend,
+    )
+    velocity = conduction_velocity(activation_times=solution.activation_times, dx=dx)
+    click.echo(f"Conduction velocity: {velocity:.3f} m/s")
+
+    fig_base = f"tissue_{cell_model}_{'transmural' if transmural else cell_type}_"
+    fig_base += "x".join(str(size) for size in shape)
+    click.echo(f"Saving figures in {outdir}")
+    position = dx*np.arange(num_nodes)
+    plt = pyplot()
+    plt.figure()
+    if num_rows == 1:
+        plt.plot(position, solution.activation_times)
+        plt.xlabel("Position (mm)")
+        plt.ylabel("Activation time (ms)")
+    else:
+        plt.imshow(
+            solution.activation_times,
+            origin="lower",
+            extent=(0, dx*num_nodes, 0, dx*num_rows),
+        )
+        plt.colorbar(label="Activation time (ms)")
+        plt.xlabel("Position (mm)")
+        plt.ylabel("Position (mm)")
+    plt.title("Activation map")
+    plt.savefig(f"{os.path.join(outdir, fig_base)}_activation_map.png")
+
+    plt.figure()
+    nodes = [num_nodes // 4, num_nodes // 2, 3*num_nodes // 4]
+    ap_signal = solution.ap_signal.reshape(len(solution.t), -1, num_nodes)[:, num_rows // 2]
+    for node in nodes:
+        plt.plot(solution.t, ap_signal[:, node], label=f"{position[node]:.1f} mm")
+    plt.title("Action potential along the tissue")
+    plt.xlabel("Time (ms)")
+    plt.ylabel(model.STATE_VARS_NAMES[model.AP_INDEX])
+    plt.legend()
+    plt.savefig(f"{os.path.join(outdir, fig_base)}_action_potentials.png")
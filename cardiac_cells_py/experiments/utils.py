@@ -1,66 +1,76 @@
 """Utility functions used to run experiments."""
-import click
-from typing import Tuple, NamedTuple, Optional
+from typing import Iterable, Iterator, List, Optional, TypeVar, Union
 
 import numpy as np
 import numpy.typing as npt
-from scipy.integrate import solve_ivp
-from cardiac_cells_py import cell_models
 
-from cardiac_cells_py.cell_models.cell_model import CellModel
+from cardiac_cells_py.experiments.profiling import SolverStats
 
+BeatT = TypeVar("BeatT")
 
-class ModelSolution(NamedTuple):
-    """Tuple containing the solution to the PDEs of a cardiac cell model.
-    """
-    # Time
-    t: npt.NDArray[np.float_]
-    # State variables
-    state_vars: npt.NDArray[np.float_]
-    # Resulting currents computed from the state variables
-    currents: npt.NDArray[np.float_]
+
+def beat_has_converged(
+    previous_state: npt.NDArray[np.float_],
+    state: npt.NDArray[np.float_],
+    tolerance: float,
+    previous_apd: Optional[npt.NDArray[np.float_]] = None,
+    apd: Optional[npt.NDArray[np.float_]] = None,
+    apd_tolerance: Optional[float] = None,
+) -> bool:
+    """Whether a cell has reached steady state, i.e. the state variables at the end of two
+    consecutive beats differ by less than :param tolerance: and, if :param apd_tolerance: is
+    given, so do their APD90s. For a population of cells, all cells must have converged."""
+    return bool(np.all(cells_have_converged(
+        previous_state=previous_state,
+        state=state,
+        tolerance=tolerance,
+        previous_apd=previous_apd,
+        apd=apd,
+        apd_tolerance=apd_tolerance,
+    )))
+
+
+def cells_have_converged(
+    previous_state: npt.NDArray[np.float_],
+    state: npt.NDArray[np.float_],
+    tolerance: float,
+    previous_apd: Optional[npt.NDArray[np.float_]] = None,
+    apd: Optional[npt.NDArray[np.float_]] = None,
+    apd_tolerance: Optional[float] = None,
+) -> npt.NDArray[np.bool_]:
+    """Whether each cell of a population has reached steady state, as in beat_has_converged. The
+    states have shape (num_state_vars, num_cells) and the APDs one value per cell."""
+    converged = np.max(np.abs(state - previous_state), axis=0) < tolerance
+    if apd_tolerance is None:
+        return converged
+    if previous_apd is None or apd is None:
+        return np.zeros_like(converged)
+    return converged & (np.abs(apd - previous_apd).reshape(converged.shape) < apd_tolerance)
 
 
-def run_model(
-    cell_model: CellModel,
-    num_cycles: int,
-    cycle_length: int,
-    cell_type: str,
-    initial_conditions: Optional[npt.NDArray[np.float_]] = None,
-) -> ModelSolution:
-    """Solve the partial differential equations of a cell model using the input parameters
-    specified by the user. If no initial conditions are provided, the standard conditions from
-    the model will be used."""
-    t = []
-    state_vars = []
-    currents = []
-    y0 = initial_conditions if initial_conditions is not None else cell_model.INITIAL_CONDITIONS
-    params = cell_model.parameters(cell_type=cell_type)
-    with click.progressbar(
-        range(num_cycles),
-        label="Computing AP signals",
-    ) as cycles:
-        for cycle_num in cycles:
-            this_cycle = solve_ivp(
-                fun=cell_model.cell_model,
-                t_span=(0, cycle_length),
-                y0=y0,
-                args=(params, True),
-                first_step=0.01,
-                max_step=1,
-            )
-            t.append(np.array(this_cycle.t) + cycle_length*cycle_num)
-            state_vars.append(np.array(this_cycle.y))
-            this_currents = cell_model.cell_model(
-                t=this_cycle.t,
-                state_vars=this_cycle.y,
-                params=params,
-                ret_ode=False
-            )
-            y0 = np.array([state_var[-1] for state_var in this_cycle.y])
-            currents.append(this_currents)
-    return ModelSolution(
-        t=np.concatenate(t),
-        state_vars=np.concatenate(state_vars, axis=1).T,
-        currents=np.concatenate(currents, axis=0)
-    )
+def collect_solver_stats(
+    beats: Iterable[BeatT],
+    solver_stats: List[SolverStats],
+) -> Iterator[BeatT]:
+    """Pass :param beats: through unchanged, appending the statistics of the solver over each of
+    them to :param solver_stats:, so that those of the beats that are not kept are not lost."""
+    for beat in beats:
+        solver_stats.extend(getattr(beat, "solver_stats", None) or [])
+        yield beat
+
+
+def retain_beats(beats: Iterable[BeatT], keep: Union[str, int] = "all") -> List[BeatT]:
+    """Consume :param beats: keeping only those required by the retention policy :param keep:,
+    which is "all", "last" or an integer k to keep every k-th beat. The last beat is always kept.
+    """
+    if keep not in ("all", "last") and (not isinstance(keep, int) or keep < 1):
+        raise ValueError(f"Retention policy ({keep}) not recognised")
+    kept: List[BeatT] = []
+    last = None
+    for beat_num, beat in enumerate(beats):
+        if keep == "all" or (isinstance(keep, int) and beat_num % keep == 0):
+            kept.append(beat)
+        last = beat
+    if last is not None and (not kept or kept[-1] is not last):
+        kept.append(last)
+    return kept
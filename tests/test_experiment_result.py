@@ -0,0 +1,52 @@
+"""Tests of the measurements of ExperimentResult on solutions that keep only some of their beats."""
+import numpy as np
+import pytest
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.experiment_result import ExperimentResult
+from cardiac_cells_py.experiments.protocols import run_model
+
+NUM_CYCLES = 5
+CYCLE_LENGTH = 1000
+
+
+@pytest.fixture(scope="module")
+def model():
+    return CellModels.MINIMAL_MODEL.create()
+
+
+@pytest.fixture(scope="module")
+def all_beats(model):
+    return ExperimentResult(
+        model=model,
+        model_solution=run_model(
+            cell_model=model,
+            num_cycles=NUM_CYCLES,
+            cycle_length=CYCLE_LENGTH,
+            cell_type="epi",
+        ),
+        cycle_length=CYCLE_LENGTH,
+        experiment_id="all",
+    )
+
+
+@pytest.mark.parametrize(
+    "keep, kept_beats",
+    [("last", [4]), (1, [0, 1, 2, 3, 4]), (2, [0, 2, 4]), (3, [0, 3, 4])],
+)
+def test_biomarkers_of_kept_beats(model, all_beats, keep, kept_beats):
+    result = ExperimentResult(
+        model=model,
+        model_solution=run_model(
+            cell_model=model,
+            num_cycles=NUM_CYCLES,
+            cycle_length=CYCLE_LENGTH,
+            cell_type="epi",
+            keep=keep,
+        ),
+        cycle_length=CYCLE_LENGTH,
+        experiment_id=str(keep),
+    )
+    expected = all_beats.biomarkers().apd_at(90)[kept_beats]
+    np.testing.assert_allclose(result.biomarkers().apd_at(90), expected)
+    assert result.apd(90) == pytest.approx(all_beats.apd(90))
@@ -0,0 +1,141 @@
+"""Equivalence of the implementations of the minimal model with its reference equations,
+MinimalModel.cell_model without an output buffer."""
+import concurrent.futures
+
+import numpy as np
+import pytest
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.integrators import get_kernels, jit_cell_model, rush_larsen
+from cardiac_cells_py.experiments.jit import JIT_AVAILABLE, params_array
+
+CELL_TYPES = ["endo", "epi", "m"]
+NUM_CELLS = 1000
+# Times at which the stimulus is off and on
+TIMES = [0.5, 10.]
+
+requires_jit = pytest.mark.skipif(not JIT_AVAILABLE, reason="Numba is not installed")
+
+
+@pytest.fixture(scope="module")
+def model():
+    return CellModels.MINIMAL_MODEL.create()
+
+
+@pytest.fixture(scope="module")
+def state_vars():
+    """States of a population of cells covering the whole range of the action potential."""
+    rng = np.random.default_rng(0)
+    return np.stack([rng.uniform(0, 1.6, NUM_CELLS), *rng.uniform(0, 1, (3, NUM_CELLS))])
+
+
+@pytest.mark.parametrize("t", TIMES)
+@pytest.mark.parametrize("cell_type", CELL_TYPES)
+def test_ode_kernel(model, state_vars, cell_type, t):
+    params = model.parameters(cell_type=cell_type)
+    expected = model.cell_model(t, state_vars, params, True)
+    workspace = model.workspace(state_vars.shape[1:])
+    for _ in range(2):
+        out = np.empty_like(state_vars)
+        np.testing.assert_allclose(
+            model.ode_kernel(t, state_vars, params, None, out, workspace),
+            expected,
+            rtol=1e-12,
+            atol=1e-14,
+        )
+    # Without a workspace the kernel allocates its own scratch arrays
+    np.testing.assert_allclose(
+        model.cell_model(t, state_vars, params, True, out=np.empty_like(state_vars)),
+        expected,
+        rtol=1e-12,
+        atol=1e-14,
+    )
+
+
+def test_ode_kernel_from_threads(model, state_vars):
+    """Concurrent calls on populations of the same shape do not share scratch arrays."""
+    params = model.parameters(cell_type="epi")
+    populations = [np.roll(state_vars, shift, axis=1) for shift in range(16)]
+
+    def derivative(population):
+        return model.cell_model(0.5, population, params, True, out=np.empty_like(population))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(derivative, populations))
+    for population, result in zip(populations, results):
+        np.testing.assert_allclose(
+            result, model.cell_model(0.5, population, params, True), rtol=1e-12, atol=1e-14
+        )
+
+
+@pytest.mark.parametrize("t", TIMES)
+@pytest.mark.parametrize("cell_type", CELL_TYPES)
+def test_lookup_tables(model, state_vars, cell_type, t):
+    lut_model = CellModels.MINIMAL_MODEL_LUT.create()
+    params = model.parameters(cell_type=cell_type)
+    expected = model.cell_model(t, state_vars, params, True)
+    for out in (None, np.empty_like(state_vars)):
+        np.testing.assert_allclose(
+            lut_model.cell_model(t, state_vars, params, True, out=out), expected, atol=1e-5
+        )
+    for lut_values, values in zip(
+        lut_model.gate_dynamics(t, state_vars, params), model.gate_dynamics(t, state_vars, params)
+    ):
+        np.testing.assert_allclose(lut_values, values, rtol=1e-4)
+
+
+def test_lookup_tables_population(model, state_vars):
+    """Cells with different parameters are each evaluated with their own parameters."""
+    lut_model = CellModels.MINIMAL_MODEL_LUT.create()
+    base = model.parameters(cell_type="epi")
+    population = [
+        base._replace(tau_so1=base.tau_so1*scale, tau_w1=base.tau_w1*scale)
+        for scale in np.linspace(0.5, 2, NUM_CELLS)
+    ]
+    params = model.stack_parameters(population)
+    np.testing.assert_allclose(
+        lut_model.cell_model(0.5, state_vars, params, True),
+        model.cell_model(0.5, state_vars, params, True),
+        atol=1e-5,
+    )
+
+
+@requires_jit
+@pytest.mark.parametrize("t", TIMES)
+@pytest.mark.parametrize("cell_type", CELL_TYPES)
+def test_jit_cell_model(model, state_vars, cell_type, t):
+    params = model.parameters(cell_type=cell_type)
+    derivative = jit_cell_model(
+        t,
+        state_vars.ravel(),
+        get_kernels(model, "jit"),
+        params_array(params, NUM_CELLS),
+        state_vars.shape,
+        model.STIMULUS,
+    )
+    np.testing.assert_allclose(
+        derivative.reshape(state_vars.shape),
+        model.cell_model(t, state_vars, params, True).T,
+        rtol=1e-12,
+        atol=1e-14,
+    )
+
+
+@requires_jit
+def test_jit_rush_larsen(model):
+    params = model.parameters(cell_type="epi")
+    y0 = np.broadcast_to(model.INITIAL_CONDITIONS[:, np.newaxis], (4, 3)).copy()
+    solutions = [
+        rush_larsen(
+            cell_model=model,
+            t_span=(0., 400.),
+            y0=y0,
+            params=params,
+            dt=0.1,
+            stimulus=model.STIMULUS,
+            backend=backend,
+        )
+        for backend in ("numpy", "jit")
+    ]
+    np.testing.assert_array_equal(solutions[0][0], solutions[1][0])
+    np.testing.assert_allclose(solutions[0][1], solutions[1][1], rtol=1e-9, atol=1e-12)
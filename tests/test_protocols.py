@@ -0,0 +1,150 @@
+"""Tests of the pacing protocols and of the engine that solves them as a single continuous run."""
+import numpy as np
+import pytest
+
+from cardiac_cells_py.cell_models import CellModels
+from cardiac_cells_py.experiments.integrators import solve_cycle
+from cardiac_cells_py.experiments.measurements import elicits_ap, measure_beats
+from cardiac_cells_py.experiments.protocols import PacingProtocol, iter_protocol_beats
+
+CELL_TYPE = "epi"
+
+
+@pytest.fixture(scope="module")
+def model():
+    return CellModels.MINIMAL_MODEL.create()
+
+
+@pytest.mark.parametrize(
+    "protocol, boundaries",
+    [
+        (PacingProtocol.constant(cycle_length=500, num_beats=3), [0, 500, 1000, 1500]),
+        (
+            PacingProtocol.s1s2(s1_cycle_length=500, num_s1=2, s2_interval=300),
+            [0, 500, 800, 1800],
+        ),
+        (
+            PacingProtocol.dynamic(cycle_lengths=[500, 300], beats_per_cycle_length=2),
+            [0, 500, 1000, 1300, 1600],
+        ),
+        (PacingProtocol.from_times([300, 100], end_time=600), [0, 100, 300, 600]),
+    ],
+)
+def test_beat_boundaries(protocol, boundaries):
+    np.testing.assert_array_equal(protocol.beat_boundaries, boundaries)
+    assert protocol.num_beats == len(boundaries) - 1
+
+
+def test_stimulus_times_outside_of_protocol():
+    with pytest.raises(ValueError):
+        PacingProtocol.from_times([100, 700], end_time=600)
+
+
+@pytest.mark.parametrize("method", ["RK45", "BDF", "LSODA"])
+def test_beats_split_at_boundaries(model, method):
+    """Beats start and end exactly at their boundaries, where consecutive beats share their state,
+    whether or not the steps of the solver land on them."""
+    protocol = PacingProtocol.dynamic(cycle_lengths=[400, 250], beats_per_cycle_length=2)
+    beats = list(iter_protocol_beats(
+        cell_model=model,
+        protocol=protocol,
+        cell_type=CELL_TYPE,
+        method=method,
+        keep_dense_output=True,
+    ))
+    boundaries = protocol.beat_boundaries
+    assert [beat.num_cycles for beat in beats] == [1, 2, 3, 4]
+    for beat, start, end in zip(beats, boundaries[:-1], boundaries[1:]):
+        assert beat.t[0] == start and beat.t[-1] == end
+        assert np.all(np.diff(beat.t) > 0)
+        np.testing.assert_allclose(beat.dense_output(beat.t).T, beat.state_vars, atol=1e-12)
+        assert beat.solver_stats[0].num_steps > 0
+    for beat, next_beat in zip(beats[:-1], beats[1:]):
+        np.testing.assert_array_equal(beat.state_vars[-1], next_beat.state_vars[0])
+
+
+def test_steps_end_on_stimulus_edges(model):
+    protocol = PacingProtocol.constant(cycle_length=500, num_beats=2)
+    t = np.concatenate([
+        beat.t for beat in iter_protocol_beats(
+            cell_model=model, protocol=protocol, cell_type=CELL_TYPE, method="BDF"
+        )
+    ])
+    for edge in (model.STIMULUS.duration, 500 + model.STIMULUS.duration):
+        assert edge in t
+
+
+@pytest.mark.parametrize("integrator, method", [
+    ("solve_ivp", "RK45"), ("solve_ivp", "BDF"), ("rush_larsen", "RK45")
+])
+def test_continuous_run_matches_beat_by_beat(model, integrator, method):
+    """A continuous run over a constant protocol agrees with solving each cycle separately."""
+    cycle_length = 500
+    beats = list(iter_protocol_beats(
+        cell_model=model,
+        protocol=PacingProtocol.constant(cycle_length=cycle_length, num_beats=2),
+        cell_type=CELL_TYPE,
+        integrator=integrator,
+        method=method,
+        rtol=1e-6,
+        atol=1e-9,
+    ))
+    params = model.parameters(cell_type=CELL_TYPE)
+    y0 = model.INITIAL_CONDITIONS
+    for beat in beats:
+        t, y = solve_cycle(
+            cell_model=model,
+            cycle_length=cycle_length,
+            y0=y0,
+            params=params,
+            integrator=integrator,
+            method=method,
+            rtol=1e-6,
+            atol=1e-9,
+        )
+        np.testing.assert_allclose(beat.state_vars[-1], y[:, -1], atol=1e-3)
+        apds = [
+            measure_beats(
+                t=beat_t, ap_signal=ap_signal, beat_starts=beat_t[:1], repolarisation_percents=(90,)
+            ).apd_at(90)
+            for beat_t, ap_signal in ((beat.t, beat.state_vars[:, 0]), (t, y[0]))
+        ]
+        np.testing.assert_allclose(apds[0], apds[1], atol=0.5)
+        y0 = y[:, -1]
+
+
+def test_s1s2(model):
+    """An S2 stimulus during the refractory period of the last S1 beat does not elicit an action
+    potential, one after it has repolarised does."""
+    for s2_interval, elicited in ((100, False), (450, True)):
+        beats = list(iter_protocol_beats(
+            cell_model=model,
+            protocol=PacingProtocol.s1s2(
+                s1_cycle_length=500, num_s1=2, s2_interval=s2_interval, s2_cycle_length=500
+            ),
+            cell_type=CELL_TYPE,
+        ))
+        assert len(beats) == 3
+        ap_signals = [beat.state_vars[:, model.AP_INDEX] for beat in beats]
+        amplitude = np.ptp(ap_signals[1])
+        assert elicits_ap(ap_signal=ap_signals[1], reference_amplitude=amplitude)
+        assert elicits_ap(ap_signal=ap_signals[2], reference_amplitude=amplitude) == elicited
+
+
+def test_stop_at_repolarisation(model):
+    """The last beat ends once it has repolarised, with the same APD as the full beat."""
+    protocol = PacingProtocol.constant(cycle_length=1000, num_beats=2)
+    full, stopped = (
+        list(iter_protocol_beats(
+            cell_model=model,
+            protocol=protocol,
+            cell_type=CELL_TYPE,
+            crossing_percents=(90,),
+            stop_at_repolarisation=stop_at_repolarisation,
+        ))
+        for stop_at_repolarisation in (None, 90)
+    )
+    assert len(stopped) == 2
+    assert stopped[0].t[-1] == 1000
+    assert stopped[1].t[-1] < 1500
+    assert stopped[1].crossings.apd_at(90) == pytest.approx(full[1].crossings.apd_at(90))
@@ -0,0 +1,72 @@
+"""Tests of the storage of solutions whose arrays grow as beats are written."""
+import numpy as np
+import pytest
+
+from cardiac_cells_py.experiments.model_solution import ModelSolution
+from cardiac_cells_py.experiments.storage import (
+    MAX_ROWS,
+    SolutionWriter,
+    load_solution,
+    npy_header,
+    save_solution,
+)
+
+
+def make_beat(start: int, num_samples: int) -> ModelSolution:
+    t = np.arange(start, start + num_samples, dtype=np.float_)
+    return ModelSolution(
+        t=t,
+        state_vars=np.stack([t, 2*t, 3*t, 4*t], axis=-1),
+        currents=np.stack([-t, -2*t, -3*t], axis=-1),
+    )
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_shape_growing_by_orders_of_magnitude(tmp_path, dtype):
+    sizes = [1, 10, 100, 1000, 10000, 100000]
+    beats = [make_beat(int(sum(sizes[:num])), size) for num, size in enumerate(sizes)]
+    with SolutionWriter(str(tmp_path), cycle_length=1, dtype=dtype) as writer:
+        for beat in beats:
+            writer.write(beat)
+    solution = load_solution(str(tmp_path))
+    assert solution.state_vars.shape == (sum(sizes), 4)
+    assert solution.currents.shape == (sum(sizes), 3)
+    for name in ("t", "state_vars", "currents"):
+        np.testing.assert_array_equal(
+            getattr(solution, name),
+            np.concatenate([getattr(beat, name) for beat in beats]).astype(dtype),
+        )
+
+
+def test_reserved_header_fits_any_number_of_rows():
+    size = len(npy_header(np.dtype("float64"), (MAX_ROWS, 4)))
+    assert size % 64 == 0
+    for rows in (0, 1, 10**6, 10**12, MAX_ROWS):
+        assert len(npy_header(np.dtype("float64"), (rows, 4), size)) == size
+
+
+def test_times_are_stored_in_double_precision(tmp_path):
+    beat = make_beat(10**6, 100)
+    beat = beat._replace(t=10**6 + 0.01*np.arange(100))
+    save_solution(str(tmp_path), beat, dtype="float32")
+    solution = load_solution(str(tmp_path))
+    assert solution.t.dtype == np.float64
+    assert solution.state_vars.dtype == np.float32
+    np.testing.assert_array_equal(solution.t, beat.t)
+
+
+def test_resampled_grid_is_uniform_across_beats(tmp_path):
+    cycle_length, dt = 1000, 0.3
+    with SolutionWriter(str(tmp_path), cycle_length=cycle_length, resample_dt=dt) as writer:
+        for beat_num in range(3):
+            t = cycle_length*beat_num + np.linspace(0, cycle_length, 101)
+            writer.write(ModelSolution(
+                t=t, state_vars=np.stack([t, t], axis=-1), currents=t[:, np.newaxis]
+            ))
+    solution = load_solution(str(tmp_path))
+    steps = np.diff(solution.t)
+    # Only the last step, to the end of the solution, may be shorter
+    np.testing.assert_allclose(steps[:-1], dt)
+    assert 0 < steps[-1] <= dt + 1e-9
+    assert solution.t[-1] == 3*cycle_length
+    np.testing.assert_allclose(solution.state_vars[:, 0], solution.t)